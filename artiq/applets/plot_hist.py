@@ -4,7 +4,7 @@ import PyQt6    # make sure pyqtgraph imports Qt6
 from PyQt6.QtCore import QTimer
 import pyqtgraph
 
-from artiq.applets.simple import TitleApplet
+from artiq.applets.simple import TitleApplet, DatasetBuffer, get_dataset_changes
 
 
 class HistogramPlot(pyqtgraph.PlotWidget):
@@ -14,6 +14,9 @@ class HistogramPlot(pyqtgraph.PlotWidget):
         self.timer = QTimer()
         self.timer.setSingleShot(True)
         self.timer.timeout.connect(self.length_warning)
+        self.curve = None
+        self.x = DatasetBuffer()
+        self.y = DatasetBuffer()
 
     def data_changed(self, value, metadata, persist, mods, title):
         try:
@@ -25,17 +28,31 @@ class HistogramPlot(pyqtgraph.PlotWidget):
         except KeyError:
             return
         if x is None:
-            x = list(range(len(y)+1))
+            x = range(len(y)+1)
 
         if len(y) and len(x) == len(y) + 1:
             self.timer.stop()
-            self.clear()
-            self.plot(x, y, stepMode=True, fillLevel=0,
-                      brush=(0, 0, 255, 150))
+            changes = get_dataset_changes(mods)
+            if changes is None or self.curve is None:
+                self.x.set(x)
+                self.y.set(y)
+                self.clear()
+                self.curve = self.plot(self.x.array, self.y.array,
+                                       stepMode=True, fillLevel=0,
+                                       brush=(0, 0, 255, 150))
+            else:
+                self.y.update(y, changes.get(self.args.y))
+                if self.args.x is None:
+                    if len(self.x) != len(x):
+                        self.x.set(x)
+                else:
+                    self.x.update(x, changes.get(self.args.x))
+                self.curve.setData(self.x.array, self.y.array)
             self.setTitle(title)
         else:
             if not self.timer.isActive():
                 self.timer.start(1000)
+            self.curve = None
 
     def length_warning(self):
         self.clear()
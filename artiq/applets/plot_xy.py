@@ -5,7 +5,7 @@ import PyQt6  # make sure pyqtgraph imports Qt6
 from PyQt6.QtCore import QTimer
 import pyqtgraph
 
-from artiq.applets.simple import TitleApplet
+from artiq.applets.simple import TitleApplet, DatasetBuffer, get_dataset_changes
 
 
 class XYPlot(pyqtgraph.PlotWidget):
@@ -18,6 +18,14 @@ class XYPlot(pyqtgraph.PlotWidget):
         self.mismatch = {'X values': False,
                          'Error bars': False,
                          'Fit values': False}
+        # Plot items and NumPy copies of the datasets, updated incrementally
+        # while the plot stays valid.
+        self.points = None
+        self.errbars = None
+        self.fit_curve = None
+        self.x = DatasetBuffer()
+        self.y = DatasetBuffer()
+        self.error = DatasetBuffer()
 
     def data_changed(self, value, metadata, persist, mods, title):
         try:
@@ -25,8 +33,9 @@ class XYPlot(pyqtgraph.PlotWidget):
         except KeyError:
             return
         x = value.get(self.args.x)
-        if x is None:
-            x = np.arange(len(y))
+        implicit_x = x is None
+        if implicit_x:
+            x = range(len(y))
         error = value.get(self.args.error)
         fit = value.get(self.args.fit)
 
@@ -53,24 +62,79 @@ class XYPlot(pyqtgraph.PlotWidget):
         else:
             if not self.timer.isActive():
                 self.timer.start(1000)
+            # The buffers miss these mods, redraw everything next time.
+            self.points = None
             return
 
+        changes = get_dataset_changes(mods)
+        if changes is None or self.points is None:
+            self._set_full_data(x, y, error, fit, title)
+            return
+
+        def change(key):
+            return changes.get(key) if key is not None else None
+
+        x_change = change(self.args.x)
+        error_change = change(self.args.error)
+        fit_change = change(self.args.fit)
+        if ((error is None) != (self.errbars is None)
+                or (fit is None) != (self.fit_curve is None)
+                or (error_change is not None and error_change.replaced
+                    and not hasattr(error, "__len__"))):
+            self._set_full_data(x, y, error, fit, title)
+            return
+
+        start = len(self.y)
+        appended = self.y.update(y, change(self.args.y))
+        if implicit_x:
+            if len(self.x) > len(y):
+                self.x.set(x)
+            else:
+                self.x.extend(x[len(self.x):])
+        else:
+            appended &= self.x.update(x, x_change)
+        if appended:
+            if len(self.y) > start:
+                self.points.addPoints(x=self.x.array[start:],
+                                      y=self.y.array[start:])
+        else:
+            self.points.setData(x=self.x.array, y=self.y.array)
+        if error is not None:
+            if hasattr(error, "__len__"):
+                self.error.update(error, error_change)
+                error = self.error.array
+            self.errbars.setData(x=self.x.array, y=self.y.array, height=error)
+        if fit is not None and (fit_change is not None or not appended):
+            xi = np.argsort(self.x.array)
+            self.fit_curve.setData(self.x.array[xi], np.asarray(fit)[xi])
+        self.setTitle(title)
+
+    def _set_full_data(self, x, y, error, fit, title):
+        self.x.set(x)
+        self.y.set(y)
         self.clear()
-        self.plot(x, y, pen=None, symbol="x")
+        self.points = pyqtgraph.ScatterPlotItem(
+            x=self.x.array, y=self.y.array, symbol="x", size=10,
+            pen=(200, 200, 200), brush=(50, 50, 150))
+        self.addItem(self.points)
         self.setTitle(title)
+        self.errbars = None
         if error is not None:
             # See https://github.com/pyqtgraph/pyqtgraph/issues/211
-            if hasattr(error, "__len__") and not isinstance(error, np.ndarray):
-                error = np.array(error)
-            errbars = pyqtgraph.ErrorBarItem(
-                x=np.array(x), y=np.array(y), height=error)
-            self.addItem(errbars)
+            if hasattr(error, "__len__"):
+                self.error.set(error)
+                error = self.error.array
+            self.errbars = pyqtgraph.ErrorBarItem(
+                x=self.x.array, y=self.y.array, height=error)
+            self.addItem(self.errbars)
+        self.fit_curve = None
         if fit is not None:
-            xi = np.argsort(x)
-            self.plot(x[xi], fit[xi])
+            xi = np.argsort(self.x.array)
+            self.fit_curve = self.plot(self.x.array[xi], np.asarray(fit)[xi])
 
     def length_warning(self):
         self.clear()
+        self.points = None
         text = "⚠️ dataset lengths mismatch:\n"
         errors = ', '.join([k for k, v in self.mismatch.items() if v])
         text = ' '.join([errors, "should have the same length as Y values"])
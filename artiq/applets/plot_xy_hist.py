@@ -1,22 +1,18 @@
 #!/usr/bin/env python3
 
 import numpy as np
-from PyQt6 import QtWidgets
+from PyQt6 import QtCore, QtWidgets
 from PyQt6.QtCore import QTimer
 import pyqtgraph
 
-from artiq.applets.simple import SimpleApplet
+from artiq.applets.simple import SimpleApplet, get_dataset_changes
 
 
 def _compute_ys(histogram_bins, histograms_counts):
-        bin_centers = np.empty(len(histogram_bins)-1)
-        for i in range(len(bin_centers)):
-            bin_centers[i] = (histogram_bins[i] + histogram_bins[i+1])/2
-
-        ys = np.empty(histograms_counts.shape[0])
-        for n, counts in enumerate(histograms_counts):
-            ys[n] = sum(bin_centers*counts)/sum(counts)
-        return ys
+    histogram_bins = np.asarray(histogram_bins)
+    histograms_counts = np.asarray(histograms_counts)
+    bin_centers = (histogram_bins[:-1] + histogram_bins[1:])/2
+    return (histograms_counts @ bin_centers)/histograms_counts.sum(axis=-1)
 
 
 # pyqtgraph.GraphicsWindow fails to behave like a regular Qt widget
@@ -36,6 +32,9 @@ class XYHistPlot(QtWidgets.QSplitter):
         self.hist_plot = pyqtgraph.PlotWidget()
         self.insertWidget(1, self.hist_plot)
         self.hist_plot_data = None
+        self.xs = None
+        self.ys = None
+        self.histograms_counts = None
 
         self.args = args
         self.timer = QTimer()
@@ -52,36 +51,30 @@ class XYHistPlot(QtWidgets.QSplitter):
         self.selected_index = None
 
         self.histogram_bins = histogram_bins
+        self.histograms_counts = histograms_counts
 
-        ys = _compute_ys(self.histogram_bins, histograms_counts)
-        self.xy_plot_data = self.xy_plot.plot(x=xs, y=ys,
+        self.xs = np.array(xs, dtype=float)
+        self.ys = _compute_ys(self.histogram_bins, histograms_counts)
+        self.xy_plot_data = self.xy_plot.plot(x=self.xs, y=self.ys,
                                               pen=None,
                                               symbol="x", symbolSize=20)
         self.xy_plot_data.sigPointsClicked.connect(self._point_clicked)
-        for index, (point, counts) in (
-                enumerate(zip(self.xy_plot_data.scatter.points(),
-                              histograms_counts))):
-            point.histogram_index = index
-            point.histogram_counts = counts
 
         text = "click on a data point at the left\n"\
                "to see the corresponding histogram"
         self.hist_plot.addItem(pyqtgraph.TextItem(text))
 
-    def _set_partial_data(self, xs, histograms_counts):
-        ys = _compute_ys(self.histogram_bins, histograms_counts)
-        self.xy_plot_data.setData(x=xs, y=ys,
-                                  pen=None,
-                                  symbol="x", symbolSize=20)
-        for index, (point, counts) in (
-                enumerate(zip(self.xy_plot_data.scatter.points(),
-                              histograms_counts))):
-            point.histogram_index = index
-            point.histogram_counts = counts
-
-    def _point_clicked(self, data_item, spot_items):
-        spot_item = spot_items[0]
-        position = spot_item.pos()
+    def _set_partial_data(self, xs, histograms_counts, rows):
+        self.histograms_counts = histograms_counts
+        self.xs[rows] = np.asarray(xs)[rows]
+        self.ys[rows] = _compute_ys(self.histogram_bins,
+                                    histograms_counts[rows])
+        self.xy_plot_data.setData(x=self.xs, y=self.ys)
+        if self.selected_index is not None and self.selected_index in rows:
+            self._show_histogram(self.selected_index)
+
+    def _show_histogram(self, index):
+        position = QtCore.QPointF(self.xs[index], self.ys[index])
         if self.arrow is None:
             self.arrow = pyqtgraph.ArrowItem(
                 angle=-120, tipAngle=30, baseAngle=20, headLen=40,
@@ -91,38 +84,52 @@ class XYHistPlot(QtWidgets.QSplitter):
             self.xy_plot.addItem(self.arrow)
         else:
             self.arrow.setPos(position)
-        self.selected_index = spot_item.histogram_index
+        self.selected_index = index
 
+        counts = self.histograms_counts[index]
         if self.hist_plot_data is None:
             self.hist_plot.clear()
             self.hist_plot_data = self.hist_plot.plot(
                 x=self.histogram_bins,
-                y=spot_item.histogram_counts,
+                y=counts,
                 stepMode=True, fillLevel=0,
                 brush=(0, 0, 255, 150))
         else:
             self.hist_plot_data.setData(x=self.histogram_bins,
-                                        y=spot_item.histogram_counts)
+                                        y=counts)
 
-    def _can_use_partial(self, mods):
-        if self.hist_plot_data is None:
-            return False
-        for mod in mods:
-            if mod["action"] != "setitem":
-                return False
-            if mod["path"] == [self.args.xs, 1]:
-                if mod["key"] == self.selected_index:
-                    return False
-            elif mod["path"][:2] == [self.args.histograms_counts, 1]:
-                if len(mod["path"]) > 2:
-                    index = mod["path"][2]
-                else:
-                    index = mod["key"]
-                if index == self.selected_index:
-                    return False
-            else:
-                return False
-        return True
+    def _point_clicked(self, data_item, spot_items):
+        self._show_histogram(spot_items[0].index())
+
+    def _changed_rows(self, mods):
+        """Return the indices of the points changed by the mods, or ``None``
+        if the plot must be redrawn entirely."""
+        if self.xy_plot_data is None:
+            return None
+        changes = get_dataset_changes(mods)
+        if changes is None:
+            return None
+        all_rows = np.arange(len(self.xs))
+        rows = []
+        for key, change in changes.items():
+            if key == self.args.histogram_bins:
+                if change.value_changed:
+                    return None
+            elif key in (self.args.xs, self.args.histograms_counts):
+                if change.replaced or change.appended:
+                    return None
+                for index in change.mutated:
+                    if isinstance(index, tuple):
+                        # multi-dimensional slicing, points are along the
+                        # first dimension
+                        index = index[0]
+                    try:
+                        rows.append(np.atleast_1d(all_rows[index]))
+                    except (TypeError, IndexError):
+                        return None
+        if not rows:
+            return np.empty(0, dtype=int)
+        return np.unique(np.concatenate(rows))
 
     def data_changed(self, value, metadata, persist, mods):
         try:
@@ -142,13 +149,15 @@ class XYHistPlot(QtWidgets.QSplitter):
         if any(self.mismatch.values()):
             if not self.timer.isActive():
                 self.timer.start(1000)
+            self.xy_plot_data = None
             return
         else:
             self.timer.stop()
-        if self._can_use_partial(mods):
-            self._set_partial_data(xs, histograms_counts)
-        else:
+        rows = self._changed_rows(mods)
+        if rows is None:
             self._set_full_data(xs, histogram_bins, histograms_counts)
+        else:
+            self._set_partial_data(xs, histograms_counts, rows)
 
     def length_warning(self):
         self.xy_plot.clear()
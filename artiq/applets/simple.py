@@ -4,6 +4,7 @@ import asyncio
 import os
 import string
 
+import numpy as np
 from qasync import QEventLoop, QtWidgets, QtCore
 
 from sipyco.sync_struct import Subscriber, process_mod
@@ -12,6 +13,8 @@ from sipyco import pyon
 from sipyco.pipe_ipc import AsyncioChildComm
 
 from artiq.language.scan import ScanObject
+from artiq.master.worker_db import extend_slice
+from artiq.gui.shared_arrays import SharedArrayMapper
 
 
 logger = logging.getLogger(__name__)
@@ -114,6 +117,153 @@ class AppletRequestRPC(_AppletRequestInterface):
         self._background(self.dataset_ctl.update, mod)
 
 
+class DatasetChange:
+    """Changes made to the value of a dataset by a list of mods, as returned
+    by :func:`get_dataset_changes`.
+
+    Appended and mutated elements should be read from the current value of
+    the dataset: mutated indices refer to positions in the current value.
+    """
+    def __init__(self):
+        #: The value was set again, or modified in a way (e.g. insertion)
+        #: that is not described by the other attributes.
+        self.replaced = False
+        #: Number of elements appended to the value.
+        self.appended = 0
+        #: List of the indices (integers or slices) of the elements of the
+        #: value that were set.
+        self.mutated = []
+
+    @property
+    def value_changed(self):
+        return self.replaced or bool(self.appended) or bool(self.mutated)
+
+
+def get_dataset_changes(mods):
+    """Summarize the changes made by a list of mods, such as those passed to
+    the ``data_changed`` method of applets, so that applets can update their
+    display incrementally.
+
+    :return: a dictionary mapping the keys of the modified datasets to
+        :class:`DatasetChange` objects, or ``None`` if all datasets were
+        replaced (initial mod).
+    """
+    changes = dict()
+    for mod in mods:
+        if mod["action"] == "init":
+            return None
+        path = mod["path"]
+        if not path:
+            key = mod["key"]
+            path = [key]
+            if mod["action"] == "setitem":
+                mod = {"action": "setitem", "path": [key], "key": 1,
+                       "value": None}
+        else:
+            key = path[0]
+        change = changes.setdefault(key, DatasetChange())
+        if len(path) == 1:
+            # persist flag, value and metadata of the dataset
+            if mod["action"] != "setitem" or mod["key"] == 1:
+                change.replaced = True
+        elif path[1] != 1:
+            # metadata
+            pass
+        elif len(path) > 2:
+            change.mutated.append(path[2])
+        elif mod["action"] == "append":
+            change.appended += 1
+        elif mod["action"] == "setitem":
+            if mod["key"] == extend_slice:
+                change.appended += len(mod["value"])
+            else:
+                change.mutated.append(mod["key"])
+        else:
+            change.replaced = True
+    return changes
+
+
+class DatasetBuffer:
+    """One-dimensional NumPy copy of a dataset value, updated incrementally
+    from the changes of the dataset.
+
+    Elements are stored in a preallocated array that grows geometrically,
+    so that appending elements one by one takes amortized constant time.
+    """
+    def __init__(self, dtype=float):
+        self._buffer = np.empty(0, dtype)
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def array(self):
+        """View of the elements of the buffer."""
+        return self._buffer[:self._length]
+
+    def _reserve(self, length):
+        if length > len(self._buffer):
+            buffer = np.empty(max(16, 2*length), self._buffer.dtype)
+            buffer[:self._length] = self.array
+            self._buffer = buffer
+
+    def set(self, value):
+        """Replace the contents of the buffer with the given value."""
+        value = np.asarray(value, self._buffer.dtype)
+        if value.ndim != 1:
+            raise ValueError("dataset value is not one-dimensional")
+        self._length = 0
+        self._reserve(len(value))
+        self._buffer[:len(value)] = value
+        self._length = len(value)
+
+    def extend(self, values):
+        """Append elements to the buffer."""
+        values = np.asarray(values, self._buffer.dtype)
+        length = self._length + len(values)
+        self._reserve(length)
+        self._buffer[self._length:length] = values
+        self._length = length
+
+    def update(self, value, change):
+        """Update the buffer to the current value of a dataset.
+
+        :param change: :class:`DatasetChange` of the dataset since the last
+            update, or ``None`` if unknown.
+        :return: ``True`` if the elements already in the buffer were left
+            unchanged, i.e. elements were only appended, ``False`` if the
+            buffer was modified in another way.
+        """
+        if change is None or change.replaced:
+            self.set(value)
+            return False
+        if len(value) != self._length + change.appended:
+            self.set(value)
+            return False
+        if change.appended:
+            self.extend(value[self._length:])
+        if change.mutated:
+            try:
+                for index in change.mutated:
+                    self.array[index] = value[index]
+            except (TypeError, ValueError, IndexError):
+                self.set(value)
+            return False
+        return True
+
+
+def _unshare_target(data, mod):
+    # Arrays mapped from shared memory are read-only and shared with other
+    # applets: copy them before modifying them.
+    path = mod["path"]
+    if len(path) >= 2 and path[1] == 1:
+        key = path[0]
+        persist, value, metadata = data[key]
+        if isinstance(value, np.ndarray) and not value.flags.writeable:
+            data[key] = (persist, value.copy(), metadata)
+
+
 class AppletIPCClient(AsyncioChildComm):
     def set_close_cb(self, close_cb):
         self.close_cb = close_cb
@@ -151,9 +301,15 @@ class AppletIPCClient(AsyncioChildComm):
                     return
                 elif action == "mod":
                     mod = obj["mod"]
+                    if "shared_arrays" in obj:
+                        shared = obj["shared_arrays"]
+                        mod = self.shared_array_mapper.insert(mod, shared)
+                        self.write_pyon({"action": "shared_arrays_mapped",
+                                         "names": [name for _, name, _, _ in shared]})
                     if mod["action"] == "init":
                         data = self.init_cb(mod["struct"])
                     else:
+                        _unshare_target(data, mod)
                         process_mod(data, mod)
                     self.mod_cb(mod)
                 else:
@@ -166,7 +322,9 @@ class AppletIPCClient(AsyncioChildComm):
     def subscribe(self, datasets, init_cb, mod_cb, dataset_prefixes=[], *, loop):
         self.write_pyon({"action": "subscribe",
                          "datasets": datasets,
-                         "dataset_prefixes": dataset_prefixes})
+                         "dataset_prefixes": dataset_prefixes,
+                         "shared_arrays": True})
+        self.shared_array_mapper = SharedArrayMapper()
         self.init_cb = init_cb
         self.mod_cb = mod_cb
         self.listen_task = loop.create_task(self.listen())
@@ -321,11 +479,25 @@ class SimpleApplet:
         else:
             return False
 
+    def subscribed_data(self, data):
+        """Iterate over the subscribed datasets among the given ones, which
+        are all the datasets of the master in standalone mode."""
+        if self.dataset_prefixes:
+            for k, d in data.items():
+                if self.is_dataset_subscribed(k):
+                    yield k, d
+        else:
+            for k in self.datasets:
+                try:
+                    yield k, data[k]
+                except KeyError:
+                    pass
+
     def emit_data_changed(self, data, mod_buffer):
         persist = dict()
         value = dict()
         metadata = dict()
-        for k, d in data.items():
+        for k, d in self.subscribed_data(data):
             persist[k], value[k], metadata[k] = d
         self.main_widget.data_changed(value, metadata, persist, mod_buffer)
 
@@ -419,6 +591,6 @@ class TitleApplet(SimpleApplet):
         persist = dict()
         value = dict()
         metadata = dict()
-        for k, d in data.items():
+        for k, d in self.subscribed_data(data):
             persist[k], value[k], metadata[k] = d
         self.main_widget.data_changed(value, metadata, persist, mod_buffer, title)
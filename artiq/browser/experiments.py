@@ -286,6 +286,10 @@ class LocalDatasetDB:
     def update(self, mod):
         self.dataset_sub.update(mod)
 
+    def update_batch(self, mods):
+        for mod in mods:
+            self.dataset_sub.update(mod)
+
 
 class ExperimentsArea(QtWidgets.QMdiArea):
     def __init__(self, root, dataset_sub):
@@ -304,6 +308,7 @@ class ExperimentsArea(QtWidgets.QMdiArea):
             "get_device": lambda key, resolve_alias=False: {"type": "dummy"},
             "get_dataset": self._ddb.get,
             "update_dataset": self._ddb.update,
+            "update_dataset_batch": self._ddb.update_batch,
         }
 
     def dataset_changed(self, path):
@@ -0,0 +1,174 @@
+"""
+Minimal in-memory ELF manipulation, used to post-process linked kernel
+libraries without spawning external tools.
+"""
+
+import struct
+
+
+class ELFError(Exception):
+    """Raised when a file cannot be processed in-memory; the caller is expected
+    to fall back to the external binutils."""
+
+
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xff00
+SHN_XINDEX = 0xffff
+
+SHT_SYMTAB = 2
+SHT_RELA = 4
+SHT_NOBITS = 8
+SHT_REL = 9
+SHT_DYNSYM = 11
+SHT_SYMTAB_SHNDX = 18
+
+SHF_ALLOC = 0x2
+SHF_INFO_LINK = 0x40
+
+
+class _Layout:
+    def __init__(self, data):
+        if data[:4] != b"\x7fELF":
+            raise ELFError("not an ELF file")
+        if data[4] == 1:
+            self.is64 = False
+        elif data[4] == 2:
+            self.is64 = True
+        else:
+            raise ELFError("unknown ELF class")
+        if data[5] == 1:
+            endian = "<"
+        elif data[5] == 2:
+            endian = ">"
+        else:
+            raise ELFError("unknown ELF data encoding")
+
+        if self.is64:
+            self.ehdr = struct.Struct(endian + "16sHHIQQQIHHHHHH")
+            self.phdr = struct.Struct(endian + "IIQQQQQQ")
+            self.shdr = struct.Struct(endian + "IIQQQQIIQQ")
+            self.sym = struct.Struct(endian + "IBBHQQ")
+            self.sym_shndx_offset = 6
+        else:
+            self.ehdr = struct.Struct(endian + "16sHHIIIIIHHHHHH")
+            self.phdr = struct.Struct(endian + "IIIIIIII")
+            self.shdr = struct.Struct(endian + "IIIIIIIIII")
+            self.sym = struct.Struct(endian + "IIIBBH")
+            self.sym_shndx_offset = 14
+        self.half = struct.Struct(endian + "H")
+
+    def segment_extent(self, data, offset):
+        if self.is64:
+            _, _, p_offset, _, _, p_filesz, _, _ = self.phdr.unpack_from(data, offset)
+        else:
+            _, p_offset, _, _, p_filesz, _, _, _ = self.phdr.unpack_from(data, offset)
+        return p_offset + p_filesz
+
+
+class _Section:
+    def __init__(self, fields):
+        (self.name, self.type, self.flags, self.addr, self.offset, self.size,
+         self.link, self.info, self.addralign, self.entsize) = fields
+
+    def fields(self):
+        return (self.name, self.type, self.flags, self.addr, self.offset, self.size,
+                self.link, self.info, self.addralign, self.entsize)
+
+
+def _align(value, alignment):
+    if alignment <= 1:
+        return value
+    return (value + alignment - 1) // alignment * alignment
+
+
+def strip_debug(data):
+    """Remove debug sections from an ELF file, like ``llvm-strip --strip-debug``.
+
+    Loadable contents are left at their original offsets; the remaining
+    non-loadable sections and the section header table are repacked after them.
+
+    :param data: contents of the ELF file.
+    :return: contents of the stripped ELF file.
+    """
+    layout = _Layout(data)
+    (ident, e_type, e_machine, e_version, e_entry, e_phoff, e_shoff, e_flags,
+     e_ehsize, e_phentsize, e_phnum, e_shentsize, e_shnum, e_shstrndx) = \
+        layout.ehdr.unpack_from(data, 0)
+    if e_shnum == 0 or e_shstrndx >= SHN_LORESERVE:
+        raise ELFError("extended section numbering is not supported")
+    if e_shentsize != layout.shdr.size:
+        raise ELFError("unexpected section header size")
+
+    sections = [_Section(layout.shdr.unpack_from(data, e_shoff + index * e_shentsize))
+                for index in range(e_shnum)]
+    shstrtab = sections[e_shstrndx]
+
+    def section_name(section):
+        start = shstrtab.offset + section.name
+        return data[start:data.index(b"\0", start)]
+
+    removed = set()
+    for index, section in enumerate(sections):
+        if section.type == SHT_SYMTAB_SHNDX:
+            raise ELFError("extended symbol section indices are not supported")
+        if section.flags & SHF_ALLOC:
+            continue
+        if section_name(section).startswith((b".debug", b".zdebug")):
+            removed.add(index)
+    for index, section in enumerate(sections):
+        if section.type in (SHT_REL, SHT_RELA) and section.info in removed:
+            removed.add(index)
+    if not removed:
+        return data
+
+    index_map = {}
+    for index in range(e_shnum):
+        if index not in removed:
+            index_map[index] = len(index_map)
+
+    def remap(index):
+        if index == SHN_UNDEF or index >= SHN_LORESERVE:
+            return index
+        if index in removed:
+            raise ELFError("reference to a removed section")
+        return index_map[index]
+
+    # Everything the loader looks at stays in place.
+    end = max(e_ehsize, e_phoff + e_phnum * e_phentsize)
+    for index in range(e_phnum):
+        end = max(end, layout.segment_extent(data, e_phoff + index * e_phentsize))
+    for section in sections:
+        if section.flags & SHF_ALLOC and section.type != SHT_NOBITS:
+            end = max(end, section.offset + section.size)
+    output = bytearray(data[:end])
+
+    new_sections = []
+    for index, section in enumerate(sections):
+        if index in removed:
+            continue
+        contents = data[section.offset:section.offset + section.size]
+        if section.type in (SHT_SYMTAB, SHT_DYNSYM):
+            contents = bytearray(contents)
+            for offset in range(0, len(contents), layout.sym.size):
+                shndx_offset = offset + layout.sym_shndx_offset
+                shndx, = layout.half.unpack_from(contents, shndx_offset)
+                layout.half.pack_into(contents, shndx_offset, remap(shndx))
+        if index > 0 and not section.flags & SHF_ALLOC and section.type != SHT_NOBITS:
+            section.offset = _align(len(output), section.addralign)
+            output += bytes(section.offset - len(output))
+            output += contents
+        elif section.flags & SHF_ALLOC and section.type != SHT_NOBITS:
+            output[section.offset:section.offset + section.size] = contents
+        section.link = remap(section.link)
+        if section.type in (SHT_REL, SHT_RELA) or section.flags & SHF_INFO_LINK:
+            section.info = remap(section.info)
+        new_sections.append(section)
+
+    e_shoff = _align(len(output), 8 if layout.is64 else 4)
+    output += bytes(e_shoff - len(output))
+    for section in new_sections:
+        output += layout.shdr.pack(*section.fields())
+    layout.ehdr.pack_into(output, 0,
+        ident, e_type, e_machine, e_version, e_entry, e_phoff, e_shoff, e_flags,
+        e_ehsize, e_phentsize, e_phnum, e_shentsize, len(new_sections), remap(e_shstrndx))
+    return bytes(output)
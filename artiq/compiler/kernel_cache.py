@@ -0,0 +1,277 @@
+"""
+The :class:`KernelCache` class implements a persistent, size-bounded,
+content-addressed store of linked kernel libraries.
+
+Cache entries are keyed by a :class:`KernelDigest`, which covers everything
+the compiler looks at after stitching: the stitched typedtree (including
+source locations and inferred types), every host value that would be quoted
+into the kernel, the target description and the code generation parameters.
+Two kernels with equal digests compile to identical libraries, and allocate
+the same object and string identifiers in the embedding map; only the latter
+needs to be replayed on a cache hit.
+"""
+
+import os
+import hashlib
+import tempfile
+import shutil
+
+import numpy
+from pythonparser import ast
+from sipyco import pyon
+
+from artiq import __version__ as artiq_version
+from . import types, builtins, asttyped
+
+
+class KernelDigest:
+    """Hash of a stitched kernel and of all host values it references.
+
+    :param typedtree: the stitched typedtree (after :meth:`Stitcher.finalize`).
+    :param embedding_map: the embedding map produced by stitching.
+    :param target: the :class:`artiq.compiler.targets.Target` to compile for.
+    :param params: additional code generation parameters
+        (e.g. ``ref_period``) that affect the compiled output.
+    """
+    def __init__(self, typedtree, embedding_map, target, **params):
+        self.embedding_map = embedding_map
+        self.stitched_keys = set(embedding_map.object_forward_map.keys())
+        # Objects reachable from quoted values, in visitation order. Objects
+        # stored in the embedding map during compilation are recorded by their
+        # index in this list, since their identity only exists in this process.
+        self.objects = []
+        self._object_indices = {}
+        self._type_printer = types.TypePrinter()
+        self._hash = hashlib.sha256()
+
+        self._write("artiq", artiq_version)
+        self._write("target", type(target).__name__, target.triple, target.data_layout,
+                    sorted(target.features), target.additional_linker_options,
+                    target.subkernel_id)
+        for key in sorted(params):
+            self._write("param", key, params[key])
+        self._visit(typedtree)
+
+        self.hexdigest = self._hash.hexdigest()
+
+    def cacheable(self):
+        # Subkernel compilation depends on argument types inferred while
+        # compiling the caller, which are not recorded in the cache.
+        return not self.embedding_map.subkernels()
+
+    def _write(self, *data):
+        self._hash.update(repr(data).encode())
+        self._hash.update(b"\0")
+
+    def _type(self, typ):
+        return self._type_printer.name(typ)
+
+    def _visit(self, node):
+        if isinstance(node, list):
+            self._write("list", len(node))
+            for elt in node:
+                self._visit(elt)
+            return
+        elif not isinstance(node, ast.AST):
+            self._write("field", node)
+            return
+
+        loc = getattr(node, "loc", None)
+        if loc is not None:
+            self._write(type(node).__name__, loc.source_buffer.name,
+                        loc.line(), loc.column())
+        else:
+            self._write(type(node).__name__)
+
+        for field_name in getattr(node, "_types", ()):
+            self._write("type", field_name, self._type(getattr(node, field_name)))
+        if hasattr(node, "typing_env"):
+            self._write("env", [(name, self._type(node.typing_env[name]))
+                                for name in sorted(node.typing_env)])
+        for attr in ("flags", "remote_fn"):
+            if hasattr(node, attr):
+                value = getattr(node, attr)
+                self._write(attr, sorted(value) if isinstance(value, set) else value)
+
+        for field_name in node._fields:
+            value = getattr(node, field_name)
+            if isinstance(node, asttyped.QuoteT) and field_name == "value":
+                self._value(value, node.type)
+            elif isinstance(value, types.Type):
+                self._write("type", field_name, self._type(value))
+            else:
+                self._visit(value)
+
+    def _value(self, value, typ):
+        typ = typ.find()
+        if types.is_constructor(typ) or types.is_instance(typ) or types.is_module(typ):
+            self._object(value, typ)
+        elif types.is_method(typ):
+            self._value(value.__func__, types.get_method_function(typ))
+            self._value(value.__self__, types.get_method_self(typ))
+        elif types.is_function(typ) or types.is_rpc(typ) or types.is_subkernel(typ) or \
+                types.is_external_function(typ) or types.is_builtin_function(typ):
+            self._function(value)
+        elif isinstance(value, numpy.ndarray):
+            self._write("ndarray", value.dtype.str, value.shape)
+            self._hash.update(numpy.ascontiguousarray(value).tobytes())
+        elif builtins.is_listish(typ) and isinstance(value, list):
+            elt_type = builtins.get_iterable_elt(typ)
+            if builtins.is_int(elt_type) or builtins.is_float(elt_type) or \
+                    builtins.is_bool(elt_type):
+                self._write("list", value)
+            else:
+                self._write("list", len(value))
+                for elt in value:
+                    self._value(elt, elt_type)
+        elif types.is_tuple(typ) and isinstance(value, tuple):
+            self._write("tuple", len(value))
+            for elt, elt_type in zip(value, typ.elts):
+                self._value(elt, elt_type)
+        else:
+            self._write("value", type(value).__name__, value)
+
+    def _function(self, value):
+        key = self.embedding_map.object_reverse_map.get(id(value))
+        function = getattr(value, "host_function", value)
+        try:
+            name = self.embedding_map.function_map.get(function)
+        except TypeError:
+            name = None
+        self._write("function", getattr(function, "__qualname__", repr(function)),
+                    key, name)
+
+    def _object(self, value, typ):
+        index = self._object_indices.get(id(value))
+        if index is not None:
+            self._write("ref", index)
+            return
+        index = len(self.objects)
+        self._object_indices[id(value)] = index
+        self.objects.append(value)
+
+        self._write("object", index, self.embedding_map.object_reverse_map.get(id(value)),
+                    self._type(typ))
+        if types.is_instance(typ):
+            self._write("constant", sorted(getattr(typ, "constant_attributes", ())))
+            if hasattr(typ, "constructor"):
+                self._object(type(value), typ.constructor)
+        for attr in typ.attributes:
+            if attr == "__objectid__":
+                self._write("attr", attr)
+                continue
+            attr_type = typ.attributes[attr]
+            self._write("attr", attr, self._type(attr_type))
+            self._value(getattr(value, attr), attr_type)
+
+    def embedding_delta(self):
+        """Describe the embedding map changes made since stitching, or return
+        ``None`` if they cannot be replayed in another process."""
+        embedding_map = self.embedding_map
+        objects = []
+        for key, obj_ref in embedding_map.object_forward_map.items():
+            if key in self.stitched_keys:
+                continue
+            index = self._object_indices.get(id(obj_ref))
+            if index is None:
+                return None
+            objects.append((key, index))
+        return {
+            "objects": objects,
+            "object_current_key": embedding_map.object_current_key,
+            "strings": [embedding_map.str_reverse_map[str_id]
+                        for str_id in range(len(embedding_map.str_reverse_map))]
+        }
+
+    def replay_embedding_delta(self, delta):
+        """Apply a description returned by :meth:`embedding_delta` to the
+        embedding map of this (equal) kernel."""
+        embedding_map = self.embedding_map
+        for key, index in delta["objects"]:
+            obj_ref = self.objects[index]
+            embedding_map.object_forward_map[key] = obj_ref
+            embedding_map.object_reverse_map[id(obj_ref)] = key
+        embedding_map.object_current_key = delta["object_current_key"]
+        for s in delta["strings"]:
+            embedding_map.store_str(s)
+
+
+class KernelCache:
+    """Persistent store of compiled kernel libraries.
+
+    Each entry is a directory named after the :class:`KernelDigest`, holding
+    the linked library, its stripped counterpart and the embedding map delta.
+    When the total size exceeds ``max_size`` bytes, the least recently used
+    entries are evicted.
+
+    :param path: directory holding the cache; created if necessary.
+    :param max_size: size bound of the cache, in bytes.
+    """
+    def __init__(self, path, max_size=256*1024*1024):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    def _entry_path(self, digest):
+        return os.path.join(self.path, digest.hexdigest)
+
+    def get(self, digest):
+        """Look up a kernel and, on a hit, restore its embedding map.
+
+        :return: a ``(library, stripped_library)`` pair, or ``None``.
+        """
+        entry = self._entry_path(digest)
+        try:
+            with open(os.path.join(entry, "kernel.elf"), "rb") as f:
+                library = f.read()
+            with open(os.path.join(entry, "kernel_stripped.elf"), "rb") as f:
+                stripped_library = f.read()
+            delta = pyon.load_file(os.path.join(entry, "embedding.pyon"))
+        except (OSError, ValueError, SyntaxError):
+            return None
+        digest.replay_embedding_delta(delta)
+        os.utime(entry)
+        return library, stripped_library
+
+    def put(self, digest, library, stripped_library):
+        """Store a compiled kernel. Kernels whose embedding map cannot be
+        replayed are silently not stored."""
+        delta = digest.embedding_delta()
+        if delta is None:
+            return
+        entry = self._entry_path(digest)
+        if os.path.exists(entry):
+            return
+
+        tmp = tempfile.mkdtemp(dir=self.path, prefix=".tmp")
+        try:
+            with open(os.path.join(tmp, "kernel.elf"), "wb") as f:
+                f.write(library)
+            with open(os.path.join(tmp, "kernel_stripped.elf"), "wb") as f:
+                f.write(stripped_library)
+            pyon.store_file(os.path.join(tmp, "embedding.pyon"), delta)
+            os.rename(tmp, entry)
+        except OSError:
+            # Another process may have stored the same kernel concurrently.
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        with os.scandir(self.path) as it:
+            for dirent in it:
+                if dirent.name.startswith(".") or not dirent.is_dir():
+                    continue
+                size = 0
+                for filename in os.listdir(dirent.path):
+                    size += os.path.getsize(os.path.join(dirent.path, filename))
+                entries.append((dirent.stat().st_mtime, size, dirent.path))
+                total_size += size
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total_size -= size
@@ -1,5 +1,7 @@
-import os, sys, tempfile, subprocess, io
-from artiq.compiler import types, ir
+import os, sys, tempfile, subprocess, io, hashlib, threading, time
+from collections import OrderedDict
+from contextlib import contextmanager
+from artiq.compiler import types, ir, elf
 from llvmlite import ir as ll, binding as llvm
 
 llvm.initialize()
@@ -49,6 +51,94 @@ class RunTool:
         for filename in self._tempnames.values():
             os.unlink(filename)
 
+class SymbolizerSession:
+    """
+    A long-lived ``llvm-symbolizer`` process, started on first use, that
+    answers address lookups for any number of libraries without spawning
+    a process per lookup.
+    """
+    def __init__(self, tool):
+        self._tool = tool
+        self._process = None
+        self._tempdir = None
+        self._filenames = {}
+        self._lock = threading.Lock()
+
+    def _start(self):
+        self._tempdir = tempfile.TemporaryDirectory(prefix="artiq_symbolizer_")
+        self._filenames = {}
+        # https://bugs.python.org/issue17023
+        windows = os.name == "nt"
+        # The LLVM output style terminates each response with an empty line.
+        self._process = subprocess.Popen(
+            [self._tool, "--addresses", "--functions", "--inlines", "--demangle",
+             "--output-style=LLVM"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, bufsize=1, shell=windows)
+
+    def close(self):
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+            self._process.wait()
+            self._process = None
+        if self._tempdir is not None:
+            self._tempdir.cleanup()
+            self._tempdir = None
+
+    def _library_filename(self, library):
+        # llvm-symbolizer caches objects by file name, so each distinct
+        # library gets its own file for the lifetime of the session.
+        digest = hashlib.sha1(library).hexdigest()
+        if digest not in self._filenames:
+            filename = os.path.join(self._tempdir.name, digest + ".elf")
+            with open(filename, "wb") as f:
+                f.write(library)
+            self._filenames[digest] = filename
+        return self._filenames[digest]
+
+    def _read_response(self):
+        response = []
+        while True:
+            line = self._process.stdout.readline()
+            if line == "":
+                raise OSError("{} exited unexpectedly".format(self._tool))
+            line = line.rstrip("\n")
+            if line == "":
+                return response
+            response.append(line)
+
+    def symbolize(self, library, addresses):
+        """Look up the given addresses (as hexadecimal strings) and return
+        the output in the format of ``--output-style=GNU``."""
+        with self._lock:
+            try:
+                if self._process is None:
+                    self._start()
+                filename = self._library_filename(library)
+                lines = []
+                for address in addresses:
+                    self._process.stdin.write("\"{}\" {}\n".format(filename, address))
+                    self._process.stdin.flush()
+                    response = self._read_response()
+                    # Drop the column of the locations, which GNU style omits.
+                    response[2::2] = [location.rsplit(":", 1)[0]
+                                      for location in response[2::2]]
+                    lines += response
+                return lines
+            except OSError:
+                self.close()
+                raise
+
+_symbolizer_sessions = {}
+
+def get_symbolizer_session(tool):
+    if tool not in _symbolizer_sessions:
+        _symbolizer_sessions[tool] = SymbolizerSession(tool)
+    return _symbolizer_sessions[tool]
+
 def _dump(target, kind, suffix, content):
     if target is not None:
         print("====== {} DUMP ======".format(kind.upper()), file=sys.stderr)
@@ -81,6 +171,9 @@ class Target:
         provided by the target, e.g. ``"printf"``.
     :var now_pinning: (boolean)
         Whether the target implements the now-pinning RTIO optimization.
+    :var timings: (dict of string to float)
+        Time spent in each compilation stage by this target instance,
+        in seconds, in the order the stages were first entered.
     """
     triple = "unknown"
     data_layout = ""
@@ -97,6 +190,16 @@ class Target:
     def __init__(self, subkernel_id=None):
         self.llcontext = ll.Context()
         self.subkernel_id = subkernel_id
+        self.timings = OrderedDict()
+
+    @contextmanager
+    def timed(self, stage):
+        """Accumulate the time spent in the ``with`` block into :attr:`timings`."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0.0) + time.monotonic() - start
 
     def target_machine(self):
         lltarget = llvm.Target.from_triple(self.triple)
@@ -139,7 +242,14 @@ class Target:
         llpassmgr.run(llmodule)
 
     def compile(self, module):
-        """Compile the module to a relocatable object for this target."""
+        """Compile the module to an optimized LLVM module for this target."""
+        return self.compile_llvm_ir(self.emit_llvm_ir(module))
+
+    def emit_llvm_ir(self, module):
+        """Generate the LLVM IR of the module, as assembly.
+
+        This is the last stage that accesses host objects (via the embedding map);
+        the result can be handed over to :meth:`compile_llvm_ir` in another thread."""
 
         if os.getenv("ARTIQ_DUMP_SIG"):
             print("====== MODULE_SIGNATURE DUMP ======", file=sys.stderr)
@@ -149,43 +259,70 @@ class Target:
             ir.BasicBlock._dump_loc = False
 
         type_printer = types.TypePrinter()
-        suffix = "_subkernel_{}".format(self.subkernel_id) if self.subkernel_id is not None else ""
-        _dump(os.getenv("ARTIQ_DUMP_IR"), "ARTIQ IR", suffix + ".txt",
+        _dump(os.getenv("ARTIQ_DUMP_IR"), "ARTIQ IR", self._dump_suffix() + ".txt",
               lambda: "\n".join(fn.as_entity(type_printer) for fn in module.artiq_ir))
 
-        llmod = module.build_llvm_ir(self)
-
-        try:
-            llparsedmod = llvm.parse_assembly(str(llmod))
-            llparsedmod.verify()
-        except RuntimeError:
-            _dump("", "LLVM IR (broken)", ".ll", lambda: str(llmod))
-            raise
+        with self.timed("IR build"):
+            llmod = module.build_llvm_ir(self)
+
+        # llvmlite can only hand a module over to LLVM as assembly. Serialize
+        # it exactly once, and release the Python-side IR before LLVM builds
+        # its own copy, to bound peak memory for large kernels.
+        with self.timed("serialize"):
+            return str(llmod)
+
+    def compile_llvm_ir(self, llsource):
+        """Parse, verify and optimize LLVM IR produced by :meth:`emit_llvm_ir`."""
+        suffix = self._dump_suffix()
+
+        with self.timed("parse"):
+            try:
+                # Use a private context so that several modules can be compiled
+                # concurrently.
+                llparsedmod = llvm.parse_assembly(llsource, llvm.create_context())
+            except RuntimeError:
+                _dump("", "LLVM IR (broken)", ".ll", lambda: llsource)
+                raise
+        with self.timed("verify"):
+            try:
+                llparsedmod.verify()
+            except RuntimeError:
+                _dump("", "LLVM IR (broken)", ".ll", lambda: llsource)
+                raise
 
         _dump(os.getenv("ARTIQ_DUMP_UNOPT_LLVM"), "LLVM IR (generated)", suffix + "_unopt.ll",
               lambda: str(llparsedmod))
 
-        self.optimize(llparsedmod)
+        with self.timed("optimize"):
+            self.optimize(llparsedmod)
 
         _dump(os.getenv("ARTIQ_DUMP_LLVM"), "LLVM IR (optimized)", suffix + ".ll",
               lambda: str(llparsedmod))
 
         return llparsedmod
 
+    def _dump_suffix(self):
+        if self.subkernel_id is not None:
+            return "_subkernel_{}".format(self.subkernel_id)
+        return ""
+
     def assemble(self, llmodule):
         llmachine = self.target_machine()
 
         _dump(os.getenv("ARTIQ_DUMP_ASM"), "Assembly", ".s",
               lambda: llmachine.emit_assembly(llmodule))
 
+        with self.timed("emit"):
+            llobject = llmachine.emit_object(llmodule)
+
         _dump(os.getenv("ARTIQ_DUMP_OBJ"), "Object file", ".o",
-              lambda: llmachine.emit_object(llmodule))
+              lambda: llobject)
 
-        return llmachine.emit_object(llmodule)
+        return llobject
 
     def link(self, objects):
         """Link the relocatable objects into a shared library for this target."""
-        with RunTool([self.tool_ld, "-shared", "--eh-frame-hdr"] +
+        with self.timed("link"), RunTool([self.tool_ld, "-shared", "--eh-frame-hdr"] +
                      self.additional_linker_options +
                      ["-T" + os.path.join(os.path.dirname(__file__), "kernel.ld")] +
                      ["{{obj{}}}".format(index) for index in range(len(objects))] +
@@ -205,10 +342,15 @@ class Target:
         return self.link([self.assemble(self.compile(module)) for module in modules])
 
     def strip(self, library):
-        with RunTool([self.tool_strip, "--strip-debug", "{library}", "-o", "{output}"],
-                     library=library, output=None) \
-                as results:
-            return results["output"].read()
+        with self.timed("strip"):
+            try:
+                return elf.strip_debug(library)
+            except elf.ELFError:
+                pass
+            with RunTool([self.tool_strip, "--strip-debug", "{library}", "-o", "{output}"],
+                         library=library, output=None) \
+                    as results:
+                return results["output"].read()
 
     def symbolize(self, library, addresses):
         if addresses == []:
@@ -220,48 +362,61 @@ class Target:
         # the backtrace entry should point at.
         last_inlined = None
         offset_addresses = [hex(addr - 1) for addr in addresses]
-        with RunTool([self.tool_symbolizer, "--addresses",  "--functions", "--inlines",
-                      "--demangle", "--output-style=GNU", "--exe={library}"] + offset_addresses,
-                     library=library) \
-                as results:
-            lines = iter(results["__stdout__"].read().rstrip().split("\n"))
-            backtrace = []
-            while True:
-                try:
-                    address_or_function = next(lines)
-                except StopIteration:
-                    break
-                if address_or_function[:2] == "0x":
-                    address  = int(address_or_function[2:], 16) + 1 # remove offset
-                    function = next(lines)
-                    inlined = False
-                else:
-                    address  = backtrace[-1][4] # inlined
-                    function = address_or_function
-                    inlined = True
-                location = next(lines)
-
-                filename, line = location.rsplit(":", 1)
-                if filename == "??" or filename == "<synthesized>":
-                    continue
-                if line == "?":
-                    line = -1
-                else:
-                    line = int(line)
-                # can't get column out of addr2line D:
-                if inlined:
-                    last_inlined.append((filename, line, -1, function, address))
-                else:
-                    last_inlined = []
-                    backtrace.append((filename, line, -1, function, address,
-                                      last_inlined))
-            return backtrace
+        try:
+            lines = get_symbolizer_session(self.tool_symbolizer).symbolize(
+                library, offset_addresses)
+        except OSError:
+            with RunTool([self.tool_symbolizer, "--addresses",  "--functions", "--inlines",
+                          "--demangle", "--output-style=GNU", "--exe={library}"] + offset_addresses,
+                         library=library) \
+                    as results:
+                lines = results["__stdout__"].read().rstrip().split("\n")
+
+        lines = iter(lines)
+        backtrace = []
+        while True:
+            try:
+                address_or_function = next(lines)
+            except StopIteration:
+                break
+            if address_or_function[:2] == "0x":
+                address  = int(address_or_function[2:], 16) + 1 # remove offset
+                function = next(lines)
+                inlined = False
+            else:
+                address  = backtrace[-1][4] # inlined
+                function = address_or_function
+                inlined = True
+            location = next(lines)
+
+            filename, line = location.rsplit(":", 1)
+            if filename == "??" or filename == "<synthesized>":
+                continue
+            if line == "?":
+                line = -1
+            else:
+                line = int(line)
+            # can't get column out of addr2line D:
+            if inlined:
+                last_inlined.append((filename, line, -1, function, address))
+            else:
+                last_inlined = []
+                backtrace.append((filename, line, -1, function, address,
+                                  last_inlined))
+        return backtrace
 
     def demangle(self, names):
-        if not any(names):
+        # Kernel function names are not mangled; only runtime (Rust and C++)
+        # symbols need to go through the demangler.
+        mangled = [i for i, name in enumerate(names) if name.startswith(("_Z", "_R"))]
+        if not mangled:
             return names
-        with RunTool([self.tool_cxxfilt] + names) as results:
-            return results["__stdout__"].read().rstrip().split("\n")
+        with RunTool([self.tool_cxxfilt] + [names[i] for i in mangled]) as results:
+            demangled = results["__stdout__"].read().rstrip().split("\n")
+        names = list(names)
+        for i, name in zip(mangled, demangled):
+            names[i] = name
+        return names
 
 class NativeTarget(Target):
     def __init__(self):
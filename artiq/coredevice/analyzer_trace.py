@@ -0,0 +1,212 @@
+"""
+Indexed, memory-mapped storage of decoded analyzer traces.
+
+An analyzer trace file holds the columns of the decoded messages (see
+:class:`artiq.coredevice.comm_analyzer.DecodedMessages`) sorted by time, the
+permutation grouping them by channel and the times in that order. Opening a
+trace only reads its header: the columns and indices are memory-mapped, and
+:meth:`AnalyzerTrace.get_messages` reads only the messages of the requested
+channel and time window.
+
+Layout of the file (integers are little endian):
+
+* the magic string ``b"ARTIQ analyzer trace\\n"``;
+* the length of the header, on 8 bytes;
+* the header, a PYON-encoded dictionary;
+* the arrays, each aligned to 64 bytes from the start of the data, which is
+  itself aligned to 64 bytes from the start of the file.
+"""
+
+import numpy
+from sipyco import pyon
+
+from artiq.coredevice.comm_analyzer import (
+    MessageType, StoppedMessage, DecodedMessages, DecodedDump)
+
+
+__all__ = ["TRACE_MAGIC", "is_analyzer_trace", "write_trace", "AnalyzerTrace"]
+
+
+TRACE_MAGIC = b"ARTIQ analyzer trace\n"
+_version = 1
+_alignment = 64
+
+_column_dtypes = {
+    "message_type": "<u1",
+    "channel": "<u4",
+    "timestamp": "<u8",
+    "rtio_counter": "<u8",
+    "address": "<u4",
+    "data": "<u8"
+}
+
+
+def _align(offset):
+    return -(-offset // _alignment) * _alignment
+
+
+def is_analyzer_trace(filename):
+    """Return whether the given file is an analyzer trace, as opposed to a
+    raw analyzer dump."""
+    with open(filename, "rb") as f:
+        return f.read(len(TRACE_MAGIC)) == TRACE_MAGIC
+
+
+def write_trace(filename, dump):
+    """Write a decoded analyzer dump (:class:`DecodedDump`) to a trace
+    file."""
+    messages = dump.messages
+    if not isinstance(messages, DecodedMessages):
+        messages = DecodedMessages.from_messages(messages)
+    stopped = None
+    if len(messages) and messages.message_type[-1] == MessageType.stopped.value:
+        stopped = int(messages.rtio_counter[-1])
+        messages = messages[:-1]
+    messages = messages[numpy.argsort(messages.time, kind="stable")]
+    time = messages.time
+
+    # Messages defining the start of the trace when converted to waveforms
+    nonzero = numpy.flatnonzero(time)
+    start_index = int(nonzero[0]) if len(nonzero) else None
+
+    channel_order = numpy.argsort(messages.channel, kind="stable")
+    channels, channel_offsets, channel_counts = numpy.unique(
+        messages.channel[channel_order], return_index=True, return_counts=True)
+
+    arrays = [(column, getattr(messages, column).astype(dtype))
+              for column, dtype in _column_dtypes.items()]
+    arrays.append(("time", time.astype("<u8")))
+    arrays.append(("channel_order", channel_order.astype("<i8")))
+    arrays.append(("channel_time", time[channel_order].astype("<u8")))
+
+    descriptors = dict()
+    offset = 0
+    for name, array in arrays:
+        descriptors[name] = (array.dtype.str, offset, len(array))
+        offset = _align(offset + array.nbytes)
+    header = {
+        "version": _version,
+        "log_channel": dump.log_channel,
+        "dds_onehot_sel": dump.dds_onehot_sel,
+        "stopped": stopped,
+        "start_index": start_index,
+        "count": len(messages),
+        "channels": {int(channel): (int(channel_offset), int(count))
+                     for channel, channel_offset, count
+                     in zip(channels, channel_offsets, channel_counts)},
+        "arrays": descriptors
+    }
+    header = pyon.encode(header).encode()
+
+    with open(filename, "wb") as f:
+        f.write(TRACE_MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        data_start = _align(f.tell())
+        for name, array in arrays:
+            _, offset, _ = descriptors[name]
+            f.write(bytes(data_start + offset - f.tell()))
+            f.write(memoryview(numpy.ascontiguousarray(array)).cast("B"))
+
+
+class AnalyzerTrace:
+    """Analyzer trace file opened for reading.
+
+    :param filename: name of a file written by :func:`write_trace`.
+    """
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+                raise ValueError("not an analyzer trace")
+            header_length = int.from_bytes(f.read(8), "little")
+            header = pyon.decode(f.read(header_length).decode())
+            data_start = _align(f.tell())
+        if header["version"] != _version:
+            raise ValueError("unsupported analyzer trace version {}"
+                             .format(header["version"]))
+        self.log_channel = header["log_channel"]
+        self.dds_onehot_sel = header["dds_onehot_sel"]
+        self.stopped = header["stopped"]
+        self._start_index = header["start_index"]
+        self._channels = header["channels"]
+
+        self._map = numpy.memmap(filename, numpy.uint8, "r")
+        self._arrays = dict()
+        for name, (dtype, offset, length) in header["arrays"].items():
+            dtype = numpy.dtype(dtype)
+            start = data_start + offset
+            self._arrays[name] = \
+                self._map[start:start + length*dtype.itemsize].view(dtype)
+
+    def close(self):
+        self._arrays = dict()
+        self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def channels(self):
+        """Sorted list of the channels of the messages."""
+        return sorted(self._channels)
+
+    def __len__(self):
+        return len(self._arrays["time"])
+
+    def _columns(self, index):
+        return DecodedMessages(*(self._arrays[column][index]
+                                 for column in DecodedMessages.columns))
+
+    def _window(self, time, start_time, end_time):
+        start = 0 if start_time is None else \
+            int(numpy.searchsorted(time, start_time, "left"))
+        end = len(time) if end_time is None else \
+            int(numpy.searchsorted(time, end_time, "left"))
+        return start, end
+
+    def get_messages(self, channel=None, start_time=None, end_time=None):
+        """Return the messages of a channel (or of all channels if ``None``)
+        whose time is in ``[start_time, end_time)``, in time order.
+
+        The messages of all channels are returned as views of the file.
+        """
+        if channel is None:
+            start, end = self._window(self._arrays["time"], start_time, end_time)
+            return self._columns(slice(start, end))
+        offset, count = self._channels.get(channel, (0, 0))
+        channel_time = self._arrays["channel_time"][offset:offset + count]
+        start, end = self._window(channel_time, start_time, end_time)
+        order = self._arrays["channel_order"][offset + start:offset + end]
+        return self._columns(numpy.asarray(order))
+
+    def get_decoded_dump(self, channels=None):
+        """Build a :class:`DecodedDump` holding the messages of the given
+        channels (or of all channels if ``None``), which can be converted to
+        waveforms or VCD.
+
+        The message setting the start time of the waveforms is always
+        included, so that converting a subset of the channels gives the same
+        times as converting the whole trace.
+        """
+        if channels is None:
+            index = slice(None)
+        else:
+            parts = [self._arrays["channel_order"][offset:offset + count]
+                     for channel, (offset, count) in self._channels.items()
+                     if channel in channels]
+            if self._start_index is not None:
+                parts.append([self._start_index])
+            index = numpy.unique(numpy.concatenate(parts)) if parts \
+                else numpy.empty(0, numpy.int64)
+        messages = self._columns(index)
+        if self.stopped is not None:
+            stopped = DecodedMessages.from_messages(
+                [StoppedMessage(self.stopped)])
+            messages = DecodedMessages(*(
+                numpy.concatenate((getattr(messages, column),
+                                   getattr(stopped, column)))
+                for column in DecodedMessages.columns))
+        return DecodedDump(self.log_channel, self.dds_onehot_sel, messages)
@@ -1,5 +1,6 @@
-from operator import itemgetter
+from operator import itemgetter, index as to_index
 from collections import namedtuple
+from collections.abc import Sequence
 from itertools import count
 from contextlib import contextmanager
 from sipyco import keepalive
@@ -10,6 +11,8 @@ import logging
 import socket
 import math
 
+import numpy
+
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +20,11 @@ logger = logging.getLogger(__name__)
 DEFAULT_REF_PERIOD = 1e-9
 ANALYZER_MAGIC = b"ARTIQ Analyzer Proxy\n"
 
+# endian byte and header
+DUMP_HEADER_SIZE = 16
+# 10x buffer size of firmware
+MAX_PAYLOAD_LENGTH = 10 * 512 * 1024
+
 
 class MessageType(Enum):
     output = 0b00
@@ -48,18 +56,45 @@ class WaveformType(Enum):
     LOG = 3
 
 
+def _get_dump_endian(data):
+    if data[0] == ord('E'):
+        return '>'
+    elif data[0] == ord('e'):
+        return '<'
+    else:
+        raise ValueError
+
+
+def get_dump_length(header):
+    """Return the total length of an analyzer dump, given its first
+    ``DUMP_HEADER_SIZE`` bytes."""
+    sent_bytes, = struct.unpack_from(_get_dump_endian(header) + "I", header, 1)
+    return DUMP_HEADER_SIZE + sent_bytes
+
+
+def _recv_into(sock, view):
+    received = 0
+    while received < len(view):
+        n = sock.recv_into(view[received:])
+        if not n:
+            break
+        received += n
+    return received
+
+
 def get_analyzer_dump(host, port=1382):
     sock = socket.create_connection((host, port))
     try:
-        r = bytes()
-        while True:
-            buf = sock.recv(8192)
-            if not buf:
-                break
-            r += buf
+        header = bytearray(DUMP_HEADER_SIZE)
+        received = _recv_into(sock, memoryview(header))
+        if received < len(header):
+            return bytes(header[:received])
+        r = bytearray(get_dump_length(header))
+        r[:len(header)] = header
+        received += _recv_into(sock, memoryview(r)[received:])
     finally:
         sock.close()
-    return r
+    return bytes(r[:received])
 
 
 OutputMessage = namedtuple(
@@ -99,32 +134,152 @@ def decode_message(data):
         raise ValueError
 
 
+# Layout of the 32-byte messages, which are big endian. Exception messages
+# hold their type in the least significant byte of the address field.
+_message_dtype = numpy.dtype([
+    ("data", ">u8"),
+    ("address", ">u4"),
+    ("rtio_counter", ">u8"),
+    ("timestamp", ">u8"),
+    ("type_channel", ">u4")
+])
+assert _message_dtype.itemsize == 32
+
+_exception_types = numpy.array([e.value for e in ExceptionType])
+
+
+class DecodedMessages(Sequence):
+    """Analyzer messages, stored as one numpy array per field.
+
+    The column attributes (``message_type``, ``channel``, ``timestamp``,
+    ``rtio_counter``, ``address`` and ``data``) hold the fields of all
+    messages. Fields that a message type does not have hold the raw contents
+    of the message at their position.
+
+    Indexing with an integer builds the corresponding :class:`OutputMessage`,
+    :class:`InputMessage`, :class:`ExceptionMessage` or
+    :class:`StoppedMessage`, so that the object can be used like the list of
+    messages. Indexing with a slice, an integer array or a boolean mask
+    returns the selected messages as a new :class:`DecodedMessages`.
+    """
+    columns = ("message_type", "channel", "timestamp", "rtio_counter",
+               "address", "data")
+
+    def __init__(self, message_type, channel, timestamp, rtio_counter,
+                 address, data):
+        self.message_type = message_type
+        self.channel = channel
+        self.timestamp = timestamp
+        self.rtio_counter = rtio_counter
+        self.address = address
+        self.data = data
+
+    @classmethod
+    def from_buffer(cls, buffer, count=-1, offset=0):
+        records = numpy.frombuffer(buffer, _message_dtype, count, offset)
+        type_channel = records["type_channel"].astype(numpy.uint32)
+        return cls((type_channel & 0b11).astype(numpy.uint8),
+                   type_channel >> 2,
+                   records["timestamp"].astype(numpy.uint64),
+                   records["rtio_counter"].astype(numpy.uint64),
+                   records["address"].astype(numpy.uint32),
+                   records["data"].astype(numpy.uint64))
+
+    @classmethod
+    def from_messages(cls, messages):
+        """Build the columns from a list of message tuples."""
+        columns = [[] for _ in cls.columns]
+        for message in messages:
+            if isinstance(message, OutputMessage):
+                fields = (MessageType.output, message.channel,
+                          message.timestamp, message.rtio_counter,
+                          message.address, message.data)
+            elif isinstance(message, InputMessage):
+                fields = (MessageType.input, message.channel,
+                          message.timestamp, message.rtio_counter,
+                          0, message.data)
+            elif isinstance(message, ExceptionMessage):
+                fields = (MessageType.exception, message.channel, 0,
+                          message.rtio_counter,
+                          message.exception_type.value, 0)
+            else:
+                fields = (MessageType.stopped, 0, 0, message.rtio_counter,
+                          0, 0)
+            for column, field in zip(columns, fields):
+                column.append(field)
+        columns[0] = [message_type.value for message_type in columns[0]]
+        dtypes = (numpy.uint8, numpy.uint32, numpy.uint64, numpy.uint64,
+                  numpy.uint32, numpy.uint64)
+        return cls(*(numpy.array(column, dtype)
+                     for column, dtype in zip(columns, dtypes)))
+
+    def check(self):
+        """Raise :class:`ValueError` if an exception message has an unknown
+        exception type."""
+        exception_type = self.exception_type[
+            self.message_type == MessageType.exception.value]
+        unknown = ~numpy.isin(exception_type, _exception_types)
+        if unknown.any():
+            raise ValueError("{} is not a valid ExceptionType".format(
+                exception_type[unknown][0]))
+
+    @property
+    def exception_type(self):
+        return self.address & 0xff
+
+    @property
+    def time(self):
+        """Time of each message in machine units, as returned by
+        :func:`get_message_time`: the timestamp of input and output messages,
+        and the RTIO counter of the others."""
+        return numpy.where(self.message_type <= MessageType.input.value,
+                           self.timestamp, self.rtio_counter)
+
+    def __len__(self):
+        return len(self.message_type)
+
+    def __getitem__(self, index):
+        if isinstance(index, (slice, numpy.ndarray, list)):
+            return DecodedMessages(*(getattr(self, column)[index]
+                                     for column in self.columns))
+        index = to_index(index)
+        message_type = MessageType(int(self.message_type[index]))
+        channel = int(self.channel[index])
+        rtio_counter = int(self.rtio_counter[index])
+        if message_type == MessageType.output:
+            return OutputMessage(channel, int(self.timestamp[index]),
+                                 rtio_counter, int(self.address[index]),
+                                 int(self.data[index]))
+        elif message_type == MessageType.input:
+            return InputMessage(channel, int(self.timestamp[index]),
+                                rtio_counter, int(self.data[index]))
+        elif message_type == MessageType.exception:
+            return ExceptionMessage(channel, rtio_counter, ExceptionType(
+                int(self.address[index]) & 0xff))
+        else:
+            return StoppedMessage(rtio_counter)
+
+
 DecodedDump = namedtuple(
     "DecodedDump", "log_channel dds_onehot_sel messages")
 
 
 def decode_dump(data):
     # extract endian byte
-    if data[0] == ord('E'):
-        endian = '>'
-    elif data[0] == ord('e'):
-        endian = '<'
-    else:
-        raise ValueError
-    data = data[1:]
+    endian = _get_dump_endian(data)
     # only header is device endian
     # messages are big endian
-    parts = struct.unpack(endian + "IQbbb", data[:15])
+    parts = struct.unpack_from(endian + "IQbbb", data, 1)
     (sent_bytes, total_byte_count,
      error_occurred, log_channel, dds_onehot_sel) = parts
 
     logger.debug("analyzer dump has length %d", sent_bytes)
 
     expected_len = sent_bytes + 15
-    if expected_len != len(data):
+    if expected_len != len(data) - 1:
         raise ValueError("analyzer dump has incorrect length "
                          "(got {}, expected {})".format(
-                            len(data), expected_len))
+                            len(data) - 1, expected_len))
     if error_occurred:
         logger.warning("error occurred within the analyzer, "
                        "data may be corrupted")
@@ -134,18 +289,49 @@ def decode_dump(data):
     if sent_bytes == 0:
         logger.warning("analyzer dump is empty")
 
-    position = 15
-    messages = []
-    for _ in range(sent_bytes//32):
-        messages.append(decode_message(data[position:position+32]))
-        position += 32
+    messages = DecodedMessages.from_buffer(data, sent_bytes//32, 16)
+    messages.check()
 
-    if len(messages) == 1 and isinstance(messages[0], StoppedMessage):
+    if (len(messages) == 1
+            and messages.message_type[0] == MessageType.stopped.value):
         logger.warning("analyzer dump is empty aside from stop message")
 
     return DecodedDump(log_channel, bool(dds_onehot_sel), messages)
 
 
+def merge_dumps(dumps, max_payload_length=MAX_PAYLOAD_LENGTH):
+    """Concatenate successive analyzer dumps into one dump.
+
+    Since the core device clears its buffer after each dump, the result
+    holds all the messages of the dumps. The stop messages ending all but the
+    last dump are removed. If there are more than ``max_payload_length``
+    bytes of messages, the oldest ones are dropped, as if the analyzer ring
+    buffer had wrapped.
+    """
+    total_byte_count = 0
+    any_error_occurred = False
+    messages = []
+    for i, dump in enumerate(dumps):
+        endian = _get_dump_endian(dump)
+        (sent_bytes, dump_total_byte_count,
+         error_occurred, log_channel, dds_onehot_sel) = \
+            struct.unpack_from(endian + "IQbbb", dump, 1)
+        dump_messages = memoryview(dump)[DUMP_HEADER_SIZE:DUMP_HEADER_SIZE + sent_bytes]
+        if (i != len(dumps) - 1 and len(dump_messages) >= 32
+                and dump_messages[-1] & 0b11 == MessageType.stopped.value):
+            dump_messages = dump_messages[:-32]
+            dump_total_byte_count -= 32
+        messages.append(dump_messages)
+        total_byte_count += dump_total_byte_count
+        any_error_occurred |= bool(error_occurred)
+    messages = b"".join(messages)
+    if len(messages) > max_payload_length:
+        messages = messages[len(messages) - max_payload_length//32*32:]
+    header = struct.pack(endian + "IQbbb", len(messages), total_byte_count,
+                         any_error_occurred, log_channel, dds_onehot_sel)
+    return dump[:1] + header + messages
+
+
 # simplified from sipyco broadcast Receiver
 class AnalyzerProxyReceiver:
     def __init__(self, receive_cb, disconnect_cb=None):
@@ -194,8 +380,7 @@ class AnalyzerProxyReceiver:
                     raise ValueError
                 data.extend(await self.reader.readexactly(4))
                 payload_length = struct.unpack(endian + "I", data[1:5])[0]
-                if payload_length > 10 * 512 * 1024:
-                    # 10x buffer size of firmware
+                if payload_length > MAX_PAYLOAD_LENGTH:
                     raise ValueError
 
                 # The remaining header length is 11 bytes.
@@ -219,33 +404,115 @@ def vcd_codes():
         yield code
 
 
-class VCDChannel:
-    def __init__(self, out, code):
-        self.out = out
-        self.code = code
+def _format_binary(values, width):
+    # Vectorized "{:0{width}b}".format(value)
+    values = numpy.asarray(values, numpy.uint64)
+    if len(values) and int(values.max()).bit_length() > width:
+        return numpy.array(["{:0{}b}".format(value, width)
+                            for value in values.tolist()])
+    shifts = numpy.arange(width - 1, -1, -1, dtype=numpy.uint64)
+    bits = ((values[:, None] >> shifts) & numpy.uint64(1)).astype(numpy.uint8)
+    bits += ord("0")
+    return bits.view("S{}".format(width)).ravel().astype("U{}".format(width))
+
+
+def _forward_fill(mask, values, initial):
+    """For each message, return the value of the last message (inclusive)
+    for which ``mask`` is set, or ``initial`` if there is none, and whether
+    there is one."""
+    index = numpy.where(mask, numpy.arange(len(mask)), -1)
+    numpy.maximum.accumulate(index, out=index)
+    found = index >= 0
+    if not len(values):
+        return numpy.asarray(values), found
+    return numpy.where(found, values[numpy.maximum(index, 0)], initial), found
+
+
+class _BufferedChannel:
+    # Values are either set one at a time at the current time (set_value,
+    # set_value_double, set_log), or as arrays of times and values
+    # (set_values). Both are kept in order.
+    def __init__(self, ty, current_time=0):
+        self.ty = ty
+        self.current_time = current_time
+        self._chunks = []
+        self._times = []
+        self._values = []
+
+    def _flush_values(self):
+        if self._times:
+            values = numpy.empty(len(self._values), object)
+            values[:] = self._values
+            self._chunks.append((numpy.array(self._times, numpy.int64),
+                                 values))
+            self._times = []
+            self._values = []
 
     def set_value(self, value):
-        if len(value) > 1:
-            self.out.write("b" + value + " " + self.code + "\n")
-        else:
-            self.out.write(value + self.code + "\n")
+        self._times.append(self.current_time)
+        self._values.append(value)
 
     def set_value_double(self, x):
-        integer_cast = struct.unpack(">Q", struct.pack(">d", x))[0]
-        self.set_value("{:064b}".format(integer_cast))
+        self.set_value(x)
 
     def set_log(self, log_message):
-        value = ""
-        for c in log_message:
-            value += "{:08b}".format(ord(c))
-        self.set_value(value)
+        self.set_value(log_message)
+
+    def set_time(self, time):
+        self.current_time = time
+
+    def set_values(self, times, values):
+        """Set values at the given times, which must not be earlier than
+        those of the values already set."""
+        self._flush_values()
+        if len(times):
+            self._chunks.append((numpy.asarray(times, numpy.int64),
+                                 numpy.asarray(values)))
+
+    def get_data(self):
+        """Return a pair of arrays holding the times and values."""
+        self._flush_values()
+        if self.ty == WaveformType.ANALOG:
+            dtype = numpy.float64
+        elif self.ty == WaveformType.LOG:
+            dtype = object
+        else:
+            dtype = str
+        if not self._chunks:
+            return numpy.empty(0, numpy.int64), numpy.empty(0, dtype)
+        times = numpy.concatenate([times for times, _ in self._chunks])
+        values = numpy.concatenate([values.astype(dtype)
+                                    for _, values in self._chunks])
+        return times, values
+
+
+class VCDChannel(_BufferedChannel):
+    def __init__(self, code, ty):
+        _BufferedChannel.__init__(self, ty)
+        self.code = code
+
+    def _format(self, value):
+        if len(value) > 1:
+            return "b" + value + " " + self.code + "\n"
+        else:
+            return value + self.code + "\n"
+
+    def get_lines(self):
+        """Return the times of the values and the VCD lines setting them."""
+        times, values = self.get_data()
+        if self.ty == WaveformType.ANALOG:
+            values = _format_binary(values.astype(">f8").view(">u8"), 64)
+        elif self.ty == WaveformType.LOG:
+            values = ["".join("{:08b}".format(ord(c)) for c in log_message)
+                      for log_message in values]
+        return times, [self._format(value) for value in values]
 
 
 class VCDManager:
     def __init__(self, fileobj):
         self.out = fileobj
         self.codes = vcd_codes()
-        self.current_time = None
+        self.channels = list()
         self.start_time = 0
 
     def set_timescale_ps(self, timescale):
@@ -255,7 +522,9 @@ class VCDManager:
         code = next(self.codes)
         self.out.write("$var wire {width} {code} {name} $end\n"
                        .format(name=name, code=code, width=width))
-        return VCDChannel(self.out, code)
+        channel = VCDChannel(code, ty)
+        self.channels.append(channel)
+        return channel
 
     @contextmanager
     def scope(self, scope, name):
@@ -265,9 +534,8 @@ class VCDManager:
 
     def set_time(self, time):
         time -= self.start_time
-        if time != self.current_time:
-            self.out.write("#{}\n".format(time))
-            self.current_time = time
+        for channel in self.channels:
+            channel.set_time(time)
 
     def set_start_time(self, time):
         self.start_time = time
@@ -275,13 +543,32 @@ class VCDManager:
     def set_end_time(self, time):
         pass
 
+    def finish(self):
+        """Write the values of all channels, in time order."""
+        all_times = []
+        all_lines = []
+        for channel in self.channels:
+            times, lines = channel.get_lines()
+            all_times.append(times)
+            all_lines += lines
+        if not all_lines:
+            return
+        all_times = numpy.concatenate(all_times)
+        current_time = None
+        for i in numpy.argsort(all_times, kind="stable"):
+            time = all_times[i]
+            if time != current_time:
+                self.out.write("#{}\n".format(time))
+                current_time = time
+            self.out.write(all_lines[i])
+
 
 class WaveformManager:
     def __init__(self):
         self.current_time = 0
         self.start_time = 0
         self.end_time = 0
-        self.channels = list()
+        self.channels = dict()
         self.current_scope = ""
         self.trace = {"timescale": 1, "stopped_x": None, "logs": dict(), "data": dict()}
 
@@ -291,9 +578,8 @@ class WaveformManager:
     def get_channel(self, name, width, ty, precision=0, unit=""):
         if ty == WaveformType.LOG:
             self.trace["logs"][self.current_scope + name] = (ty, width, precision, unit)
-        data = self.trace["data"][self.current_scope + name] = list()
-        channel = WaveformChannel(data, self.current_time)
-        self.channels.append(channel)
+        channel = WaveformChannel(ty, self.current_time)
+        self.channels[self.current_scope + name] = channel
         return channel
 
     @contextmanager
@@ -305,7 +591,7 @@ class WaveformManager:
 
     def set_time(self, time):
         time -= self.start_time
-        for channel in self.channels:
+        for channel in self.channels.values():
             channel.set_time(time)
 
     def set_start_time(self, time):
@@ -317,23 +603,15 @@ class WaveformManager:
         self.end_time = time
         self.trace["stopped_x"] = self.end_time - self.start_time
 
+    def finish(self):
+        """Store the data of each channel in the trace, as a pair of arrays
+        holding the times and the values."""
+        for name, channel in self.channels.items():
+            self.trace["data"][name] = channel.get_data()
 
-class WaveformChannel:
-    def __init__(self, data, current_time):
-        self.data = data
-        self.current_time = current_time
 
-    def set_value(self, value):
-        self.data.append((self.current_time, value))
-
-    def set_value_double(self, x):
-        self.data.append((self.current_time, x))
-
-    def set_time(self, time):
-        self.current_time = time
-
-    def set_log(self, log_message):
-        self.data.append((self.current_time, log_message))
+class WaveformChannel(_BufferedChannel):
+    pass
 
 
 class ChannelSignatureManager:
@@ -379,6 +657,23 @@ class TTLHandler:
                 message.timestamp, message.data, self.name)
             self.channel_value.set_value(str(message.data))
 
+    def process_messages(self, messages, times):
+        output = messages.message_type == MessageType.output.value
+        set_value = output & (messages.address == 0)
+        set_oe = output & (messages.address == 1)
+        inputs = messages.message_type == MessageType.input.value
+        data = messages.data.astype(str)
+
+        last_value, _ = _forward_fill(set_value, data, self.last_value)
+        oe, _ = _forward_fill(set_oe, messages.data != 0, self.oe)
+        changed = (set_value & oe) | set_oe | inputs
+        values = numpy.where(inputs, data,
+                             numpy.where(oe, last_value, "X"))
+        self.channel_value.set_values(times[changed], values[changed])
+        if len(messages):
+            self.last_value = str(last_value[-1])
+            self.oe = bool(oe[-1])
+
 
 class TTLClockGenHandler:
     def __init__(self, manager, name, ref_period):
@@ -395,6 +690,11 @@ class TTLClockGenHandler:
             frequency = message.data/self.ref_period/2**24
             self.channel_frequency.set_value_double(frequency)
 
+    def process_messages(self, messages, times):
+        output = messages.message_type == MessageType.output.value
+        frequency = messages.data[output]/self.ref_period/2**24
+        self.channel_frequency.set_values(times[output], frequency)
+
 
 class DDSHandler:
     def __init__(self, manager, onehot_sel, sysclk):
@@ -466,6 +766,55 @@ class DDSHandler:
                          self.selected_dds_channels)
             self._decode_ad9914_write(message)
 
+    def process_messages(self, messages, times):
+        output = messages.message_type == MessageType.output.value
+        address = messages.address[output]
+        data = messages.data[output]
+        times = times[output]
+
+        select = address == 0x81
+        gpio = data >> numpy.uint64(1)  # strip reset
+        for dds_channel_nr, dds_channel in self.dds_channels.items():
+            if self.onehot_sel:
+                selects = (gpio >> numpy.uint64(dds_channel_nr)) & numpy.uint64(1) != 0
+            else:
+                selects = gpio == dds_channel_nr
+            selected, _ = _forward_fill(
+                select, selects, dds_channel_nr in self.selected_dds_channels)
+
+            def register(register_address, initial):
+                values, found = _forward_fill(
+                    selected & (address == register_address), data,
+                    0 if initial is None else initial)
+                if initial is not None:
+                    found[:] = True
+                return values, found
+
+            ftw0, has_ftw0 = register(0x11, dds_channel["ftw"][0])
+            ftw1, has_ftw1 = register(0x13, dds_channel["ftw"][1])
+            phase_word, has_pow = register(0x31, dds_channel["pow"])
+            fud = selected & (address == 0x80)
+
+            set_frequency = fud & has_ftw0 & has_ftw1
+            ftw = (ftw0[set_frequency].astype(numpy.float64)
+                   + ftw1[set_frequency].astype(numpy.float64)*2**16)
+            dds_channel["vcd_frequency"].set_values(
+                times[set_frequency], ftw*self.sysclk/2**32)
+            set_phase = fud & has_pow
+            dds_channel["vcd_phase"].set_values(
+                times[set_phase], phase_word[set_phase]/2**16)
+
+            if len(data):
+                if has_ftw0[-1]:
+                    dds_channel["ftw"][0] = int(ftw0[-1])
+                if has_ftw1[-1]:
+                    dds_channel["ftw"][1] = int(ftw1[-1])
+                if has_pow[-1]:
+                    dds_channel["pow"] = int(phase_word[-1])
+        if select.any():
+            self.selected_dds_channels = self._gpio_to_channels(
+                int(data[select][-1]))
+
 
 class WishboneHandler:
     def __init__(self, manager, name, read_bit):
@@ -585,6 +934,48 @@ class SPIMaster2Handler(WishboneHandler):
         elif isinstance(message, InputMessage):
             self._reads.append(message)
 
+    def process_messages(self, messages, times):
+        self.stb.set_values(numpy.repeat(times, 2),
+                            numpy.tile(["1", "0"], len(times)))
+
+        output = messages.message_type == MessageType.output.value
+        address = messages.address[output]
+        data = messages.data[output]
+        output_times = times[output]
+        if (address > 1).any():
+            raise ValueError("bad address", int(address[address > 1][0]))
+
+        config = address == 1
+        config_data = data[config]
+        config_times = output_times[config]
+        for reg_name, shift, mask in [("chip_select", 24, None),
+                                      ("div", 16, 0xff),
+                                      ("length", 8, 0x1f),
+                                      ("flags", 0, 0xff)]:
+            values = config_data >> numpy.uint64(shift)
+            if mask is not None:
+                values &= numpy.uint64(mask)
+            self.channels[reg_name].set_values(
+                config_times, _format_binary(values, 8))
+        write = address == 0
+        self.channels["write"].set_values(
+            output_times[write], _format_binary(data[write], 32))
+
+        # Untimed reads are shown at the first later output whose timestamp
+        # is after the RTIO counter of the read, in order.
+        inputs = messages.message_type == MessageType.input.value
+        position = numpy.arange(len(messages))
+        read_output = numpy.maximum(
+            numpy.searchsorted(position[output], position[inputs], "right"),
+            numpy.searchsorted(messages.timestamp[output],
+                               messages.rtio_counter[inputs], "right"))
+        read_output = numpy.maximum.accumulate(read_output) \
+            if len(read_output) else read_output
+        shown = read_output < len(output_times)
+        self.channels["read"].set_values(
+            output_times[read_output[shown]],
+            _format_binary(messages.data[inputs][shown], 32))
+
 
 def _extract_log_chars(data):
     r = ""
@@ -597,6 +988,42 @@ def _extract_log_chars(data):
     return r
 
 
+def _extract_log_entries(data, entry=""):
+    """Decode the log entries in an array of log channel words.
+
+    :param entry: the incomplete entry left by the previous words.
+    :return: a list of ``(index, entry)`` tuples giving the complete entries
+        (without terminator) and the index of the word completing them, and
+        the incomplete entry left by the last word.
+    """
+    if (data >> numpy.uint64(32)).any():
+        entries = []
+        for index, word in enumerate(data.tolist()):
+            entry += _extract_log_chars(word)
+            if len(entry) > 1 and entry[-1] == "\x1D":
+                entries.append((index, entry[:-1]))
+                entry = ""
+        return entries, entry
+
+    chars = data.astype(">u4").view(numpy.uint8)
+    nonzero = numpy.flatnonzero(chars)
+    word_index = nonzero // 4
+    chars = chars[nonzero]
+    # Entries can only end with the last character of a word.
+    last_in_word = numpy.append(word_index[1:] != word_index[:-1], True) \
+        if len(chars) else numpy.zeros(0, bool)
+    ends = numpy.flatnonzero((chars == 0x1D) & last_in_word)
+
+    text = entry + chars.tobytes().decode("latin-1")
+    entries = []
+    start = 0
+    for end in (ends + len(entry)).tolist():
+        if end - start >= 1:
+            entries.append((int(word_index[end - len(entry)]), text[start:end]))
+            start = end + 1
+    return entries, text[start:]
+
+
 class LogHandler:
     def __init__(self, manager, log_channels):
         self.channels = dict()
@@ -614,9 +1041,34 @@ class LogHandler:
                 self.channels[channel_name].set_log(log_message)
                 self.current_entry = ""
 
+    def process_messages(self, messages, times):
+        output = messages.message_type == MessageType.output.value
+        entries, self.current_entry = _extract_log_entries(
+            messages.data[output], self.current_entry)
+        times = times[output]
+        logs = {name: ([], []) for name in self.channels}
+        for index, entry in entries:
+            channel_name, log_message = entry.split("\x1E", maxsplit=1)
+            logs[channel_name][0].append(times[index])
+            logs[channel_name][1].append(log_message)
+        for channel_name, (log_times, log_messages) in logs.items():
+            values = numpy.empty(len(log_messages), object)
+            values[:] = log_messages
+            self.channels[channel_name].set_values(log_times, values)
+
 
 def get_log_channels(log_channel, messages):
     log_channels = dict()
+    if isinstance(messages, DecodedMessages):
+        entries, _ = _extract_log_entries(messages.data[
+            (messages.message_type == MessageType.output.value)
+            & (messages.channel == log_channel)])
+        for _, entry in entries:
+            channel_name, log_message = entry.split("\x1E", maxsplit=1)
+            log_channels[channel_name] = max(
+                log_channels.get(channel_name, 0), len(log_message))
+        return log_channels
+
     log_entry = ""
     for message in messages:
         if (isinstance(message, OutputMessage)
@@ -700,6 +1152,20 @@ def get_channel_list(devices):
     return manager.channels
 
 
+def get_rtio_channels(devices):
+    """Map the names of the waveform channels of the devices to the RTIO
+    channel of their messages. Log channels and the channels computed from
+    the messages of all RTIO channels are not included."""
+    rtio_channels = dict()
+    for name, desc in devices.items():
+        manager = ChannelSignatureManager()
+        for channel in create_channel_handlers(manager, {name: desc},
+                                               1e-9, 3e9, False):
+            for waveform_channel in manager.channels:
+                rtio_channels[waveform_channel] = channel
+    return rtio_channels
+
+
 def get_message_time(message):
     return getattr(message, "timestamp", message.rtio_counter)
 
@@ -728,15 +1194,17 @@ def decoded_dump_to_target(manager, devices, dump, uniform_interval):
         logger.warning("unable to determine DDS sysclk")
         dds_sysclk = 3e9  # guess
 
-    if isinstance(dump.messages[-1], StoppedMessage):
-        m = dump.messages[-1]
-        end_time = get_message_time(m)
+    messages = dump.messages
+    if not isinstance(messages, DecodedMessages):
+        messages = DecodedMessages.from_messages(messages)
+    if len(messages) and messages.message_type[-1] == MessageType.stopped.value:
+        end_time = int(messages.rtio_counter[-1])
         manager.set_end_time(end_time)
-        messages = dump.messages[:-1]
+        messages = messages[:-1]
     else:
         logger.warning("StoppedMessage missing")
-        messages = dump.messages
-    messages = sorted(messages, key=get_message_time)
+    messages = messages[numpy.argsort(messages.time, kind="stable")]
+    message_times = messages.time
 
     channel_handlers = create_channel_handlers(
         manager, devices, ref_period,
@@ -753,26 +1221,45 @@ def decoded_dump_to_target(manager, devices, dump, uniform_interval):
     slack = manager.get_channel("rtio_slack", 64, ty=WaveformType.ANALOG)
 
     manager.set_time(0)
-    start_time = 0
-    for m in messages:
-        start_time = get_message_time(m)
-        if start_time:
-            break
+    nonzero = numpy.flatnonzero(message_times)
+    start_time = int(message_times[nonzero[0]]) if len(nonzero) else 0
     if not uniform_interval:
         manager.set_start_time(start_time)
-    t0 = start_time
-    for i, message in enumerate(messages):
-        if message.channel in channel_handlers:
-            t = get_message_time(message)
-            if t >= 0:
-                if uniform_interval:
-                    interval.set_value_double((t - t0)*ref_period)
-                    manager.set_time(i)
-                    timestamp.set_value("{:064b}".format(t))
-                    t0 = t
-                else:
-                    manager.set_time(t)
-            channel_handlers[message.channel].process_message(message)
-            if isinstance(message, OutputMessage):
-                slack.set_value_double(
-                    (message.timestamp - message.rtio_counter)*ref_period)
+
+    handled = numpy.flatnonzero(numpy.isin(messages.channel,
+                                           list(channel_handlers)))
+    handled_times = message_times[handled]
+    if uniform_interval:
+        # Messages are shown one after the other; the interval to a message
+        # is shown at the previous one.
+        times = handled
+        interval.set_values(
+            numpy.concatenate(([0], handled))[:len(handled)],
+            numpy.diff(handled_times.astype(numpy.int64),
+                       prepend=start_time)*ref_period)
+        timestamp.set_values(handled, _format_binary(handled_times, 64))
+        time_offset = 0
+    else:
+        times = handled_times.astype(numpy.int64) - start_time
+        time_offset = start_time
+
+    handled_messages = messages[handled]
+    channels = handled_messages.channel
+    for channel, handler in channel_handlers.items():
+        indices = numpy.flatnonzero(channels == channel)
+        if not len(indices):
+            continue
+        if hasattr(handler, "process_messages"):
+            handler.process_messages(handled_messages[indices],
+                                     times[indices])
+        else:
+            for i in indices.tolist():
+                manager.set_time(int(times[i]) + time_offset)
+                handler.process_message(handled_messages[i])
+
+    output = handled_messages.message_type == MessageType.output.value
+    slack.set_values(
+        times[output],
+        (handled_messages.timestamp[output].astype(numpy.int64)
+         - handled_messages.rtio_counter[output].astype(numpy.int64))*ref_period)
+    manager.finish()
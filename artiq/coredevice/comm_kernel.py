@@ -1,9 +1,13 @@
 import struct
+import hashlib
 import logging
 import traceback
 import numpy
 import socket
 import builtins
+import queue
+import threading
+import time
 from enum import Enum
 from fractions import Fraction
 from collections import namedtuple
@@ -26,6 +30,9 @@ class Request(Enum):
 
     SubkernelUpload = 9
 
+    UploadResidentKernel = 10
+    LoadResidentKernel = 11
+
 
 class Reply(Enum):
     SystemInfo = 2
@@ -39,6 +46,8 @@ class Reply(Enum):
 
     RPCRequest = 10
 
+    ResidentKernelMismatch = 11
+
     ClockFailure = 15
 
 
@@ -67,17 +76,13 @@ def _receive_list(kernel, embedding_map):
     length = kernel._read_int32()
     tag = chr(kernel._read_int8())
     if tag == "b":
-        buffer = kernel._read(length)
-        return list(struct.unpack(kernel.endian + "%s?" % length, buffer))
+        return kernel._read_array(length, '?').tolist()
     elif tag == "i":
-        buffer = kernel._read(4 * length)
-        return list(struct.unpack(kernel.endian + "%sl" % length, buffer))
+        return kernel._read_array(length, kernel.endian + 'i4').tolist()
     elif tag == "I":
-        buffer = kernel._read(8 * length)
-        return list(numpy.ndarray((length, ), kernel.endian + 'i8', buffer))
+        return list(kernel._read_array(length, kernel.endian + 'i8'))
     elif tag == "f":
-        buffer = kernel._read(8 * length)
-        return list(struct.unpack(kernel.endian + "%sd" % length, buffer))
+        return kernel._read_array(length, kernel.endian + 'd').tolist()
     else:
         fn = receivers[tag]
         elems = []
@@ -95,19 +100,15 @@ def _receive_array(kernel, embedding_map):
     shape = tuple(kernel._read_int32() for _ in range(num_dims))
     tag = chr(kernel._read_int8())
     fn = receivers[tag]
-    length = numpy.prod(shape)
+    length = int(numpy.prod(shape))
     if tag == "b":
-        buffer = kernel._read(length)
-        elems = numpy.ndarray((length, ), '?', buffer)
+        elems = kernel._read_array(length, '?')
     elif tag == "i":
-        buffer = kernel._read(4 * length)
-        elems = numpy.ndarray((length, ), kernel.endian + 'i4', buffer)
+        elems = kernel._read_array(length, kernel.endian + 'i4')
     elif tag == "I":
-        buffer = kernel._read(8 * length)
-        elems = numpy.ndarray((length, ), kernel.endian + 'i8', buffer)
+        elems = kernel._read_array(length, kernel.endian + 'i8')
     elif tag == "f":
-        buffer = kernel._read(8 * length)
-        elems = numpy.ndarray((length, ), kernel.endian + 'd', buffer)
+        elems = kernel._read_array(length, kernel.endian + 'd')
     else:
         fn = receivers[tag]
         elems = []
@@ -173,6 +174,73 @@ class CommKernelDummy:
         pass
 
 
+class _AsyncRPCExecutor:
+    """Runs async RPCs in order on a background thread, so that a slow
+    callback does not stop the kernel connection from being read.
+
+    At most ``queue_size`` calls are pending; when the queue is full,
+    :meth:`submit` blocks until the thread has caught up. The first exception
+    raised by a call is kept and returned by :meth:`wait`; the calls queued
+    after it are dropped.
+    """
+    def __init__(self, queue_size):
+        self._queue = queue.Queue(queue_size)
+        self._thread = None
+        self._error = None
+        self.stats = {
+            "submitted": 0,
+            "max_pending": 0,
+            "blocked": 0,
+            "blocked_time": 0.0
+        }
+
+    def _worker(self):
+        while True:
+            call = self._queue.get()
+            try:
+                if call is None:
+                    return
+                if self._error is None:
+                    function, args, kwargs = call
+                    try:
+                        function(*args, **kwargs)
+                    except Exception as exn:
+                        self._error = exn
+            finally:
+                self._queue.task_done()
+
+    def submit(self, function, args, kwargs):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker,
+                                            name="async_rpc", daemon=True)
+            self._thread.start()
+        call = (function, args, kwargs)
+        try:
+            self._queue.put_nowait(call)
+        except queue.Full:
+            t0 = time.monotonic()
+            self._queue.put(call)
+            self.stats["blocked"] += 1
+            self.stats["blocked_time"] += time.monotonic() - t0
+        self.stats["submitted"] += 1
+        self.stats["max_pending"] = max(self.stats["max_pending"],
+                                        self._queue.qsize())
+
+    def wait(self):
+        """Wait until all submitted calls have run, and return the first
+        exception raised by them (if any) since the last call."""
+        if self._thread is not None:
+            self._queue.join()
+        error, self._error = self._error, None
+        return error
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
 def incompatible_versions(v1, v2):
     if v1.endswith(".beta") or v2.endswith(".beta"):
         # Beta branches may introduce breaking changes. Check version strictly.
@@ -186,12 +254,28 @@ def incompatible_versions(v1, v2):
 class CommKernel:
     warned_of_mismatch = False
 
-    def __init__(self, host, port=1381):
+    # Reads larger than the receive buffer go directly to their destination.
+    read_buffer_size = 65536
+
+    def __init__(self, host, port=1381, async_rpc_queue_size=0):
         self._read_type = None
         self.host = host
         self.port = port
-        self.read_buffer = bytearray()
+        if async_rpc_queue_size:
+            self.async_rpc_executor = _AsyncRPCExecutor(async_rpc_queue_size)
+        else:
+            self.async_rpc_executor = None
+        self.read_buffer = bytearray(self.read_buffer_size)
+        self._read_view = memoryview(self.read_buffer)
+        # unread data is read_buffer[_read_start:_read_end]
+        self._read_start = 0
+        self._read_end = 0
         self.write_buffer = bytearray()
+        # Whether the runtime keeps a copy of the last kernel uploaded with
+        # UploadResidentKernel, and the digest of that kernel.
+        self.resident_kernels = False
+        self._resident_digest = None
+        self._digest_cache = (None, None)
 
 
     def open(self):
@@ -217,31 +301,71 @@ class CommKernel:
         self.pack_float64 = struct.Struct(self.endian + "d").pack
 
     def close(self):
+        if self.async_rpc_executor is not None:
+            self.async_rpc_executor.close()
         if not hasattr(self, "socket"):
             return
         self.socket.close()
         del self.socket
+        self._read_start = self._read_end = 0
         logger.debug("disconnected")
 
     #
     # Reader interface
     #
 
+    def _recv_into(self, view, waitall):
+        flag = 0
+        if waitall:
+            flag |= socket.MSG_WAITALL
+        received = self.socket.recv_into(view, len(view), flag)
+        if not received:
+            raise ConnectionResetError("Core device connection closed unexpectedly")
+        return received
+
+    def _fill_read_buffer(self, length):
+        # Receive until at least length bytes are buffered, asking for as
+        # much as fits so that small reads do not each call recv.
+        available = self._read_end - self._read_start
+        if self._read_start:
+            self.read_buffer[:available] = \
+                self.read_buffer[self._read_start:self._read_end]
+            self._read_start = 0
+            self._read_end = available
+        while self._read_end < length:
+            self._read_end += self._recv_into(
+                self._read_view[self._read_end:], False)
+
+    def _read_into(self, view):
+        """Fill the writable byte buffer ``view`` with received data."""
+        length = len(view)
+        start = self._read_start
+        offset = min(length, self._read_end - start)
+        view[:offset] = self._read_view[start:start + offset]
+        self._read_start = start + offset
+        while offset < length:
+            remaining = length - offset
+            if remaining >= self.read_buffer_size:
+                offset += self._recv_into(view[offset:], True)
+            else:
+                self._fill_read_buffer(remaining)
+                view[offset:] = self._read_view[:remaining]
+                self._read_start = remaining
+                offset = length
+
     def _read(self, length):
-        # cache the reads to avoid frequent call to recv
-        while len(self.read_buffer) < length:
-            # the number is just the maximum amount
-            # when there is not much data, it would return earlier
-            diff = length - len(self.read_buffer)
-            flag = 0
-            if diff > 8192:
-                flag |= socket.MSG_WAITALL
-            new_buffer = self.socket.recv(8192, flag)
-            if not new_buffer:
-                raise ConnectionResetError("Core device connection closed unexpectedly")
-            self.read_buffer += new_buffer
-        result = self.read_buffer[:length]
-        self.read_buffer = self.read_buffer[length:]
+        start = self._read_start
+        if self._read_end - start >= length:
+            self._read_start = start + length
+            return self.read_buffer[start:start + length]
+        result = bytearray(length)
+        self._read_into(memoryview(result))
+        return result
+
+    def _read_array(self, length, dtype):
+        """Receive a one-dimensional array of ``length`` elements."""
+        result = numpy.empty(length, dtype)
+        self._read_into(memoryview(result.view(numpy.uint8)))
         return result
 
     def _read_header(self):
@@ -359,7 +483,14 @@ class CommKernel:
         self._read_expect(Reply.SystemInfo)
         runtime_id = self._read(4)
         if runtime_id == b"AROR":
-            gateware_version = self._read_string().split(";")[0]
+            ident = self._read_string().split(";")
+            gateware_version = ident[0]
+            # Runtimes that support optional protocol features list them in
+            # an extra field of the identifier.
+            capabilities = set()
+            for field in ident[1:]:
+                if field.startswith("capabilities="):
+                    capabilities.update(field[len("capabilities="):].split(","))
             if not self.warned_of_mismatch and incompatible_versions(gateware_version, software_version):
                 logger.warning("Mismatch between gateware (%s) "
                                "and software (%s) versions",
@@ -369,23 +500,61 @@ class CommKernel:
             finished_cleanly = self._read_bool()
             if not finished_cleanly:
                 logger.warning("Previous kernel did not cleanly finish")
+            self.resident_kernels = "resident_kernel" in capabilities
         elif runtime_id == b"ARZQ":
             pass
         else:
             raise UnsupportedDevice("Unsupported runtime ID: {}"
                                     .format(runtime_id))
 
-    def load(self, kernel_library):
-        self._write_header(Request.LoadKernel)
-        self._write_bytes(kernel_library)
-        self._flush()
+    def _kernel_digest(self, kernel_library):
+        # Precompiled kernels pass the same object at every run.
+        library, digest = self._digest_cache
+        if library is not kernel_library:
+            digest = hashlib.sha256(kernel_library).digest()
+            self._digest_cache = (kernel_library, digest)
+        return digest
 
-        self._read_header()
+    def _read_load_reply(self):
         if self._read_type == Reply.LoadFailed:
             raise LoadError(self._read_string())
         else:
             self._read_expect(Reply.LoadCompleted)
 
+    def load(self, kernel_library):
+        if not self.resident_kernels:
+            self._write_header(Request.LoadKernel)
+            self._write_bytes(kernel_library)
+            self._flush()
+
+            self._read_header()
+            self._read_load_reply()
+            return
+
+        digest = self._kernel_digest(kernel_library)
+        if digest == self._resident_digest:
+            # The runtime loads its own copy, unless it has been replaced
+            # (e.g. by another client or a reboot) in the meantime.
+            self._write_header(Request.LoadResidentKernel)
+            self._write_bytes(digest)
+            self._flush()
+
+            self._read_header()
+            if self._read_type != Reply.ResidentKernelMismatch:
+                self._read_load_reply()
+                return
+            logger.debug("resident kernel was replaced, uploading again")
+
+        self._resident_digest = None
+        self._write_header(Request.UploadResidentKernel)
+        self._write_bytes(digest)
+        self._write_bytes(kernel_library)
+        self._flush()
+
+        self._read_header()
+        self._read_load_reply()
+        self._resident_digest = digest
+
     def upload_subkernel(self, kernel_library, id, destination):
         self._write_header(Request.SubkernelUpload)
         self._write_int32(id)
@@ -425,23 +594,56 @@ class CommKernel:
             else:
                 args.append(value)
 
-    def _skip_rpc_value(self, tags):
-        tag = chr(tags.pop(0))
+    def _skip_rpc_value(self, tags, index):
+        """Return the index of the tag following the type that starts at
+        ``tags[index]``."""
+        tag = chr(tags[index])
+        index += 1
         if tag == "t":
-            length = tags.pop(0)
+            length = tags[index]
+            index += 1
             for _ in range(length):
-                self._skip_rpc_value(tags)
+                index = self._skip_rpc_value(tags, index)
         elif tag == "l":
-            self._skip_rpc_value(tags)
+            index = self._skip_rpc_value(tags, index)
         elif tag == "r":
-            self._skip_rpc_value(tags)
+            index = self._skip_rpc_value(tags, index)
         elif tag == "a":
-            _ndims = tags.pop(0)
-            self._skip_rpc_value(tags)
+            index = self._skip_rpc_value(tags, index + 1)
+        return index
+
+    def _write_array(self, array):
+        """Write the contents of a one-dimensional array, sending large
+        arrays directly from their memory."""
+        if array.nbytes > 4096:
+            self._flush()
+            self.socket.sendall(memoryview(array.view(numpy.uint8)))
         else:
-            pass
+            self._write(array.tobytes())
 
-    def _send_rpc_value(self, tags, value, root, function):
+    def _pack_int_list(self, value, bits):
+        # Fast path: convert with numpy and check the range of all elements
+        # at once. Anything that does not convert to an integer array takes
+        # the struct path, which accepts exactly what it used to.
+        try:
+            array = numpy.array(value)
+        except (ValueError, OverflowError):
+            array = None
+        if (array is not None and array.ndim == 1 and len(array)
+                and array.dtype.kind in "biu"):
+            if (array.min() >= -2**(bits-1)
+                    and array.max() <= 2**(bits-1)-1):
+                return array.astype(self.endian + ("i4" if bits == 32 else "i8"))
+            return None
+        try:
+            return struct.pack(self.endian + "%s%s" % (
+                len(value), "l" if bits == 32 else "q"), *value)
+        except struct.error:
+            return None
+
+    def _send_rpc_value(self, tags, index, value, root, function):
+        """Serialize ``value`` with the type that starts at ``tags[index]``,
+        and return the index of the following tag."""
         def check(cond, expected):
             if not cond:
                 raise RPCReturnValueError(
@@ -450,13 +652,16 @@ class CommKernel:
                         value=repr(value), type=expected(),
                         function=function, root=root))
 
-        tag = chr(tags.pop(0))
+        tag = chr(tags[index])
+        index += 1
         if tag == "t":
-            length = tags.pop(0)
+            length = tags[index]
+            index += 1
             check(isinstance(value, tuple) and length == len(value),
                   lambda: "tuple of {}".format(length))
             for elt in value:
-                self._send_rpc_value(tags, elt, root, function)
+                index = self._send_rpc_value(tags, index, elt, root, function)
+            return index
         elif tag == "n":
             check(value is None,
                   lambda: "None")
@@ -501,71 +706,69 @@ class CommKernel:
             check(isinstance(value, list),
                   lambda: "list")
             self._write_int32(len(value))
-            tag_element = chr(tags[0])
+            tag_element = chr(tags[index])
             if tag_element == "b":
                 self._write(bytes(value))
-            elif tag_element == "i":
-                try:
-                    self._write(struct.pack(self.endian + "%sl" % len(value), *value))
-                except struct.error:
-                    raise RPCReturnValueError(
-                        "type mismatch: cannot serialize {value} as {type}".format(
-                            value=repr(value), type="32-bit integer list"))
-            elif tag_element == "I":
-                try:
-                    self._write(struct.pack(self.endian + "%sq" % len(value), *value))
-                except struct.error:
-                    raise RPCReturnValueError(
-                        "type mismatch: cannot serialize {value} as {type}".format(
-                            value=repr(value), type="64-bit integer list"))
+            elif tag_element in "iI":
+                bits = 32 if tag_element == "i" else 64
+                data = self._pack_int_list(value, bits)
+                check(data is not None,
+                      lambda: "{}-bit integer list".format(bits))
             elif tag_element == "f":
-                self._write(struct.pack(self.endian + "%sd" %
-                                        len(value), *value))
+                try:
+                    array = numpy.array(value)
+                except (ValueError, OverflowError):
+                    array = None
+                if (array is not None and array.ndim == 1
+                        and array.dtype.kind in "biuf"):
+                    data = array.astype(self.endian + "d")
+                else:
+                    data = struct.pack(self.endian + "%sd" % len(value), *value)
             else:
                 for elt in value:
-                    tags_copy = bytearray(tags)
-                    self._send_rpc_value(tags_copy, elt, root, function)
-            self._skip_rpc_value(tags)
+                    self._send_rpc_value(tags, index, elt, root, function)
+            if tag_element in "iIf":
+                if isinstance(data, numpy.ndarray):
+                    self._write_array(data)
+                else:
+                    self._write(data)
+            return self._skip_rpc_value(tags, index)
         elif tag == "a":
             check(isinstance(value, numpy.ndarray),
                   lambda: "numpy.ndarray")
-            num_dims = tags.pop(0)
+            num_dims = tags[index]
+            index += 1
             check(num_dims == len(value.shape),
                   lambda: "{}-dimensional numpy.ndarray".format(num_dims))
             for s in value.shape:
                 self._write_int32(s)
-            tag_element = chr(tags[0])
+            tag_element = chr(tags[index])
+            flat = value.reshape((-1,), order="C")
             if tag_element == "b":
-                self._write(value.reshape((-1,), order="C").tobytes())
-            elif tag_element == "i":
-                array = value.reshape(
-                    (-1,), order="C").astype(self.endian + 'i4')
-                self._write(array.tobytes())
-            elif tag_element == "I":
-                array = value.reshape(
-                    (-1,), order="C").astype(self.endian + 'i8')
-                self._write(array.tobytes())
+                self._write_array(numpy.ascontiguousarray(flat))
+            elif tag_element in "iI":
+                bits = 32 if tag_element == "i" else 64
+                if flat.dtype.kind in "iu" and len(flat):
+                    check(flat.min() >= -2**(bits-1) and
+                          flat.max() <= 2**(bits-1)-1,
+                          lambda: "{}-bit int array".format(bits))
+                self._write_array(flat.astype(
+                    self.endian + ("i4" if bits == 32 else "i8")))
             elif tag_element == "f":
-                array = value.reshape(
-                    (-1,), order="C").astype(self.endian + 'd')
-                self._write(array.tobytes())
+                self._write_array(flat.astype(self.endian + 'd'))
             else:
-                for elt in value.reshape((-1,), order="C"):
-                    tags_copy = bytearray(tags)
-                    self._send_rpc_value(tags_copy, elt, root, function)
-            self._skip_rpc_value(tags)
+                for elt in flat:
+                    self._send_rpc_value(tags, index, elt, root, function)
+            return self._skip_rpc_value(tags, index)
         elif tag == "r":
             check(isinstance(value, range),
                   lambda: "range")
-            tags_copy = bytearray(tags)
-            self._send_rpc_value(tags_copy, value.start, root, function)
-            tags_copy = bytearray(tags)
-            self._send_rpc_value(tags_copy, value.stop, root, function)
-            tags_copy = bytearray(tags)
-            self._send_rpc_value(tags_copy, value.step, root, function)
-            tags = tags_copy
+            self._send_rpc_value(tags, index, value.start, root, function)
+            self._send_rpc_value(tags, index, value.stop, root, function)
+            return self._send_rpc_value(tags, index, value.step, root, function)
         else:
             raise IOError("Unknown RPC value tag: {}".format(repr(tag)))
+        return index
 
     def _truncate_message(self, msg, limit=4096):
         if len(msg) > limit:
@@ -587,9 +790,15 @@ class CommKernel:
                      (" (async)" if is_async else ""), args, kwargs, return_tags)
 
         if is_async:
-            service(*args, **kwargs)
+            if self.async_rpc_executor is None:
+                service(*args, **kwargs)
+            else:
+                self.async_rpc_executor.submit(service, args, kwargs)
             return
 
+        # Synchronous RPCs observe the effects of all preceding async RPCs.
+        self._wait_async_rpcs()
+
         try:
             result = service(*args, **kwargs)
         except RPCReturnValueError as exn:
@@ -648,8 +857,7 @@ class CommKernel:
                          service_id, args, kwargs, result)
             self._write_header(Request.RPCReply)
             self._write_bytes(return_tags)
-            self._send_rpc_value(bytearray(return_tags),
-                                 result, result, service)
+            self._send_rpc_value(return_tags, 0, result, result, service)
             self._flush()
 
     def _serve_exception(self, embedding_map, symbolizer, demangler):
@@ -725,16 +933,41 @@ class CommKernel:
             logger.warning(f"{(', '.join(errors[:-1]) + ' and ') if len(errors) > 1 else ''}{errors[-1]} "
                            f"reported during kernel execution")
 
+    def _wait_async_rpcs(self):
+        if self.async_rpc_executor is None:
+            return
+        error = self.async_rpc_executor.wait()
+        stats = self.async_rpc_executor.stats
+        if stats["blocked"]:
+            logger.debug("async RPC queue full %d times (%.3fs) over %d calls",
+                         stats["blocked"], stats["blocked_time"],
+                         stats["submitted"])
+        if error is not None:
+            raise error
+
+    def _log_async_rpc_error(self):
+        # The kernel failure takes precedence over any error raised by the
+        # async RPCs still pending, which is only logged.
+        try:
+            self._wait_async_rpcs()
+        except Exception:
+            logger.error("async RPC failed", exc_info=True)
+
     def serve(self, embedding_map, symbolizer, demangler):
         while True:
             self._read_header()
             if self._read_type == Reply.RPCRequest:
                 self._serve_rpc(embedding_map)
             elif self._read_type == Reply.KernelException:
-                self._serve_exception(embedding_map, symbolizer, demangler)
+                try:
+                    self._serve_exception(embedding_map, symbolizer, demangler)
+                finally:
+                    self._log_async_rpc_error()
             elif self._read_type == Reply.ClockFailure:
+                self._log_async_rpc_error()
                 raise exceptions.ClockFailure
             else:
                 self._read_expect(Reply.KernelFinished)
                 self._process_async_error()
+                self._wait_async_rpcs()
                 return
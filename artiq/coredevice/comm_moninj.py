@@ -11,6 +11,11 @@ __all__ = ["TTLProbe", "TTLOverride", "CommMonInj"]
 logger = logging.getLogger(__name__)
 
 
+_read_size = 64*1024
+_monitor_payload = struct.Struct("<lbq")
+_injection_payload = struct.Struct("<lbb")
+
+
 class TTLProbe(Enum):
     level = 0
     oe = 1
@@ -78,22 +83,49 @@ class CommMonInj:
         packet = struct.pack("<blb", 2, channel, override)
         self._writer.write(packet)
 
+    def set_update_interval(self, interval):
+        """Set the minimum interval, in seconds, between two batches of
+        updates sent to this client. Intermediate values are dropped.
+
+        Only supported when connected to ``aqctl_moninj_proxy``.
+        """
+        packet = struct.pack("<bL", 4, round(interval*1e3))
+        self._writer.write(packet)
+
+    def _parse(self, buffer):
+        """Process the complete packets at the start of the buffer, and return
+        their total length."""
+        position = 0
+        end = len(buffer)
+        while position < end:
+            ty = buffer[position]
+            if ty == 0:
+                if end - position < 1 + _monitor_payload.size:
+                    break
+                channel, probe, value = _monitor_payload.unpack_from(buffer, position + 1)
+                self.monitor_cb(channel, probe, value)
+                position += 1 + _monitor_payload.size
+            elif ty == 1:
+                if end - position < 1 + _injection_payload.size:
+                    break
+                channel, override, value = _injection_payload.unpack_from(buffer, position + 1)
+                self.injection_status_cb(channel, override, value)
+                position += 1 + _injection_payload.size
+            else:
+                raise ValueError("Unknown packet type", bytes([ty]))
+        return position
+
     async def _receive_cr(self):
         try:
+            # Packets are read in large chunks and all those received are
+            # processed at each wakeup.
+            buffer = bytearray()
             while True:
-                ty = await self._reader.read(1)
-                if not ty:
+                data = await self._reader.read(_read_size)
+                if not data:
                     return
-                if ty == b"\x00":
-                    payload = await self._reader.readexactly(13)
-                    channel, probe, value = struct.unpack("<lbq", payload)
-                    self.monitor_cb(channel, probe, value)
-                elif ty == b"\x01":
-                    payload = await self._reader.readexactly(6)
-                    channel, override, value = struct.unpack("<lbb", payload)
-                    self.injection_status_cb(channel, override, value)
-                else:
-                    raise ValueError("Unknown packet type", ty)
+                buffer += data
+                del buffer[:self._parse(buffer)]
         except Exception:
             logger.error("Moninj connection terminating with exception", exc_info=True)
         finally:
@@ -1,7 +1,9 @@
 import os, sys
+import logging
 import numpy
 from inspect import getfullargspec
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 
 from pythonparser import diagnostic
 
@@ -13,19 +15,36 @@ from artiq.language.units import *
 
 from artiq.compiler.module import Module
 from artiq.compiler.embedding import Stitcher
+from artiq.compiler.kernel_cache import KernelDigest, KernelCache
 from artiq.compiler.targets import RV32IMATarget, RV32GTarget, CortexA9Target
 
 from artiq.coredevice.comm_kernel import CommKernel, CommKernelDummy
+from artiq.coredevice.kernel_bundle import KernelBundle
 # Import for side effects (creating the exception classes).
 from artiq.coredevice import exceptions
 
 
+logger = logging.getLogger(__name__)
+
+
 def _render_diagnostic(diagnostic, colored):
     def shorten_path(path):
         return path.replace(artiq_dir, "<artiq>")
     lines = [shorten_path(path) for path in diagnostic.render(colored=colored)]
     return "\n".join(lines)
 
+def _log_timings(function, target, cached):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("kernel %s %s: %s",
+            getattr(function, "__qualname__", function),
+            "loaded from cache" if cached else "compiled",
+            ", ".join("{} {:.1f} ms".format(stage, duration*1e3)
+                      for stage, duration in target.timings.items()))
+
+def _dump_requested():
+    # Cached kernels skip the compiler stages that produce the dumps.
+    return any(var.startswith("ARTIQ_DUMP_") for var in os.environ)
+
 colors_supported = os.name == "posix"
 class _DiagnosticEngine(diagnostic.Engine):
     def render_diagnostic(self, diagnostic):
@@ -85,6 +104,18 @@ class Core:
         (optional).
     :param analyze_at_run_end: automatically trigger the core device analyzer
         proxy after the Experiment's run stage finishes.
+    :param compile_cache_dir: directory of the persistent cache of compiled
+        kernels (optional). When set, kernels whose stitched code and quoted
+        host values are identical to a previously compiled kernel are not
+        compiled again.
+    :param compile_cache_size: size bound of the compiled kernel cache, in bytes.
+    :param async_rpc_queue_size: if non-zero, async RPCs are executed in
+        order on a background thread, and at most this many of them wait to
+        be executed; when the queue is full, reading from the core device
+        pauses until the host catches up. Async RPC functions then run
+        concurrently with the rest of the experiment and must be thread-safe.
+        By default (0), async RPCs are executed on the thread serving the
+        kernel.
     """
 
     kernel_invariants = {
@@ -95,7 +126,9 @@ class Core:
                  host, ref_period,
                  analyzer_proxy=None, analyze_at_run_end=False,
                  ref_multiplier=8,
-                 target="rv32g", satellite_cpu_targets={}):
+                 target="rv32g", satellite_cpu_targets={},
+                 compile_cache_dir=None, compile_cache_size=256*1024*1024,
+                 async_rpc_queue_size=0):
         self.ref_period = ref_period
         self.ref_multiplier = ref_multiplier
         self.satellite_cpu_targets = satellite_cpu_targets
@@ -104,9 +137,14 @@ class Core:
         if host is None:
             self.comm = CommKernelDummy()
         else:
-            self.comm = CommKernel(host)
+            self.comm = CommKernel(host,
+                                   async_rpc_queue_size=async_rpc_queue_size)
         self.analyzer_proxy_name = analyzer_proxy
         self.analyze_at_run_end = analyze_at_run_end
+        if compile_cache_dir is None:
+            self.compile_cache = None
+        else:
+            self.compile_cache = KernelCache(compile_cache_dir, compile_cache_size)
 
         self.first_run = True
         self.dmgr = dmgr
@@ -127,30 +165,73 @@ class Core:
                 attribute_writeback=True, print_as_rpc=True,
                 target=None, destination=0, subkernel_arg_types=[],
                 old_embedding_map=None):
+        _, backend = self._compile_frontend(function, args, kwargs, set_result,
+            attribute_writeback, print_as_rpc, target, destination,
+            subkernel_arg_types, old_embedding_map)
+        return backend()[:5]
+
+    def _compile_frontend(self, function, args, kwargs, set_result,
+                          attribute_writeback, print_as_rpc, target, destination,
+                          subkernel_arg_types, old_embedding_map):
+        # Runs every compilation stage that accesses host objects or the
+        # embedding map, and returns the embedding map together with a callable
+        # that runs the remaining stages (LLVM and linking) and returns the
+        # result of :meth:`compile`, followed by the unstripped library. The
+        # callable may be run in another thread.
         try:
             engine = _DiagnosticEngine(all_errors_are_fatal=True)
-
-            stitcher = Stitcher(engine=engine, core=self, dmgr=self.dmgr,
-                                print_as_rpc=print_as_rpc,
-                                destination=destination, subkernel_arg_types=subkernel_arg_types,
-                                old_embedding_map=old_embedding_map)
-            stitcher.stitch_call(function, args, kwargs, set_result)
-            stitcher.finalize()
-
-            module = Module(stitcher,
-                ref_period=self.ref_period,
-                attribute_writeback=attribute_writeback)
             target = target if target is not None else self.target_cls()
 
-            library = target.compile_and_link([module])
+            with target.timed("stitch"):
+                stitcher = Stitcher(engine=engine, core=self, dmgr=self.dmgr,
+                                    print_as_rpc=print_as_rpc,
+                                    destination=destination, subkernel_arg_types=subkernel_arg_types,
+                                    old_embedding_map=old_embedding_map)
+                stitcher.stitch_call(function, args, kwargs, set_result)
+                stitcher.finalize()
+            embedding_map = stitcher.embedding_map
+
+            digest = None
+            if self.compile_cache is not None and not _dump_requested():
+                with target.timed("cache lookup"):
+                    digest = KernelDigest(stitcher.typedtree, embedding_map, target,
+                                          ref_period=self.ref_period,
+                                          attribute_writeback=attribute_writeback,
+                                          print_as_rpc=print_as_rpc)
+                    if digest.cacheable():
+                        cached = self.compile_cache.get(digest)
+                    else:
+                        digest = cached = None
+                if cached is not None:
+                    library, stripped_library = cached
+                    _log_timings(function, target, cached=True)
+                    return embedding_map, lambda: (
+                        embedding_map, stripped_library,
+                        lambda addresses: target.symbolize(library, addresses),
+                        lambda symbols: target.demangle(symbols),
+                        {}, library)
+
+            with target.timed("module"):
+                module = Module(stitcher,
+                    ref_period=self.ref_period,
+                    attribute_writeback=attribute_writeback)
+            llsource = target.emit_llvm_ir(module)
+        except diagnostic.Error as error:
+            raise CompileError(error.diagnostic) from error
+
+        def backend():
+            llobject = target.assemble(target.compile_llvm_ir(llsource))
+            library = target.link([llobject])
             stripped_library = target.strip(library)
+            if digest is not None:
+                self.compile_cache.put(digest, library, stripped_library)
+            _log_timings(function, target, cached=False)
 
-            return stitcher.embedding_map, stripped_library, \
+            return embedding_map, stripped_library, \
                    lambda addresses: target.symbolize(library, addresses), \
                    lambda symbols: target.demangle(symbols), \
-                   module.subkernel_arg_types
-        except diagnostic.Error as error:
-            raise CompileError(error.diagnostic) from error
+                   module.subkernel_arg_types, library
+        return embedding_map, backend
 
     def _run_compiled(self, kernel_library, embedding_map, symbolizer, demangler):
         if self.first_run:
@@ -173,6 +254,12 @@ class Core:
         return result
 
     def compile_subkernel(self, sid, subkernel_fn, embedding_map, args, subkernel_arg_types, subkernels):
+        destination, backend, object_map = self._compile_subkernel_frontend(
+            sid, subkernel_fn, embedding_map, args, subkernel_arg_types)
+        _, kernel_library, _, _, _, _ = backend()
+        return destination, kernel_library, object_map
+
+    def _compile_subkernel_frontend(self, sid, subkernel_fn, embedding_map, args, subkernel_arg_types):
         # pass self to subkernels (if applicable)
         # assuming the first argument is self
         subkernel_args = getfullargspec(subkernel_fn.artiq_embedded.function)
@@ -183,32 +270,51 @@ class Core:
         destination = subkernel_fn.artiq_embedded.destination
         destination_tgt = self.satellite_cpu_targets[destination]
         target = get_target_cls(destination_tgt)(subkernel_id=sid)
-        object_map, kernel_library, _, _, _ = \
-            self.compile(subkernel_fn, self_arg, {}, attribute_writeback=False,
-                        print_as_rpc=False, target=target, destination=destination, 
-                        subkernel_arg_types=subkernel_arg_types.get(sid, []),
-                        old_embedding_map=embedding_map)
+        object_map, backend = self._compile_frontend(subkernel_fn, self_arg, {}, None,
+            attribute_writeback=False, print_as_rpc=False, target=target,
+            destination=destination, subkernel_arg_types=subkernel_arg_types.get(sid, []),
+            old_embedding_map=embedding_map)
         if object_map.has_rpc():
             raise ValueError("Subkernel must not use RPC")
-        return destination, kernel_library, object_map
+        return destination, backend, object_map
 
     def compile_and_upload_subkernels(self, embedding_map, args, subkernel_arg_types):
+        self._compile_subkernels(embedding_map, args, subkernel_arg_types,
+                                 self.comm.upload_subkernel)
+
+    def _compile_subkernels(self, embedding_map, args, subkernel_arg_types, upload):
+        # Stitching and IR generation run in order in this thread, since
+        # each subkernel extends the embedding map of the previous one. The
+        # LLVM and linking stages, which dominate and release the GIL, run
+        # in a thread pool, and each library is uploaded as soon as it and
+        # all libraries before it are ready.
         subkernels = embedding_map.subkernels()
         subkernels_compiled = []
-        while True:
-            new_subkernels = {}
-            for sid, subkernel_fn in subkernels.items():
-                if sid in subkernels_compiled:
-                    continue
-                destination, kernel_library, embedding_map = \
-                    self.compile_subkernel(sid, subkernel_fn, embedding_map,
-                                        args, subkernel_arg_types, subkernels)
-                self.comm.upload_subkernel(kernel_library, sid, destination)
-                new_subkernels.update(embedding_map.subkernels())
-                subkernels_compiled.append(sid)
-            if new_subkernels == subkernels:
-                break
-            subkernels.update(new_subkernels)
+        pending_uploads = []
+
+        def upload_ready(wait):
+            while pending_uploads and (wait or pending_uploads[0][2].done()):
+                sid, destination, future = pending_uploads.pop(0)
+                _, kernel_library, _, _, _, _ = future.result()
+                upload(kernel_library, sid, destination)
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            while True:
+                new_subkernels = {}
+                for sid, subkernel_fn in subkernels.items():
+                    if sid in subkernels_compiled:
+                        continue
+                    destination, backend, embedding_map = \
+                        self._compile_subkernel_frontend(sid, subkernel_fn, embedding_map,
+                                                         args, subkernel_arg_types)
+                    pending_uploads.append((sid, destination, executor.submit(backend)))
+                    upload_ready(wait=False)
+                    new_subkernels.update(embedding_map.subkernels())
+                    subkernels_compiled.append(sid)
+                if new_subkernels == subkernels:
+                    break
+                subkernels.update(new_subkernels)
+            upload_ready(wait=True)
         # check for messages without a send/recv pair
         unpaired_messages = embedding_map.subkernel_messages_unpaired()
         if unpaired_messages:
@@ -275,6 +381,76 @@ class Core:
 
         return run_precompiled
 
+    def precompile_bundle(self, function, *args, **kwargs):
+        """Precompile a kernel into a :class:`~artiq.coredevice.kernel_bundle.KernelBundle`,
+        which can be saved to a file and run later, possibly from another process,
+        with :meth:`load_precompiled`.
+
+        The same restrictions as for :meth:`precompile` apply. In addition, the
+        host objects used by the kernel (e.g. RPC methods) are looked up again when
+        the bundle is loaded: either by their attribute path from the object the
+        kernel is a method of, or by their module and qualified name.
+        """
+        if not hasattr(function, "artiq_embedded"):
+            raise ValueError("Argument is not a kernel")
+
+        @rpc(flags={"async"})
+        def set_result(new_result):
+            pass
+
+        embedding_map, backend = self._compile_frontend(function, args, kwargs, set_result,
+            attribute_writeback=False, print_as_rpc=True, target=None, destination=0,
+            subkernel_arg_types=[], old_embedding_map=None)
+        embedding_map, stripped_library, _, _, subkernel_arg_types, library = backend()
+        subkernels = []
+        self._compile_subkernels(embedding_map, args, subkernel_arg_types,
+            lambda kernel_library, sid, destination:
+                subkernels.append((sid, destination, kernel_library)))
+
+        roots = {}
+        if hasattr(function, "__self__"):
+            roots["self"] = function.__self__
+        return KernelBundle.from_embedding_map(self.target_cls.__name__,
+            library, stripped_library, embedding_map, roots, set_result, subkernels)
+
+    def load_precompiled(self, bundle, obj=None):
+        """Load a kernel bundle created by :meth:`precompile_bundle` and return a
+        callable that executes it on the core device, like :meth:`precompile`.
+
+        Subkernels of the bundle are uploaded immediately.
+
+        :param bundle: a :class:`~artiq.coredevice.kernel_bundle.KernelBundle`, or the
+            name of a file it was saved to.
+        :param obj: object taking the place of the object the kernel was a method of
+            when looking up host objects by attribute path (typically, the experiment).
+        """
+        if not isinstance(bundle, KernelBundle):
+            bundle = KernelBundle.load(bundle)
+        if bundle.target != self.target_cls.__name__:
+            raise ValueError("Kernel bundle was compiled for target {}, core device "
+                             "uses {}".format(bundle.target, self.target_cls.__name__))
+        target = self.target_cls()
+
+        result = None
+        @rpc(flags={"async"})
+        def set_result(new_result):
+            nonlocal result
+            result = new_result
+
+        roots = {} if obj is None else {"self": obj}
+        embedding_map = bundle.make_embedding_map(roots, set_result)
+        for sid, destination, kernel_library in bundle.subkernels:
+            self.comm.upload_subkernel(kernel_library, sid, destination)
+
+        def run_precompiled():
+            nonlocal result
+            self._run_compiled(bundle.stripped_library, embedding_map,
+                               lambda addresses: target.symbolize(bundle.library, addresses),
+                               lambda symbols: target.demangle(symbols))
+            return result
+
+        return run_precompiled
+
     @portable
     def seconds_to_mu(self, seconds):
         """Convert seconds to the corresponding number of machine units
@@ -0,0 +1,277 @@
+"""
+The :class:`KernelBundle` class holds a precompiled kernel in a form that can
+be stored and run from another process, without stitching or compiling it
+again.
+
+A bundle contains the linked kernel library and the libraries of its
+subkernels, the strings of the embedding map, and a description of each host
+object the kernel refers to (RPC services, exception types). Objects are
+described by their attribute path from the object the kernel was called on
+(e.g. ``self.dataset_helper.update``) or by their module and qualified name,
+and are looked up again when the bundle is loaded.
+
+Bundles are stored as tar archives with the layout written by
+``artiq_compile`` for kernels with subkernels (``main.elf`` and
+``<sid> <destination>.elf``), to which are added the unstripped library
+(``main_debug.elf``, used to symbolize backtraces) and the description of
+the embedding map (``embedding.pyon``).
+"""
+
+import io
+import sys
+import types
+import logging
+import tarfile
+import importlib
+
+from sipyco import pyon
+
+from artiq import __version__ as artiq_version
+from artiq.compiler.embedding import EmbeddingMap
+
+
+logger = logging.getLogger(__name__)
+
+
+__all__ = ["KernelBundle", "is_kernel_bundle"]
+
+
+# Depth of the search for host objects among the attributes of the objects
+# the kernel refers to.
+_search_depth = 3
+
+
+def _attribute_paths(roots):
+    """Map the ids of the objects reachable from the roots through instance
+    attributes to their shortest attribute path."""
+    paths = dict()
+    queue = []
+    for name, obj in roots.items():
+        paths[id(obj)] = (name, )
+        queue.append((obj, (name, )))
+    while queue:
+        obj, path = queue.pop(0)
+        if len(path) > _search_depth:
+            continue
+        try:
+            attributes = vars(obj)
+        except TypeError:
+            continue
+        for attr, value in list(attributes.items()):
+            if attr.startswith("__") or id(value) in paths:
+                continue
+            if isinstance(value, (type(None), bool, int, float, complex,
+                                  str, bytes, list, tuple, dict, set)):
+                continue
+            paths[id(value)] = path + (attr, )
+            queue.append((value, path + (attr, )))
+    return paths
+
+
+def _describe(obj, paths, set_result):
+    if obj is set_result:
+        return ("result", )
+    path = paths.get(id(obj))
+    if path is not None:
+        return ("attr", ) + path
+    if isinstance(obj, types.MethodType):
+        path = paths.get(id(obj.__self__))
+        if path is not None:
+            return ("attr", ) + path + (obj.__func__.__name__, )
+    module = getattr(obj, "__module__", None)
+    qualname = getattr(obj, "__qualname__", None)
+    if (isinstance(module, str) and isinstance(qualname, str)
+            and "<locals>" not in qualname):
+        return ("global", module, qualname)
+    return None
+
+
+class _UnresolvedObject:
+    """Stands for a host object that could not be found when loading a
+    bundle. Calling it (as an RPC) raises an exception, which is reported to
+    the kernel."""
+    def __init__(self, description):
+        self.description = description
+
+    def __call__(self, *args, **kwargs):
+        raise LookupError("host object {!r} of precompiled kernel is not "
+                          "available".format(self.description))
+
+    def __repr__(self):
+        return "<unresolved {!r}>".format(self.description)
+
+
+def _resolve_global(module_name, qualname, roots):
+    module = sys.modules.get(module_name)
+    if module is None:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            module = None
+    candidates = [] if module is None else [module]
+    # Experiment files are imported under generated module names; look up
+    # their globals in the module of the object the kernel was called on.
+    for root in roots.values():
+        root_module = sys.modules.get(type(root).__module__)
+        if root_module is not None and root_module not in candidates:
+            candidates.append(root_module)
+    for candidate in candidates:
+        obj = candidate
+        try:
+            for name in qualname.split("."):
+                obj = getattr(obj, name)
+        except AttributeError:
+            continue
+        return obj
+    raise LookupError
+
+
+def _resolve(description, roots, set_result):
+    if description is None:
+        raise LookupError
+    kind = description[0]
+    if kind == "result":
+        return set_result
+    elif kind == "attr":
+        obj = roots[description[1]]
+        for name in description[2:]:
+            obj = getattr(obj, name)
+        return obj
+    elif kind == "global":
+        return _resolve_global(description[1], description[2], roots)
+    else:
+        raise LookupError
+
+
+def is_kernel_bundle(file):
+    """Return whether the given file is a kernel bundle, as opposed to an
+    archive of kernel libraries without embedding map."""
+    if not tarfile.is_tarfile(file):
+        return False
+    with tarfile.open(file, "r:") as tar:
+        return "embedding.pyon" in tar.getnames()
+
+
+class KernelBundle:
+    """Serialisable precompiled kernel.
+
+    Bundles are created by :meth:`artiq.coredevice.core.Core.precompile_bundle`
+    and run with :meth:`artiq.coredevice.core.Core.load_precompiled`.
+
+    :param target: name of the target class the kernel was compiled for.
+    :param library: linked kernel library.
+    :param stripped_library: the same library, stripped of debug information.
+    :param objects: dictionary mapping object keys of the embedding map to
+        the description of the corresponding host object, or to ``None`` if
+        the object cannot be found again.
+    :param object_current_key: last object key allocated by the compiler.
+    :param strings: strings of the embedding map, in the order of their IDs.
+    :param subkernels: list of ``(sid, destination, library)`` tuples.
+    """
+    def __init__(self, target, library, stripped_library, objects,
+                 object_current_key, strings, subkernels):
+        self.target = target
+        self.library = library
+        self.stripped_library = stripped_library
+        self.objects = objects
+        self.object_current_key = object_current_key
+        self.strings = strings
+        self.subkernels = subkernels
+
+    @classmethod
+    def from_embedding_map(cls, target, library, stripped_library,
+                           embedding_map, roots, set_result, subkernels):
+        """Build a bundle from the result of a compilation.
+
+        :param roots: dictionary of the objects from which attribute paths
+            are taken, e.g. ``{"self": experiment}``.
+        :param set_result: the RPC receiving the return value of the kernel,
+            which is bound again when the bundle is loaded.
+        """
+        paths = _attribute_paths(roots)
+        objects = dict()
+        for key, obj in embedding_map.object_forward_map.items():
+            objects[key] = _describe(obj, paths, set_result)
+        strings = [embedding_map.str_reverse_map[str_id]
+                   for str_id in range(len(embedding_map.str_reverse_map))]
+        return cls(target, library, stripped_library, objects,
+                   embedding_map.object_current_key, strings, subkernels)
+
+    def make_embedding_map(self, roots, set_result):
+        """Create the embedding map used to serve the RPCs and exceptions of
+        the kernel, looking up the host objects from the given roots.
+
+        Objects that cannot be found are replaced by placeholders which
+        raise an exception when called.
+        """
+        embedding_map = EmbeddingMap()
+        for s in self.strings:
+            embedding_map.store_str(s)
+        for key, description in self.objects.items():
+            try:
+                obj = _resolve(description, roots, set_result)
+            except (LookupError, AttributeError):
+                obj = _UnresolvedObject(description)
+                if description is not None:
+                    logger.warning("host object %r of precompiled kernel "
+                                   "not found", description)
+            embedding_map.object_forward_map[key] = obj
+            embedding_map.object_reverse_map[id(obj)] = key
+        embedding_map.object_current_key = self.object_current_key
+        return embedding_map
+
+    def save(self, file):
+        """Write the bundle to a file (name or binary file object)."""
+        description = {
+            "artiq_version": artiq_version,
+            "target": self.target,
+            "objects": self.objects,
+            "object_current_key": self.object_current_key,
+            "strings": self.strings
+        }
+        members = [
+            ("main.elf", self.stripped_library),
+            ("main_debug.elf", self.library),
+            ("embedding.pyon", pyon.encode(description).encode())
+        ]
+        for sid, destination, library in self.subkernels:
+            members.append(("{} {}.elf".format(sid, destination), library))
+
+        if isinstance(file, str):
+            tar = tarfile.open(file, "w:")
+        else:
+            tar = tarfile.open(fileobj=file, mode="w:")
+        with tar:
+            for name, data in members:
+                info = tarfile.TarInfo(name=name)
+                info.size = len(data)
+                tar.addfile(info, fileobj=io.BytesIO(data))
+
+    @classmethod
+    def load(cls, file):
+        """Read a bundle written by :meth:`save`."""
+        if isinstance(file, str):
+            tar = tarfile.open(file, "r:")
+        else:
+            tar = tarfile.open(fileobj=file, mode="r:")
+        with tar:
+            contents = {entry.name: tar.extractfile(entry).read()
+                        for entry in tar if entry.isfile()}
+        try:
+            description = pyon.decode(contents.pop("embedding.pyon").decode())
+            stripped_library = contents.pop("main.elf")
+            library = contents.pop("main_debug.elf")
+        except KeyError as e:
+            raise ValueError("not a kernel bundle") from e
+        if description["artiq_version"] != artiq_version:
+            logger.warning("kernel bundle was compiled with ARTIQ %s, "
+                           "running with ARTIQ %s",
+                           description["artiq_version"], artiq_version)
+        subkernels = []
+        for name, subkernel_library in contents.items():
+            sid, destination = map(int, name.removesuffix(".elf").split(" "))
+            subkernels.append((sid, destination, subkernel_library))
+        subkernels.sort()
+        return cls(description["target"], library, stripped_library,
+                   description["objects"], description["object_current_key"],
+                   description["strings"], subkernels)
@@ -17,6 +17,10 @@ from artiq.tools import elide
 logger = logging.getLogger(__name__)
 
 
+# Minimum interval in seconds between two repaints of the widgets
+_refresh_interval = 1/60
+
+
 class _CancellableLineEdit(QtWidgets.QLineEdit):
     def escapePressedConnect(self, cb):
         self.esc_cb = cb
@@ -451,6 +455,10 @@ class _DeviceManager:
         self.dac_widgets = dict()
         self.channels_cb = lambda: None
 
+        # Widgets updated by moninj are repainted at most once per frame.
+        self.dirty_widgets = set()
+        self.refresh_handle = None
+
     def init_ddb(self, ddb):
         self.ddb = ddb
 
@@ -673,6 +681,20 @@ class _DeviceManager:
         if self.mi_connection is not None:
             self.mi_connection.monitor_probe(enable, spi_channel, channel)
 
+    def mark_dirty(self, widget_uid):
+        self.dirty_widgets.add(widget_uid)
+        if self.refresh_handle is None:
+            self.refresh_handle = asyncio.get_event_loop().call_later(
+                _refresh_interval, self.refresh_dirty)
+
+    def refresh_dirty(self):
+        self.refresh_handle = None
+        dirty_widgets, self.dirty_widgets = self.dirty_widgets, set()
+        for widget_uid in dirty_widgets:
+            widget = self.widgets_by_uid.get(widget_uid)
+            if widget is not None:
+                widget.refresh_display()
+
     def monitor_cb(self, channel, probe, value):
         if channel in self.ttl_widgets:
             widget_uid = self.ttl_widgets[channel]
@@ -681,17 +703,17 @@ class _DeviceManager:
                 widget.cur_level = bool(value)
             elif probe == TTLProbe.oe.value:
                 widget.cur_oe = bool(value)
-            widget.refresh_display()
+            self.mark_dirty(widget_uid)
         elif (channel, probe) in self.dds_widgets:
             widget_uid = self.dds_widgets[(channel, probe)]
             widget = self.widgets_by_uid[widget_uid]
             widget.dds_model.monitor_update(probe, value)
-            widget.refresh_display()
+            self.mark_dirty(widget_uid)
         elif (channel, probe) in self.dac_widgets:
             widget_uid = self.dac_widgets[(channel, probe)]
             widget = self.widgets_by_uid[widget_uid]
             widget.cur_value = value
-            widget.refresh_display()
+            self.mark_dirty(widget_uid)
 
     def injection_status_cb(self, channel, override, value):
         if channel in self.ttl_widgets:
@@ -701,7 +723,7 @@ class _DeviceManager:
                 widget.cur_override = bool(value)
             if override == TTLOverride.level.value:
                 widget.cur_override_level = bool(value)
-            widget.refresh_display()
+            self.mark_dirty(widget_uid)
 
     def disconnect_cb(self):
         logger.error("lost connection to moninj")
@@ -735,6 +757,8 @@ class _DeviceManager:
                      self.setup_dac_monitoring(True, spi_channel, channel)
 
     async def close(self):
+        if self.refresh_handle is not None:
+            self.refresh_handle.cancel()
         self.mi_connector_task.cancel()
         try:
             await asyncio.wait_for(self.mi_connector_task, None)
@@ -1,7 +1,6 @@
 import os
 import asyncio
 import logging
-import bisect
 import itertools
 import math
 
@@ -16,6 +15,8 @@ from sipyco import pyon
 from artiq.tools import exc_to_warning, short_format
 from artiq.coredevice import comm_analyzer
 from artiq.coredevice.comm_analyzer import WaveformType
+from artiq.coredevice.analyzer_trace import (is_analyzer_trace, write_trace,
+                                             AnalyzerTrace)
 from artiq.gui.tools import LayoutWidget, get_open_file_name, get_save_file_name
 from artiq.gui.models import DictSyncTreeSepModel
 from artiq.gui.dndwidgets import VDragScrollArea, VDragDropSplitter
@@ -114,6 +115,58 @@ class _BackgroundItem(pg.GraphicsWidgetAnchor, pg.GraphicsWidget):
         self.item.setBrush(brush)
 
 
+class _MinMaxPyramid:
+    """Multi-resolution index of the minimum and maximum of a waveform.
+
+    Level ``i`` holds the extrema of consecutive buckets of ``factor**(i+1)``
+    points. :meth:`get` uses it to reduce the visible part of the waveform to
+    a few points per pixel, in time proportional to the number of pixels.
+    """
+    factor = 4
+
+    def __init__(self, x, y):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.levels = []
+        size = 1
+        mins = maxs = self.y
+        while len(mins) > 1:
+            starts = np.arange(0, len(mins), self.factor)
+            mins = np.fmin.reduceat(mins, starts)
+            maxs = np.fmax.reduceat(maxs, starts)
+            size *= self.factor
+            self.levels.append((size, mins, maxs))
+
+    def get(self, xmin, xmax, pixels):
+        """Return the points to draw for the given range of x and width in
+        pixels.
+
+        Each bucket of points is drawn as its first, minimum, maximum and
+        last value, at the position of its first point.
+        """
+        n = len(self.x)
+        start = max(int(np.searchsorted(self.x, xmin, "right")) - 1, 0)
+        end = min(int(np.searchsorted(self.x, xmax, "right")) + 1, n)
+        level = None
+        for size, mins, maxs in self.levels:
+            if (end - start) // size < pixels:
+                break
+            level = size, mins, maxs
+        if level is None:
+            return self.x[start:end], self.y[start:end]
+        size, mins, maxs = level
+        first_bucket = start // size
+        last_bucket = -(-end // size)
+        firsts = np.arange(first_bucket, last_bucket) * size
+        lasts = np.minimum(firsts + size, n) - 1
+        y = np.empty(4 * len(firsts))
+        y[0::4] = self.y[firsts]
+        y[1::4] = mins[first_bucket:last_bucket]
+        y[2::4] = maxs[first_bucket:last_bucket]
+        y[3::4] = self.y[lasts]
+        return np.repeat(self.x[firsts], 4), y
+
+
 class _BaseWaveform(pg.PlotWidget):
     cursorMove = QtCore.pyqtSignal(float)
 
@@ -137,8 +190,8 @@ class _BaseWaveform(pg.PlotWidget):
         self.precision = precision
         self.unit = unit
 
-        self.x_data = []
-        self.y_data = []
+        self.x_data = np.empty(0)
+        self.y_data = np.empty(0)
 
         self.plot_item = self.getPlotItem()
         self.plot_item.hideButtons()
@@ -153,7 +206,10 @@ class _BaseWaveform(pg.PlotWidget):
 
         self.view_box = self.plot_item.getViewBox()
         self.view_box.setMouseEnabled(x=True, y=False)
-        self.view_box.disableAutoRange(axis=pg.ViewBox.YAxis)
+        self.view_box.disableAutoRange()
+        self.view_box.sigXRangeChanged.connect(self._update_plot)
+        self.view_box.sigResized.connect(self._update_plot)
+        self._pyramid = None
         self.view_box.setLimits(xMin=0, minXRange=20)
 
         self.title_label = pg.LabelItem(self.name, parent=self.plot_item)
@@ -181,10 +237,29 @@ class _BaseWaveform(pg.PlotWidget):
         self.view_box.setLimits(xMax=stopped_x)
 
     def setData(self, data):
+        # data is a pair of arrays holding the times and values, or an
+        # empty list for channels without data
         if len(data) == 0:
-            self.x_data, self.y_data = [], []
+            self.x_data, self.y_data = np.empty(0), np.empty(0)
         else:
-            self.x_data, self.y_data = zip(*data)
+            self.x_data, self.y_data = data
+
+    def setPlotData(self, x, y):
+        """Set the points to draw. Only the visible ones are given to
+        pyqtgraph, decimated to the resolution of the view."""
+        self._pyramid = _MinMaxPyramid(x, y)
+        self._update_plot()
+
+    def _update_plot(self, *args):
+        if self._pyramid is None:
+            return
+        xmin, xmax = self.view_box.viewRange()[0]
+        pixels = max(int(self.view_box.width()), 1)
+        self.plot_data_item.setData(*self._pyramid.get(xmin, xmax, pixels))
+        self._update_markers(xmin, xmax, pixels)
+
+    def _update_markers(self, xmin, xmax, pixels):
+        pass
 
     def onDataChange(self, data):
         raise NotImplementedError
@@ -193,7 +268,7 @@ class _BaseWaveform(pg.PlotWidget):
         self.cursor.setValue(x)
         if len(self.x_data) < 1:
             return
-        ind = bisect.bisect_left(self.x_data, x) - 1
+        ind = np.searchsorted(self.x_data, x) - 1
         dr = self.plot_data_item.dataRect()
         self.cursor_y = None
         if dr is not None and 0 <= ind < len(self.y_data):
@@ -228,40 +303,48 @@ class BitWaveform(_BaseWaveform):
     def __init__(self, name, width, precision, unit, parent=None):
         _BaseWaveform.__init__(self, name, width, precision, unit, parent)
         self.plot_item.showGrid(x=True, y=False)
-        self._arrows = []
+        # marks values written again without change
+        self._arrows = pg.ScatterPlotItem(
+            symbol="t1", size=15,
+            pen=pg.mkPen(200, 200, 200), brush=pg.mkBrush(200, 200, 200))
+        self.addItem(self._arrows)
+        self._arrows_x = np.empty(0)
+        self._arrows_y = np.empty(0)
+
+    def _update_markers(self, xmin, xmax, pixels):
+        start = np.searchsorted(self._arrows_x, xmin, "left")
+        end = np.searchsorted(self._arrows_x, xmax, "right")
+        x = self._arrows_x[start:end]
+        y = self._arrows_y[start:end]
+        if len(x) > pixels and xmax > xmin:
+            # keep one marker per pixel and level
+            pixel = ((x - xmin) * (pixels / (xmax - xmin))).astype(np.int64)
+            _, first = np.unique(pixel * 3 + (y * 2).astype(np.int64),
+                                 return_index=True)
+            first.sort()
+            x = x[first]
+            y = y[first]
+        self._arrows.setData(x=x, y=y)
 
     def onDataChange(self, data):
         try:
             self.setData(data)
-            for arw in self._arrows:
-                self.removeItem(arw)
-            self._arrows = []
-            l = len(data)
-            display_y = np.empty(l)
-            display_x = np.empty(l)
-            display_map = {
-                "X": 0.5,
-                "1": 1,
-                "0": 0
-            }
-            previous_y = None
-            for i, coord in enumerate(data):
-                x, y = coord
-                dis_y = display_map[y]
-                if previous_y == y:
-                    arw = pg.ArrowItem(pxMode=True, angle=90)
-                    self.addItem(arw)
-                    self._arrows.append(arw)
-                    arw.setPos(x, dis_y)
-                display_y[i] = dis_y
-                display_x[i] = x
-                previous_y = y
-            self.plot_data_item.setData(x=display_x, y=display_y)
+            values = self.y_data.astype(str)
+            display_y = np.full(len(values), np.nan)
+            for value, dis_y in ("X", 0.5), ("1", 1), ("0", 0):
+                display_y[values == value] = dis_y
+            if np.isnan(display_y).any():
+                raise ValueError("invalid bit value")
+            display_x = np.asarray(self.x_data, dtype=float)
+            repeated = np.flatnonzero(values[1:] == values[:-1]) + 1
+            self._arrows_x = display_x[repeated]
+            self._arrows_y = display_y[repeated]
+            self.setPlotData(display_x, display_y)
         except:
             logger.error("Error when displaying waveform: %s", self.name, exc_info=True)
-            for arw in self._arrows:
-                self.removeItem(arw)
-            self.plot_data_item.setData(x=[], y=[])
+            self._arrows_x = np.empty(0)
+            self._arrows_y = np.empty(0)
+            self.setPlotData([], [])
 
     def onCursorMove(self, x):
         _BaseWaveform.onCursorMove(self, x)
@@ -278,14 +361,14 @@ class AnalogWaveform(_BaseWaveform):
     def onDataChange(self, data):
         try:
             self.setData(data)
-            self.plot_data_item.setData(x=self.x_data, y=self.y_data)
-            if len(data) > 0:
-                max_y = max(self.y_data)
-                min_y = min(self.y_data)
+            self.setPlotData(self.x_data, self.y_data)
+            if len(self.y_data) > 0:
+                max_y = np.max(self.y_data)
+                min_y = np.min(self.y_data)
                 self.plot_item.setRange(yRange=(min_y, max_y), padding=0.1)
         except:
             logger.error("Error when displaying waveform: %s", self.name, exc_info=True)
-            self.plot_data_item.setData(x=[], y=[])
+            self.setPlotData([], [])
 
     def onCursorMove(self, x):
         _BaseWaveform.onCursorMove(self, x)
@@ -299,52 +382,62 @@ class AnalogWaveform(_BaseWaveform):
 class BitVectorWaveform(_BaseWaveform):
     def __init__(self, name, width, precision, unit, parent=None):
         _BaseWaveform.__init__(self, name, width, precision, parent)
-        self._labels = []
+        # labels are created when they first become visible
+        self._labels = dict()
+        self._shown_labels = []
         self._format_string = "{:0=" + str(math.ceil(width / 4)) + "X}"
         self.view_box.sigTransformChanged.connect(self._update_labels)
         self.plot_item.showGrid(x=True, y=False)
 
+    def _get_label(self, i):
+        lbl = self._labels.get(i)
+        if lbl is None:
+            lbl = pg.TextItem(
+                self._format_string.format(int(self.y_data[i], 2)), anchor=(0, 0.5))
+            lbl.setPos(self.x_data[i], 0.5)
+            lbl.setTextWidth(100)
+            self._labels[i] = lbl
+        return lbl
+
+    def _remove_labels(self):
+        for lbl in self._shown_labels:
+            self.removeItem(lbl)
+        self._shown_labels = []
+
     def _update_labels(self):
-        for label in self._labels:
-            self.removeItem(label)
+        self._remove_labels()
         xmin, xmax = self.view_box.viewRange()[0]
-        left_label_i = bisect.bisect_left(self.x_data, xmin)
-        right_label_i = bisect.bisect_right(self.x_data, xmax) + 1
+        left_label_i = int(np.searchsorted(self.x_data, xmin, "left"))
+        right_label_i = int(np.searchsorted(self.x_data, xmax, "right")) + 1
+        # Labels are at least one pixel wide: when there are more values in
+        # view than pixels, none of them fits.
+        if right_label_i - left_label_i > self.view_box.width():
+            return
         for i, j in itertools.pairwise(range(left_label_i, right_label_i)):
             x1 = self.x_data[i]
             x2 = self.x_data[j] if j < len(self.x_data) else self.stopped_x
-            lbl = self._labels[i]
+            lbl = self._get_label(i)
             bounds = lbl.boundingRect()
             bounds_view = self.view_box.mapSceneToView(bounds)
             if bounds_view.boundingRect().width() < x2 - x1:
                 self.addItem(lbl)
+                self._shown_labels.append(lbl)
 
     def onDataChange(self, data):
         try:
+            self._remove_labels()
+            self._labels = dict()
             self.setData(data)
-            for lbl in self._labels:
-                self.plot_item.removeItem(lbl)
-            self._labels = []
-            l = len(data)
-            display_x = np.empty(l * 2)
-            display_y = np.empty(l * 2)
-            for i, coord in enumerate(data):
-                x, y = coord
-                display_x[i * 2] = x
-                display_x[i * 2 + 1] = x
-                display_y[i * 2] = 0
-                display_y[i * 2 + 1] = int(int(y) != 0)
-                lbl = pg.TextItem(
-                    self._format_string.format(int(y, 2)), anchor=(0, 0.5))
-                lbl.setPos(x, 0.5)
-                lbl.setTextWidth(100)
-                self._labels.append(lbl)
-            self.plot_data_item.setData(x=display_x, y=display_y)
+            display_x = np.repeat(np.asarray(self.x_data, dtype=float), 2)
+            display_y = np.zeros(len(display_x))
+            # values are binary strings
+            display_y[1::2] = np.char.find(self.y_data.astype(str), "1") >= 0
+            self.setPlotData(display_x, display_y)
         except:
             logger.error("Error when displaying waveform: %s", self.name, exc_info=True)
-            for lbl in self._labels:
-                self.plot_item.removeItem(lbl)
-            self.plot_data_item.setData(x=[], y=[])
+            self._remove_labels()
+            self._labels = dict()
+            self.setPlotData([], [])
 
     def onCursorMove(self, x):
         _BaseWaveform.onCursorMove(self, x)
@@ -369,31 +462,19 @@ class LogWaveform(_BaseWaveform):
             for lbl in self._labels:
                 self.plot_item.removeItem(lbl)
             self._labels = []
-            self.plot_data_item.setData(
-                x=self.x_data, y=np.ones(len(self.x_data)))
-            if len(data) == 0:
-                return
-            old_x = data[0][0]
-            old_msg = data[0][1]
-            for x, msg in data[1:]:
-                if x == old_x:
-                    old_msg += "\n" + msg
-                else:
-                    lbl = pg.TextItem(old_msg)
-                    self.addItem(lbl)
-                    self._labels.append(lbl)
-                    lbl.setPos(old_x, 1)
-                    old_msg = msg
-                    old_x = x
-            lbl = pg.TextItem(old_msg)
-            self.addItem(lbl)
-            self._labels.append(lbl)
-            lbl.setPos(old_x, 1)
+            self.setPlotData(self.x_data, np.ones(len(self.x_data)))
+            for x, group in itertools.groupby(
+                    zip(self.x_data.tolist(), self.y_data.tolist()),
+                    key=lambda entry: entry[0]):
+                lbl = pg.TextItem("\n".join(msg for _, msg in group))
+                self.addItem(lbl)
+                self._labels.append(lbl)
+                lbl.setPos(x, 1)
         except:
             logger.error("Error when displaying waveform: %s", self.name, exc_info=True)
             for lbl in self._labels:
                 self.plot_item.removeItem(lbl)
-            self.plot_data_item.setData(x=[], y=[])
+            self.setPlotData([], [])
 
 
 # pg.GraphicsView ignores dragEnterEvent but not dragLeaveEvent
@@ -714,7 +795,13 @@ class WaveformDock(QtWidgets.QDockWidget):
         self._waveform_model = _WaveformModel()
 
         self._ddb = None
+        self._rtio_channels = dict()
         self._dump = None
+        # indexed trace file, of which only the RTIO channels of the displayed
+        # waveforms are converted (all of them if None)
+        self._trace = None
+        self._trace_filename = None
+        self._trace_channels = None
 
         self._waveform_data = {
             "timescale": 1,
@@ -762,6 +849,7 @@ class WaveformDock(QtWidgets.QDockWidget):
         self._file_menu = QtWidgets.QMenu()
         self._add_async_action("Open trace...", self.load_trace)
         self._add_async_action("Save trace...", self.save_trace)
+        self._add_async_action("Save indexed trace...", self.save_indexed_trace)
         self._add_async_action("Save trace as VCD...", self.save_vcd)
         self._add_async_action("Open channel list...", self.load_channels)
         self._add_async_action("Save channel list...", self.save_channels)
@@ -793,16 +881,58 @@ class WaveformDock(QtWidgets.QDockWidget):
     def _add_channels(self):
         channels = self._add_channel_dialog.channels
         count = self._waveform_model.rowCount()
+        self._load_trace_channels([channel[0] for channel in channels])
         self._waveform_model.extend(channels)
         self._waveform_model.update_data(self._waveform_data['data'],
                                          count,
                                          count + len(channels))
 
+    def _close_trace(self):
+        if self._trace is not None:
+            self._trace.close()
+        self._trace = None
+        self._trace_filename = None
+
+    def _load_trace_channels(self, names):
+        if self._trace is None or self._trace_channels is None:
+            return
+        channels = {self._trace.log_channel}
+        for name in names:
+            if name.startswith("logs/"):
+                continue
+            if name not in self._rtio_channels:
+                # e.g. rtio_slack, computed from all messages
+                channels = None
+                break
+            channels.add(self._rtio_channels[name])
+        if channels is not None:
+            if channels <= self._trace_channels:
+                return
+            channels |= self._trace_channels
+        decoded_dump = self._trace.get_decoded_dump(channels)
+        self._trace_channels = channels
+        self._waveform_data.update(
+            comm_analyzer.decoded_dump_to_waveform_data(self._ddb, decoded_dump))
+
+    def _open_trace(self, filename):
+        self._close_trace()
+        self._dump = None
+        self._trace = AnalyzerTrace(filename)
+        self._trace_filename = filename
+        self._trace_channels = set()
+        self._load_trace_channels(
+            [row[0] for row in self._waveform_model.backing_struct])
+        self._show_waveform_data()
+
     def on_dump_receive(self, dump):
+        self._close_trace()
         self._dump = dump
         decoded_dump = comm_analyzer.decode_dump(dump)
         waveform_data = comm_analyzer.decoded_dump_to_waveform_data(self._ddb, decoded_dump)
         self._waveform_data.update(waveform_data)
+        self._show_waveform_data()
+
+    def _show_waveform_data(self):
         self._channel_model.update(self._waveform_data['logs'])
         self._waveform_model.update_all(self._waveform_data['data'])
         self._waveform_view.setStoppedX(self._waveform_data['stopped_x'])
@@ -820,9 +950,12 @@ class WaveformDock(QtWidgets.QDockWidget):
             return
         self._current_dir = os.path.dirname(filename)
         try:
-            with open(filename, 'rb') as f:
-                dump = f.read()
-            self.on_dump_receive(dump)
+            if is_analyzer_trace(filename):
+                self._open_trace(filename)
+            else:
+                with open(filename, 'rb') as f:
+                    dump = f.read()
+                self.on_dump_receive(dump)
         except:
             logger.error("Failed to open analyzer trace", exc_info=True)
 
@@ -846,8 +979,36 @@ class WaveformDock(QtWidgets.QDockWidget):
         except:
             logger.error("Failed to save analyzer trace", exc_info=True)
 
+    def _get_decoded_dump(self):
+        if self._dump is not None:
+            return comm_analyzer.decode_dump(self._dump)
+        else:
+            return self._trace.get_decoded_dump()
+
+    async def save_indexed_trace(self):
+        if self._dump is None and self._trace is None:
+            logger.error("No analyzer trace stored in dashboard, "
+                         "try loading from file or fetching from device")
+            return
+        try:
+            filename = await get_save_file_name(
+                self,
+                "Save Indexed Analyzer Trace",
+                self._current_dir,
+                "All files (*.*)")
+        except asyncio.CancelledError:
+            return
+        self._current_dir = os.path.dirname(filename)
+        if (self._trace_filename is not None
+                and os.path.abspath(filename) == os.path.abspath(self._trace_filename)):
+            return
+        try:
+            write_trace(filename, self._get_decoded_dump())
+        except:
+            logger.error("Failed to save indexed analyzer trace", exc_info=True)
+
     async def save_vcd(self):
-        if self._dump is None:
+        if self._dump is None and self._trace is None:
             logger.error("No analyzer trace stored in dashboard, "
                          "try loading from file or fetching from device")
             return
@@ -861,7 +1022,7 @@ class WaveformDock(QtWidgets.QDockWidget):
             return
         self._current_dir = os.path.dirname(filename)
         try:
-            decoded_dump = comm_analyzer.decode_dump(self._dump)
+            decoded_dump = self._get_decoded_dump()
             with open(filename, 'w') as f:
                 comm_analyzer.decoded_dump_to_vcd(f, self._ddb, decoded_dump)
         except:
@@ -879,6 +1040,7 @@ class WaveformDock(QtWidgets.QDockWidget):
         self._current_dir = os.path.dirname(filename)
         try:
             channel_list = pyon.load_file(filename)
+            self._load_trace_channels([row[0] for row in channel_list])
             self._waveform_model.import_list(channel_list)
             self._waveform_model.update_all(self._waveform_data['data'])
         except:
@@ -904,6 +1066,7 @@ class WaveformDock(QtWidgets.QDockWidget):
         channel_list = comm_analyzer.get_channel_list(self._ddb)
         self._channel_model.clear()
         self._channel_model.update(channel_list)
+        self._rtio_channels = comm_analyzer.get_rtio_channels(self._ddb)
         desc = self._ddb.get("core_analyzer")
         if desc is not None:
             addr = desc["host"]
@@ -67,6 +67,10 @@ fn write_sync<W>(writer: &mut W) -> Result<(), IoError<W::WriteError>>
     writer.write_all(&[0x5a; 4])
 }
 
+/// Optional protocol features supported by this runtime, advertised in the
+/// `SystemInfo` reply.
+const CAPABILITIES: &str = ";capabilities=resident_kernel";
+
 #[derive(Debug)]
 pub enum Request {
     SystemInfo,
@@ -86,6 +90,9 @@ pub enum Request {
     },
 
     UploadSubkernel { id: u32, destination: u8, kernel: Vec<u8> },
+
+    UploadResidentKernel { digest: Vec<u8>, kernel: Vec<u8> },
+    LoadResidentKernel { digest: Vec<u8> },
 }
 
 #[derive(Debug)]
@@ -111,6 +118,8 @@ pub enum Reply<'a> {
 
     RpcRequest { async: bool },
 
+    ResidentKernelMismatch,
+
     ClockFailure,
 }
 
@@ -145,6 +154,14 @@ impl Request {
                 kernel: reader.read_bytes()?
             },
 
+            10 => Request::UploadResidentKernel {
+                digest: reader.read_bytes()?,
+                kernel: reader.read_bytes()?
+            },
+            11 => Request::LoadResidentKernel {
+                digest: reader.read_bytes()?
+            },
+
             ty  => return Err(Error::UnknownPacket(ty))
         })
     }
@@ -171,7 +188,11 @@ impl<'a> Reply<'a> {
             Reply::SystemInfo { ident, finished_cleanly } => {
                 writer.write_u8(2)?;
                 writer.write(b"AROR")?;
-                writer.write_string(ident)?;
+                // The capabilities of the runtime are appended to the
+                // identifier as an extra field, which older hosts ignore.
+                writer.write_u32((ident.len() + CAPABILITIES.len()) as u32)?;
+                writer.write_all(ident.as_bytes())?;
+                writer.write_all(CAPABILITIES.as_bytes())?;
                 writer.write_u8(finished_cleanly as u8)?;
             },
 
@@ -237,6 +258,10 @@ impl<'a> Reply<'a> {
                 writer.write_u8(async as u8)?;
             },
 
+            Reply::ResidentKernelMismatch => {
+                writer.write_u8(11)?;
+            },
+
             Reply::ClockFailure => {
                 writer.write_u8(15)?;
             },
@@ -131,7 +131,9 @@ macro_rules! unexpected {
 struct Congress {
     cache: Cache,
     dma_manager: DmaManager,
-    finished_cleanly: Cell<bool>
+    finished_cleanly: Cell<bool>,
+    // digest and library of the last kernel uploaded with UploadResidentKernel
+    resident_kernel: Option<(Vec<u8>, Vec<u8>)>
 }
 
 impl Congress {
@@ -139,7 +141,8 @@ impl Congress {
         Congress {
             cache: Cache::new(),
             dma_manager: DmaManager::new(),
-            finished_cleanly: Cell::new(true)
+            finished_cleanly: Cell::new(true),
+            resident_kernel: None
         }
     }
 }
@@ -198,6 +201,8 @@ fn host_read<R>(reader: &mut R) -> Result<host::Request, Error<R::ReadError>>
     let request = host::Request::read_from(reader)?;
     match &request {
         &host::Request::LoadKernel(_) => debug!("comm<-host LoadLibrary(...)"),
+        &host::Request::UploadResidentKernel { .. } =>
+            debug!("comm<-host UploadResidentKernel(...)"),
         &host::Request::UploadSubkernel { id, destination, kernel: _} => debug!(
             "comm<-host UploadSubkernel(id: {}, destination: {}, ...)", id, destination),
         _ => debug!("comm<-host {:?}", request)
@@ -383,6 +388,42 @@ fn process_host_message(io: &Io, _aux_mutex: &Mutex, _ddma_mutex: &Mutex, _subke
                 }
             }
         },
+        host::Request::UploadResidentKernel { digest, kernel } => {
+            session.congress.resident_kernel = None;
+            match unsafe { kern_load(io, session, &kernel) } {
+                Ok(()) => {
+                    session.congress.resident_kernel = Some((digest, kernel));
+                    host_write(stream, host::Reply::LoadCompleted)?
+                }
+                Err(error) => {
+                    let mut description = String::new();
+                    write!(&mut description, "{}", error).unwrap();
+                    host_write(stream, host::Reply::LoadFailed(&description))?;
+                    kern_acknowledge()?;
+                }
+            }
+        },
+        host::Request::LoadResidentKernel { digest } => {
+            match session.congress.resident_kernel.take() {
+                Some((resident_digest, kernel)) if resident_digest == digest => {
+                    let result = unsafe { kern_load(io, session, &kernel) };
+                    session.congress.resident_kernel = Some((resident_digest, kernel));
+                    match result {
+                        Ok(()) => host_write(stream, host::Reply::LoadCompleted)?,
+                        Err(error) => {
+                            let mut description = String::new();
+                            write!(&mut description, "{}", error).unwrap();
+                            host_write(stream, host::Reply::LoadFailed(&description))?;
+                            kern_acknowledge()?;
+                        }
+                    }
+                }
+                resident_kernel => {
+                    session.congress.resident_kernel = resident_kernel;
+                    host_write(stream, host::Reply::ResidentKernelMismatch)?
+                }
+            }
+        },
         host::Request::RunKernel =>
             match kern_run(session) {
                 Ok(()) => (),
@@ -9,32 +9,96 @@ from sipyco.asyncio_tools import AsyncioServer, SignalHandler, atexit_register_c
 from sipyco.pc_rpc import Server
 from sipyco import common_args
 
-from artiq.coredevice.comm_analyzer import get_analyzer_dump, ANALYZER_MAGIC
+from artiq.coredevice.comm_analyzer import (
+    ANALYZER_MAGIC, DUMP_HEADER_SIZE, get_dump_length, merge_dumps)
 
 
 logger = logging.getLogger(__name__)
 
 
+class _Dump:
+    """Analyzer dump, which is forwarded to the clients while it is received
+    from the core device."""
+    def __init__(self, data, received=None):
+        self.data = data
+        self.received = len(data) if received is None else received
+        self.failed = False
+        self._progress = asyncio.Condition()
+
+    @property
+    def complete(self):
+        return self.received == len(self.data)
+
+    async def update(self, received):
+        async with self._progress:
+            self.received = received
+            self._progress.notify_all()
+
+    async def fail(self):
+        async with self._progress:
+            self.failed = True
+            self._progress.notify_all()
+
+    async def wait(self, position):
+        """Wait until more than ``position`` bytes have been received, and
+        return the number of bytes received."""
+        async with self._progress:
+            await self._progress.wait_for(
+                lambda: self.received > position or self.failed)
+        if self.failed:
+            raise ConnectionAbortedError("analyzer dump was not received completely")
+        return self.received
+
+
+class _Recipient:
+    def __init__(self):
+        self._dumps = []
+        self._dumps_available = asyncio.Event()
+
+    def put(self, dump):
+        # Dumps are received one at a time: those not yet sent to a slow
+        # client are complete, and are merged instead of queued.
+        complete = [pending for pending in self._dumps if pending.complete]
+        if len(complete) > 1:
+            complete = [_Dump(merge_dumps([pending.data
+                                           for pending in complete]))]
+        self._dumps = complete + [dump]
+        self._dumps_available.set()
+
+    async def get(self):
+        while True:
+            while not self._dumps:
+                self._dumps_available.clear()
+                await self._dumps_available.wait()
+            dump = self._dumps.pop(0)
+            if not dump.failed:
+                return dump
+
+
 # simplified version of sipyco Broadcaster
 class ProxyServer(AsyncioServer):
-    def __init__(self, queue_limit=8):
+    def __init__(self):
         AsyncioServer.__init__(self)
         self._recipients = set()
-        self._queue_limit = queue_limit
 
     async def _handle_connection_cr(self, reader, writer):
         try:
             writer.write(ANALYZER_MAGIC)
-            queue = asyncio.Queue(self._queue_limit)
-            self._recipients.add(queue)
+            recipient = _Recipient()
+            self._recipients.add(recipient)
             try:
                 while True:
-                    dump = await queue.get()
-                    writer.write(dump)
-                    # raise exception on connection error
-                    await writer.drain()
+                    dump = await recipient.get()
+                    sent = 0
+                    view = memoryview(dump.data)
+                    while sent < len(view):
+                        received = await dump.wait(sent)
+                        writer.write(view[sent:received])
+                        sent = received
+                        # raise exception on connection error
+                        await writer.drain()
             finally:
-                self._recipients.remove(queue)
+                self._recipients.remove(recipient)
         except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
             # receivers disconnecting are a normal occurence
             pass
@@ -43,7 +107,7 @@ class ProxyServer(AsyncioServer):
 
     def distribute(self, dump):
         for recipient in self._recipients:
-            recipient.put_nowait(dump)
+            recipient.put(dump)
 
 
 class ProxyControl:
@@ -51,17 +115,40 @@ class ProxyControl:
         self.distribute_cb = distribute_cb
         self.core_addr = core_addr
         self.core_port = core_port
+        self._lock = asyncio.Lock()
 
     def ping(self):
         return True
 
-    def trigger(self):
+    async def _get_dump(self):
+        reader, writer = await asyncio.open_connection(
+            self.core_addr, self.core_port)
         try:
-            dump = get_analyzer_dump(self.core_addr, self.core_port)
+            header = await reader.readexactly(DUMP_HEADER_SIZE)
+            # The dump is sent to the clients as it is read into this buffer.
+            dump = _Dump(bytearray(get_dump_length(header)), len(header))
+            dump.data[:len(header)] = header
             self.distribute_cb(dump)
-        except:
-            logger.warning("Trigger failed:", exc_info=True)
-            raise
+            try:
+                while not dump.complete:
+                    chunk = await reader.read(len(dump.data) - dump.received)
+                    if not chunk:
+                        raise ConnectionError("analyzer dump is truncated")
+                    dump.data[dump.received:dump.received + len(chunk)] = chunk
+                    await dump.update(dump.received + len(chunk))
+            except:
+                await dump.fail()
+                raise
+        finally:
+            writer.close()
+
+    async def trigger(self):
+        async with self._lock:
+            try:
+                await self._get_dump()
+            except:
+                logger.warning("Trigger failed:", exc_info=True)
+                raise
 
 
 def get_argparser():
@@ -24,6 +24,8 @@ class EventType(Enum):
 class MonitorMux:
     def __init__(self):
         self.listeners = dict()
+        # Latest value of each monitored event, sent to new listeners.
+        self.values = dict()
         self.comm_moninj = None
 
     def _monitor(self, listener, event):
@@ -44,6 +46,8 @@ class MonitorMux:
             logger.warning("listener trying to subscribe twice to %s", event)
         else:
             listeners.append(listener)
+            if event in self.values:
+                listener.event_cb(event, self.values[event])
 
     def _unmonitor(self, listener, event):
         try:
@@ -55,16 +59,21 @@ class MonitorMux:
         except ValueError:
             logger.warning("listener trying to unsubscribe from %s, but was not subscribed", event)
             return
+        listener.discard_event(event)
         if not listeners:
-            del self.listeners[event]
-            if event[0] == EventType.PROBE:
-                logger.debug("stopped monitoring channel %d probe %d", event[1], event[2])
-                self.comm_moninj.monitor_probe(False, event[1], event[2])
-            elif event[0] == EventType.INJECTION:
-                logger.debug("stopped monitoring channel %d injection %d", event[1], event[2])
-                self.comm_moninj.monitor_injection(False, event[1], event[2])
-            else:
-                raise ValueError
+            self._stop_monitoring(event)
+
+    def _stop_monitoring(self, event):
+        del self.listeners[event]
+        self.values.pop(event, None)
+        if event[0] == EventType.PROBE:
+            logger.debug("stopped monitoring channel %d probe %d", event[1], event[2])
+            self.comm_moninj.monitor_probe(False, event[1], event[2])
+        elif event[0] == EventType.INJECTION:
+            logger.debug("stopped monitoring channel %d injection %d", event[1], event[2])
+            self.comm_moninj.monitor_injection(False, event[1], event[2])
+        else:
+            raise ValueError
 
     def monitor_probe(self, listener, enable, channel, probe):
         if enable:
@@ -84,14 +93,10 @@ class MonitorMux:
         except KeyError:
             # We may still receive buffered events shortly after an unsubscription. They can be ignored.
             logger.debug("received event %s but no listener", event)
-            listeners = []
+            return
+        self.values[event] = value
         for listener in listeners:
-            if event[0] == EventType.PROBE:
-                listener.monitor_cb(event[1], event[2], value)
-            elif event[0] == EventType.INJECTION:
-                listener.injection_status_cb(event[1], event[2], value)
-            else:
-                raise ValueError
+            listener.event_cb(event, value)
 
     def monitor_cb(self, channel, probe, value):
         self._event_cb((EventType.PROBE, channel, probe), value)
@@ -106,27 +111,62 @@ class MonitorMux:
             except ValueError:
                 pass
             if not listeners:
-                del self.listeners[event]
-                if event[0] == EventType.PROBE:
-                    logger.debug("stopped monitoring channel %d probe %d", event[1], event[2])
-                    self.comm_moninj.monitor_probe(False, event[1], event[2])
-                elif event[0] == EventType.INJECTION:
-                    logger.debug("stopped monitoring channel %d injection %d", event[1], event[2])
-                    self.comm_moninj.monitor_injection(False, event[1], event[2])
-                else:
-                    raise ValueError
+                self._stop_monitoring(event)
 
     def disconnect_cb(self):
         self.listeners.clear()
+        self.values.clear()
 
 
 class ProxyConnection:
-    def __init__(self, monitor_mux, reader, writer):
+    """Connection of a client to the proxy.
+
+    Only the latest value of each event is kept until it is sent to the
+    client. Values are sent at most once every ``update_interval`` seconds,
+    and not before the previous ones have been written out, so that slow
+    clients get fewer updates instead of delaying the others.
+    """
+    def __init__(self, monitor_mux, reader, writer, update_interval):
         self.monitor_mux = monitor_mux
         self.reader = reader
         self.writer = writer
+        self.update_interval = update_interval
+        self.peer = writer.get_extra_info("peername")
+        self.pending = dict()
+        self.pending_available = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+
+    def event_cb(self, event, value):
+        if event in self.pending:
+            self.dropped += 1
+        self.pending[event] = value
+        self.pending_available.set()
+
+    def discard_event(self, event):
+        self.pending.pop(event, None)
+
+    def _encode(self, event, value):
+        if event[0] == EventType.PROBE:
+            return struct.pack("<blbq", 0, event[1], event[2], value)
+        elif event[0] == EventType.INJECTION:
+            return struct.pack("<blbb", 1, event[1], event[2], value)
+        else:
+            raise ValueError
+
+    async def _send_cr(self):
+        while True:
+            await self.pending_available.wait()
+            self.pending_available.clear()
+            pending, self.pending = self.pending, dict()
+            self.writer.write(b"".join(self._encode(event, value)
+                                       for event, value in pending.items()))
+            self.sent += len(pending)
+            await self.writer.drain()
+            await asyncio.sleep(self.update_interval)
 
     async def handle(self):
+        send_task = asyncio.ensure_future(self._send_cr())
         try:
             while True:
                 ty = await self.reader.read(1)
@@ -148,31 +188,43 @@ class ProxyConnection:
                     packet = await self.reader.readexactly(6)
                     enable, channel, overrd = struct.unpack("<blb", packet)
                     self.monitor_mux.monitor_injection(self, enable, channel, overrd)
+                elif ty == b"\x04":   # SetUpdateInterval (proxy only)
+                    packet = await self.reader.readexactly(4)
+                    interval_ms, = struct.unpack("<L", packet)
+                    self.update_interval = interval_ms*1e-3
                 else:
                     raise ValueError
         finally:
             self.monitor_mux.remove_listener(self)
-
-    def monitor_cb(self, channel, probe, value):
-        packet = struct.pack("<blbq", 0, channel, probe, value)
-        self.writer.write(packet)
-
-    def injection_status_cb(self, channel, override, value):
-        packet = struct.pack("<blbb", 1, channel, override, value)
-        self.writer.write(packet)
+            send_task.cancel()
+            try:
+                await send_task
+            except (asyncio.CancelledError, ConnectionError):
+                pass
 
 
 class ProxyServer(AsyncioServer):
-    def __init__(self, monitor_mux):
+    def __init__(self, monitor_mux, update_interval):
         AsyncioServer.__init__(self)
         self.monitor_mux = monitor_mux
+        self.update_interval = update_interval
+        self.connections = set()
 
     async def _handle_connection_cr(self, reader, writer):
         line = await reader.readline()
         if line != b"ARTIQ moninj\n":
             logger.error("incorrect magic")
             return
-        await ProxyConnection(self.monitor_mux, reader, writer).handle()
+        connection = ProxyConnection(self.monitor_mux, reader, writer,
+                                     self.update_interval)
+        self.connections.add(connection)
+        try:
+            await connection.handle()
+        finally:
+            self.connections.remove(connection)
+            if connection.dropped:
+                logger.debug("client %s: %d updates sent, %d dropped",
+                             connection.peer, connection.sent, connection.dropped)
 
 
 def get_argparser():
@@ -183,15 +235,33 @@ def get_argparser():
         ("proxy", "proxying", 1383),
         ("control", "control", 1384)
     ])
+    parser.add_argument("--update-interval", default=0.05, type=float,
+                        help="minimum interval in seconds between two "
+                             "updates sent to a client, unless set by the "
+                             "client (default: %(default)s)")
     parser.add_argument("core_addr", metavar="CORE_ADDR",
                         help="hostname or IP address of the core device")
     return parser
 
 
-class PingTarget:
+class ProxyControl:
+    def __init__(self, proxy_server):
+        self.proxy_server = proxy_server
+
     def ping(self):
         return True
 
+    def get_client_statistics(self):
+        """Return, for each connected client, its address, update interval,
+        and the numbers of updates sent and dropped (superseded by a newer
+        value before they could be sent)."""
+        return [{
+            "peer": connection.peer,
+            "update_interval": connection.update_interval,
+            "sent": connection.sent,
+            "dropped": connection.dropped
+        } for connection in self.proxy_server.connections]
+
 
 def main():
     args = get_argparser().parse_args()
@@ -212,10 +282,10 @@ def main():
             monitor_mux.comm_moninj = comm_moninj
             loop.run_until_complete(comm_moninj.connect(args.core_addr))
             try:
-                proxy_server = ProxyServer(monitor_mux)
+                proxy_server = ProxyServer(monitor_mux, args.update_interval)
                 loop.run_until_complete(proxy_server.start(bind_address, args.port_proxy))
                 try:
-                    server = Server({"moninj_proxy": PingTarget()}, None, True)
+                    server = Server({"moninj_proxy": ProxyControl(proxy_server)}, None, True)
                     loop.run_until_complete(server.start(bind_address, args.port_control))
                     try:
                         _, pending = loop.run_until_complete(asyncio.wait(
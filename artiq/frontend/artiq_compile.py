@@ -32,6 +32,9 @@ def get_argparser():
 
     parser.add_argument("-o", "--output", default=None,
                         help="output file")
+    parser.add_argument("--bundle", default=False, action="store_true",
+                        help="write a kernel bundle, which keeps the embedding "
+                             "map so that the kernel may use RPCs")
     parser.add_argument("file", metavar="FILE",
                         help="file containing the experiment to compile")
     parser.add_argument("arguments", metavar="ARGUMENTS",
@@ -63,6 +66,15 @@ def main():
             core_name = exp.run.artiq_embedded.core_name
             core = getattr(exp_inst, core_name)
 
+            if args.bundle:
+                bundle = core.precompile_bundle(exp_inst.run)
+                output = args.output
+                if output is None:
+                    basename, ext = os.path.splitext(args.file)
+                    output = "{}.tar".format(basename)
+                bundle.save(output)
+                return
+
             object_map, main_kernel_library, _, _, subkernel_arg_types = \
                 core.compile(exp.run, [exp_inst], {},
                              attribute_writeback=False, print_as_rpc=False)
@@ -9,6 +9,8 @@ from artiq.master.databases import DeviceDB
 from artiq.master.worker_db import DeviceManager
 from artiq.coredevice.comm_analyzer import (get_analyzer_dump,
                                             decode_dump, decoded_dump_to_vcd)
+from artiq.coredevice.analyzer_trace import (is_analyzer_trace, write_trace,
+                                             AnalyzerTrace)
 
 
 def get_argparser():
@@ -20,13 +22,17 @@ def get_argparser():
                         help="device database file (default: '%(default)s')")
 
     parser.add_argument("-r", "--read-dump", type=str, default=None,
-                        help="read raw dump file instead of accessing device")
+                        help="read raw dump or indexed trace file instead of "
+                             "accessing device")
     parser.add_argument("-p", "--print-decoded", default=False,
                         action="store_true", help="print raw decoded messages")
     parser.add_argument("-w", "--write-vcd", type=str, default=None,
                         help="format and write contents to VCD file")
     parser.add_argument("-d", "--write-dump", type=str, default=None,
                         help="write raw dump file")
+    parser.add_argument("-t", "--write-trace", type=str, default=None,
+                        help="write indexed trace file, which the dashboard "
+                             "opens without decoding it again")
 
     parser.add_argument("-u", "--vcd-uniform-interval", action="store_true",
                         help="emit uniform time intervals between timed VCD "
@@ -40,19 +46,26 @@ def main():
     args = get_argparser().parse_args()
     common_args.init_logger_from_args(args)
 
-    if (not args.print_decoded
-            and args.write_vcd is None and args.write_dump is None):
-        print("No action selected, use -p, -w and/or -d. See -h for help.")
+    if (not args.print_decoded and args.write_vcd is None
+            and args.write_dump is None and args.write_trace is None):
+        print("No action selected, use -p, -w, -d and/or -t. See -h for help.")
         sys.exit(1)
 
     device_mgr = DeviceManager(DeviceDB(args.device_db))
-    if args.read_dump:
-        with open(args.read_dump, "rb") as f:
-            dump = f.read()
+    if args.read_dump and is_analyzer_trace(args.read_dump):
+        if args.write_dump:
+            print("Indexed traces cannot be written as raw dumps.")
+            sys.exit(1)
+        dump = None
+        decoded_dump = AnalyzerTrace(args.read_dump).get_decoded_dump()
     else:
-        core_addr = device_mgr.get_desc("core")["arguments"]["host"]
-        dump = get_analyzer_dump(core_addr)
-    decoded_dump = decode_dump(dump)
+        if args.read_dump:
+            with open(args.read_dump, "rb") as f:
+                dump = f.read()
+        else:
+            core_addr = device_mgr.get_desc("core")["arguments"]["host"]
+            dump = get_analyzer_dump(core_addr)
+        decoded_dump = decode_dump(dump)
     if args.print_decoded:
         print("Log channel:", decoded_dump.log_channel)
         print("DDS one-hot:", decoded_dump.dds_onehot_sel)
@@ -66,6 +79,8 @@ def main():
     if args.write_dump:
         with open(args.write_dump, "wb") as f:
             f.write(dump)
+    if args.write_trace:
+        write_trace(args.write_trace, decoded_dump)
 
 
 if __name__ == "__main__":
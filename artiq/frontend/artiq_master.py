@@ -62,6 +62,10 @@ def get_argparser():
                              "to identify master instead of server address")
     parser.add_argument("--log-submissions", default=None,
                         help="log experiment submissions to specified file")
+    parser.add_argument("--worker-pool-size", default=0, type=int,
+                        help="number of idle worker processes kept ready "
+                             "to reduce the startup time of runs "
+                             "(default: %(default)s)")
 
     return parser
 
@@ -108,7 +112,7 @@ def main():
     atexit.register(experiment_db.close)
 
     scheduler = Scheduler(RIDCounter(), worker_handlers, experiment_db,
-                          args.log_submissions)
+                          args.log_submissions, args.worker_pool_size)
     scheduler.start(loop=loop)
     atexit_register_coroutine(scheduler.stop, loop=loop)
 
@@ -122,6 +126,7 @@ def main():
         "get_dataset": dataset_db.get,
         "get_dataset_metadata": dataset_db.get_metadata,
         "update_dataset": dataset_db.update,
+        "update_dataset_batch": dataset_db.update_batch,
         "get_interactive_arguments": get_interactive_arguments,
         "scheduler_submit": scheduler.submit,
         "scheduler_delete": scheduler.delete,
@@ -21,6 +21,7 @@ from artiq.language.types import TBool
 from artiq.master.databases import DeviceDB, DatasetDB
 from artiq.master.worker_db import DeviceManager, DatasetManager
 from artiq.coredevice.core import CompileError, host_only
+from artiq.coredevice.kernel_bundle import is_kernel_bundle
 from artiq.compiler.embedding import EmbeddingMap
 from artiq.compiler import import_cache
 from artiq.tools import *
@@ -101,6 +102,29 @@ class TARRunner(FileRunner):
         return main_lib
 
 
+class _BundleRoot:
+    # Stands for the experiment a kernel bundle was compiled from: attribute
+    # paths resolve to the attributes of the runner, or else to devices.
+    def __init__(self, runner):
+        self._runner = runner
+
+    def __getattr__(self, name):
+        try:
+            return getattr(self._runner, name)
+        except AttributeError:
+            return self._runner.get_device(name)
+
+
+class BundleRunner(EnvExperiment):
+    def build(self, file):
+        self.setattr_device("core")
+        self.file = file
+
+    def run(self):
+        run_precompiled = self.core.load_precompiled(self.file, _BundleRoot(self))
+        run_precompiled()
+
+
 class DummyScheduler:
     def __init__(self):
         self.rid = 0
@@ -203,6 +227,8 @@ def _build_experiment(device_mgr, dataset_mgr, args):
                 raise ValueError("class-name not supported "
                                  "for precompiled kernels")
         if is_tar:
+            if is_kernel_bundle(args.file):
+                return BundleRunner(managers, file=args.file)
             return TARRunner(managers, file=args.file)
         elif is_elf:
             return ELFRunner(managers, file=args.file)
@@ -238,6 +264,8 @@ def run(with_file=False):
     dataset_db = DatasetDB(args.dataset_db)
     try:
         dataset_mgr = DatasetManager(dataset_db)
+        if args.hdf5 is not None:
+            dataset_mgr.results_file_factory = lambda: h5py.File(args.hdf5, "w")
 
         try:
             exp_inst = _build_experiment(device_mgr, dataset_mgr, args)
@@ -254,7 +282,10 @@ def run(with_file=False):
         finally:
             device_mgr.close_devices()
 
-        if args.hdf5 is not None:
+        if dataset_mgr.results_file is not None:
+            with dataset_mgr.results_file as f:
+                dataset_mgr.write_hdf5(f)
+        elif args.hdf5 is not None:
             with h5py.File(args.hdf5, "w") as f:
                 dataset_mgr.write_hdf5(f)
         else:
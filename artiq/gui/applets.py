@@ -17,6 +17,7 @@ from sipyco import pyon
 
 from artiq.gui.entries import procdesc_to_entry, EntryTreeWidget
 from artiq.gui.tools import QDockWidgetCloseDetect, LayoutWidget
+from artiq.gui.shared_arrays import SharedArrays
 
 
 logger = logging.getLogger(__name__)
@@ -90,13 +91,17 @@ class EntryArea(EntryTreeWidget):
 
 
 class AppletIPCServer(AsyncioParentComm):
-    def __init__(self, dataset_sub, dataset_ctl, expmgr):
+    def __init__(self, dataset_sub, dataset_ctl, expmgr, shared_arrays=None):
         AsyncioParentComm.__init__(self)
         self.dataset_sub = dataset_sub
         self.dataset_ctl = dataset_ctl
         self.expmgr = expmgr
         self.datasets = set()
         self.dataset_prefixes = []
+        self.shared_arrays = shared_arrays
+        self.use_shared_arrays = False
+        # shared memory segments sent to the applet and not yet mapped by it
+        self.unmapped_segments = []
 
     def write_pyon(self, obj):
         self.write(pyon.encode(obj).encode() + b"\n")
@@ -135,6 +140,16 @@ class AppletIPCServer(AsyncioParentComm):
             elif mod["action"] in {"setitem", "delitem"}:
                 if not self._is_dataset_subscribed(mod["key"]):
                     return
+        self._write_mod(mod)
+
+    def _write_mod(self, mod):
+        if self.use_shared_arrays:
+            mod, shared = self.shared_arrays.extract(mod)
+            if shared:
+                self.unmapped_segments += [name for _, name, _, _ in shared]
+                self.write_pyon({"action": "mod", "mod": mod,
+                                 "shared_arrays": shared})
+                return
         self.write_pyon({"action": "mod", "mod": mod})
 
     async def serve(self, embed_cb):
@@ -153,10 +168,17 @@ class AppletIPCServer(AsyncioParentComm):
                     elif action == "subscribe":
                         self.datasets = obj["datasets"]
                         self.dataset_prefixes = obj["dataset_prefixes"]
+                        self.use_shared_arrays = (
+                            self.shared_arrays is not None
+                            and obj.get("shared_arrays", False))
                         if self.dataset_sub.model is not None:
                             mod = self._synthesize_init(
                                 self.dataset_sub.model.backing_store)
-                            self.write_pyon({"action": "mod", "mod": mod})
+                            self._write_mod(mod)
+                    elif action == "shared_arrays_mapped":
+                        for name in obj["names"]:
+                            self.unmapped_segments.remove(name)
+                            self.shared_arrays.release(name)
                     elif action == "set_dataset":
                         await self.dataset_ctl.set(obj["key"], obj["value"], metadata=obj["metadata"], persist=obj["persist"])
                     elif action == "update_dataset":
@@ -176,6 +198,9 @@ class AppletIPCServer(AsyncioParentComm):
                          "server stopped", exc_info=True)
         finally:
             self.dataset_sub.notify_cbs.remove(self._on_mod)
+            for name in self.unmapped_segments:
+                self.shared_arrays.release(name)
+            self.unmapped_segments.clear()
 
     def start_server(self, embed_cb, *, loop=None):
         self.server_task = asyncio.ensure_future(
@@ -188,7 +213,8 @@ class AppletIPCServer(AsyncioParentComm):
 
 
 class _AppletDock(QDockWidgetCloseDetect):
-    def __init__(self, dataset_sub, dataset_ctl, expmgr, uid, name, spec, extra_substitutes):
+    def __init__(self, dataset_sub, dataset_ctl, expmgr, uid, name, spec, extra_substitutes,
+                 shared_arrays=None):
         QDockWidgetCloseDetect.__init__(self, "Applet: " + name)
         self.setObjectName("applet" + str(uid))
 
@@ -202,6 +228,7 @@ class _AppletDock(QDockWidgetCloseDetect):
         self.applet_name = name
         self.spec = spec
         self.extra_substitutes = extra_substitutes
+        self.shared_arrays = shared_arrays
 
         self.starting_stopping = False
 
@@ -217,7 +244,8 @@ class _AppletDock(QDockWidgetCloseDetect):
             return
         self.starting_stopping = True
         try:
-            self.ipc = AppletIPCServer(self.dataset_sub, self.dataset_ctl, self.expmgr)
+            self.ipc = AppletIPCServer(self.dataset_sub, self.dataset_ctl, self.expmgr,
+                                       self.shared_arrays)
             env = os.environ.copy()
             env["PYTHONUNBUFFERED"] = "1"
             env["ARTIQ_APPLET_EMBED"] = self.ipc.get_address()
@@ -429,6 +457,12 @@ class AppletsDock(QtWidgets.QDockWidget):
         self.extra_substitutes = extra_substitutes
         self.applet_uids = set()
 
+        # Large dataset values are sent to all applets through the same
+        # shared memory segments. Segments are invalidated by the dataset
+        # mods before the applet servers process them.
+        self.shared_arrays = SharedArrays()
+        dataset_sub.notify_cbs.insert(0, self.shared_arrays.on_mod)
+
         self._loop = loop
 
         self.table = QtWidgets.QTreeWidget()
@@ -528,7 +562,8 @@ class AppletsDock(QtWidgets.QDockWidget):
             self.table.itemChanged.connect(self.item_changed)
 
     def create(self, item, name, spec):
-        dock = _AppletDock(self.dataset_sub, self.dataset_ctl, self.expmgr, item.applet_uid, name, spec, self.extra_substitutes)
+        dock = _AppletDock(self.dataset_sub, self.dataset_ctl, self.expmgr, item.applet_uid, name, spec, self.extra_substitutes,
+                           self.shared_arrays)
         self.main_window.addDockWidget(QtCore.Qt.DockWidgetArea.RightDockWidgetArea, dock)
         dock.setFloating(True)
         asyncio.ensure_future(dock.start(), loop=self._loop)
@@ -704,6 +739,7 @@ class AppletsDock(QtWidgets.QDockWidget):
                 else:
                     raise ValueError
         await walk(self.table.invisibleRootItem())
+        self.shared_arrays.close()
 
     def save_state_item(self, wi):
         state = []
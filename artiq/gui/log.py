@@ -1,5 +1,7 @@
+import re
 import logging
 import time
+import collections
 from functools import partial
 
 from PyQt6 import QtCore, QtGui, QtWidgets
@@ -9,49 +11,93 @@ from artiq.gui.tools import (LayoutWidget, log_level_to_name,
                              QDockWidgetCloseDetect)
 
 
-class _ModelItem:
-    def __init__(self, parent, row):
-        self.parent = parent
-        self.row = row
-        self.children_by_row = []
+# Characters giving a free-text filter a meaning different from a plain
+# substring search.
+_regex_special = set(".^$*+?{}[]\\|()")
+
+
+class _Entry:
+    """Log record, with the lowercase text searched by the free-text filter.
+
+    Continuation lines are not given their own objects: the indices of the
+    child rows of a record point to its entry.
+    """
+    __slots__ = ("level", "source", "timestamp", "lines", "seq",
+                 "source_lower", "lines_lower")
+
+    def __init__(self, level, source, timestamp, message, seq):
+        self.level = level
+        self.source = source
+        self.timestamp = timestamp
+        self.lines = message.splitlines() or [""]
+        self.seq = seq
+        self.source_lower = source.lower()
+        self.lines_lower = message.lower().splitlines() or [""]
 
 
 class _LogFilterProxyModel(QtCore.QSortFilterProxyModel):
     def __init__(self):
         super().__init__()
-        self.setFilterCaseSensitivity(QtCore.Qt.CaseSensitivity.CaseInsensitive)
         self.setRecursiveFilteringEnabled(True)
         self.filter_level = 0
+        self.filter_search = None
 
     def filterAcceptsRow(self, source_row, source_parent):
         source = self.sourceModel()
-        index0 = source.index(source_row, 0, source_parent)
-        index1 = source.index(source_row, 1, source_parent)
-        level = source.data(index0, QtCore.Qt.ItemDataRole.UserRole)
-
-        if level >= self.filter_level:
-            regex = self.filterRegularExpression()
-            index0_text = source.data(index0, QtCore.Qt.ItemDataRole.DisplayRole)
-            msg_text = source.data(index1, QtCore.Qt.ItemDataRole.DisplayRole)
-            return (regex.match(index0_text).hasMatch() or regex.match(msg_text).hasMatch())
+        if source_parent.isValid():
+            entry = source.get_entry(source_parent.row())
+            lineno = source_row + 1
         else:
+            entry = source.get_entry(source_row)
+            lineno = 0
+
+        if entry.level < self.filter_level:
             return False
+        if self.filter_search is None:
+            return True
+        if lineno == 0 and self.filter_search(entry.source_lower):
+            return True
+        return self.filter_search(entry.lines_lower[lineno])
 
     def apply_filter_level(self, filter_level):
         self.filter_level = getattr(logging, filter_level)
         self.invalidateFilter()
 
+    def apply_filter_text(self, text):
+        """Filter entries containing the given text, which is a
+        case-insensitive regular expression if it has special characters."""
+        if not text:
+            self.filter_search = None
+        elif _regex_special.isdisjoint(text):
+            text = text.lower()
+            self.filter_search = lambda line: text in line
+        else:
+            try:
+                regex = re.compile(text, re.IGNORECASE)
+            except re.error:
+                self.filter_search = lambda line: False
+            else:
+                self.filter_search = lambda line: regex.search(line) is not None
+        self.invalidateFilter()
+
 
 class _Model(QtCore.QAbstractItemModel):
     def __init__(self):
         QtCore.QAbstractTableModel.__init__(self)
 
         self.headers = ["Source", "Message"]
-        self.children_by_row = []
 
-        self.entries = []
-        self.pending_entries = []
         self.depth = 1000
+        # Ring buffer of entries. Row 0 holds the entry with sequence number
+        # self.first, and the entry with sequence number n is stored at
+        # n % len(self.entries). Each tick inserts at most self.depth
+        # entries before trimming back to self.depth, hence the size.
+        self.entries = [None]*(2*self.depth)
+        self.first = 0
+        self.count = 0
+        # Records older than the last self.depth would be trimmed right
+        # after being inserted, so they are dropped here.
+        self.pending_entries = collections.deque(maxlen=self.depth)
         timer = QtCore.QTimer(self)
         timer.timeout.connect(self.timer_tick)
         timer.start(100)
@@ -70,94 +116,98 @@ class _Model(QtCore.QAbstractItemModel):
             return self.headers[col]
         return None
 
+    def get_entry(self, row):
+        return self.entries[(self.first + row) % len(self.entries)]
+
     def rowCount(self, parent):
         if parent.isValid():
-            item = parent.internalPointer()
-            return len(item.children_by_row)
+            if parent.internalPointer() is self:
+                return len(self.get_entry(parent.row()).lines) - 1
+            else:
+                return 0
         else:
-            return len(self.entries)
+            return self.count
 
     def columnCount(self, parent):
         return len(self.headers)
 
     def append(self, v):
-        severity, source, timestamp, message = v
-        self.pending_entries.append((severity, source, timestamp,
-                                     message.splitlines()))
+        self.pending_entries.append(v)
 
     def clear(self):
-        self.beginRemoveRows(QtCore.QModelIndex(), 0, len(self.entries)-1)
-        self.entries.clear()
-        self.children_by_row.clear()
+        if not self.count:
+            return
+        self.beginRemoveRows(QtCore.QModelIndex(), 0, self.count-1)
+        self.first += self.count
+        self.count = 0
         self.endRemoveRows()
 
     def timer_tick(self):
         if not self.pending_entries:
             return
-        nrows = len(self.entries)
         records = self.pending_entries
-        self.pending_entries = []
+        self.pending_entries = collections.deque(maxlen=self.depth)
 
+        nrows = self.count
+        seq = self.first + nrows
+        size = len(self.entries)
         self.beginInsertRows(QtCore.QModelIndex(), nrows, nrows+len(records)-1)
-        self.entries.extend(records)
-        for rec in records:
-            item = _ModelItem(self, len(self.children_by_row))
-            self.children_by_row.append(item)
-            for i in range(len(rec[3])-1):
-                item.children_by_row.append(_ModelItem(item, i))
+        for severity, source, timestamp, message in records:
+            self.entries[seq % size] = _Entry(severity, source, timestamp,
+                                              message, seq)
+            seq += 1
+        self.count += len(records)
         self.endInsertRows()
 
-        if len(self.entries) > self.depth:
-            start = len(self.entries) - self.depth
+        # Entries of removed rows stay in the buffer until overwritten.
+        if self.count > self.depth:
+            start = self.count - self.depth
             self.beginRemoveRows(QtCore.QModelIndex(), 0, start-1)
-            self.entries = self.entries[start:]
-            self.children_by_row = self.children_by_row[start:]
-            for child in self.children_by_row:
-                child.row -= start
+            self.first += start
+            self.count = self.depth
             self.endRemoveRows()
 
     def index(self, row, column, parent):
+        # Indices of records point to the model, and those of continuation
+        # lines to the entry of their record.
         if parent.isValid():
-            parent_item = parent.internalPointer()
-            return self.createIndex(row, column,
-                                    parent_item.children_by_row[row])
+            return self.createIndex(row, column, self.get_entry(parent.row()))
         else:
-            return self.createIndex(row, column, self.children_by_row[row])
+            return self.createIndex(row, column, self)
 
     def parent(self, index):
         if index.isValid():
-            parent = index.internalPointer().parent
-            if parent is self:
+            pointer = index.internalPointer()
+            if pointer is self:
                 return QtCore.QModelIndex()
             else:
-                return self.createIndex(parent.row, 0, parent)
+                return self.createIndex(pointer.seq - self.first, 0, self)
         else:
             return QtCore.QModelIndex()
 
+    def _entry_line(self, index):
+        pointer = index.internalPointer()
+        if pointer is self:
+            return self.get_entry(index.row()), 0
+        else:
+            return pointer, index.row() + 1
+
     def full_entry(self, index):
         if not index.isValid():
             return
-        item = index.internalPointer()
-        if item.parent is self:
-            msgnum = item.row
-        else:
-            msgnum = item.parent.row
-        return self.entries[msgnum][3]
+        entry, _ = self._entry_line(index)
+        return entry.lines
 
     def data(self, index, role):
         if not index.isValid():
             return
 
-        item = index.internalPointer()
-        if item.parent is self:
-            msgnum = item.row
-        else:
-            msgnum = item.parent.row
+        entry, lineno = self._entry_line(index)
 
         if role == QtCore.Qt.ItemDataRole.FontRole and index.column() == 1:
             return self.fixed_font
         elif role == QtCore.Qt.ItemDataRole.BackgroundRole:
-            level = self.entries[msgnum][0]
+            level = entry.level
             if level >= logging.ERROR:
                 return self.error_bg
             elif level >= logging.WARNING:
@@ -165,35 +215,22 @@ class _Model(QtCore.QAbstractItemModel):
             else:
                 return self.white
         elif role == QtCore.Qt.ItemDataRole.ForegroundRole:
-            level = self.entries[msgnum][0]
+            level = entry.level
             if level <= logging.DEBUG:
                 return self.debug_fg
             else:
                 return self.black
         elif role == QtCore.Qt.ItemDataRole.DisplayRole:
-            v = self.entries[msgnum]
-            column = index.column()
-            if item.parent is self:
-                if column == 0:
-                    return v[1]
-                else:
-                    return v[3][0]
+            if index.column() == 0:
+                return entry.source if lineno == 0 else ""
             else:
-                if column == 0:
-                    return ""
-                else:
-                    return v[3][item.row+1]
+                return entry.lines[lineno]
         elif role == QtCore.Qt.ItemDataRole.ToolTipRole:
-            v = self.entries[msgnum]
-            if item.parent is self:
-                lineno = 0
-            else:
-                lineno = item.row + 1
-            return (log_level_to_name(v[0]) + ", " +
-                time.strftime("%m/%d %H:%M:%S", time.localtime(v[2])) +
-                "\n" + v[3][lineno])
+            return (log_level_to_name(entry.level) + ", " +
+                time.strftime("%m/%d %H:%M:%S", time.localtime(entry.timestamp)) +
+                "\n" + entry.lines[lineno])
         elif role == QtCore.Qt.ItemDataRole.UserRole:
-            return self.entries[msgnum][0]
+            return entry.level
 
 
 class LogDock(QDockWidgetCloseDetect):
@@ -278,7 +315,7 @@ class LogDock(QDockWidgetCloseDetect):
         self.filter_level.currentIndexChanged.connect(self.apply_level_filter)
 
     def apply_text_filter(self):
-        self.proxy_model.setFilterRegularExpression(self.filter_freetext.text())
+        self.proxy_model.apply_filter_text(self.filter_freetext.text())
 
     def apply_level_filter(self):
         self.proxy_model.apply_filter_level(self.filter_level.currentText())
@@ -0,0 +1,203 @@
+"""
+Transfer of large NumPy dataset values from the dashboard to embedded applets
+through shared memory.
+
+When an applet supports it, the large arrays found in the dataset values of
+the mods sent to it are copied into a shared memory segment managed by the
+dashboard. In the mod, they are replaced by ``None`` and described by a list
+of ``(path, name, dtype, shape)`` entries, where ``name`` identifies the
+segment. The applet maps the segment and inserts a read-only array backed by
+it into the mod, without copying the data.
+
+A segment holds one version of the value of a dataset, and is shared by all
+the applets the value is sent to. It stops being current when the dataset is
+modified, and is freed once every applet it was sent to has acknowledged
+mapping it.
+"""
+
+import os
+import weakref
+from itertools import count
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+
+__all__ = ["SharedArrays", "SharedArrayMapper"]
+
+
+# Arrays smaller than this are left to PYON.
+SHARED_THRESHOLD = 64*1024
+# bool, integer, float and complex arrays (no object or structured dtypes)
+_shared_kinds = "biufc"
+
+
+def _is_shared(value):
+    return (isinstance(value, np.ndarray)
+            and value.dtype.kind in _shared_kinds
+            and value.nbytes >= SHARED_THRESHOLD)
+
+
+class _Segment:
+    def __init__(self, name, array):
+        self.shm = shared_memory.SharedMemory(name, create=True,
+                                              size=array.nbytes)
+        np.ndarray(array.shape, array.dtype, buffer=self.shm.buf)[...] = array
+        self.array = array
+        self.current = True
+        self.users = 0
+
+    def free(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedArrays:
+    """Shared memory segments holding the large dataset values sent to the
+    applets of a dashboard.
+
+    :meth:`on_mod` must be called with the dataset mods before the applet
+    servers process them.
+    """
+    def __init__(self):
+        self._prefix = "artiq{}_".format(os.getpid())
+        self._serial = count()
+        self._current = dict()
+        self._segments = dict()
+
+    def _retire(self, key):
+        segment = self._current.pop(key, None)
+        if segment is not None:
+            segment.current = False
+            if not segment.users:
+                self._free(segment)
+
+    def _free(self, segment):
+        del self._segments[segment.shm.name]
+        segment.free()
+
+    def on_mod(self, mod):
+        if mod["action"] == "init":
+            for key in list(self._current):
+                self._retire(key)
+        elif mod["path"]:
+            # modification of the value in place
+            self._retire(mod["path"][0])
+        else:
+            key = mod["key"]
+            segment = self._current.get(key)
+            if (segment is not None and not (mod["action"] == "setitem"
+                                             and mod["value"][1] is segment.array)):
+                self._retire(key)
+
+    def _share(self, key, array):
+        segment = self._current.get(key)
+        if segment is None or segment.array is not array:
+            self._retire(key)
+            name = self._prefix + str(next(self._serial))
+            segment = _Segment(name, array)
+            self._current[key] = segment
+            self._segments[name] = segment
+        segment.users += 1
+        return (segment.shm.name, array.dtype.str, array.shape)
+
+    def extract(self, mod):
+        """Place the large dataset values of a mod in shared memory.
+
+        :return: the mod without these values, and the list of their
+            descriptions. Each segment in the list must be released with
+            :meth:`release` once the applet has mapped it.
+        """
+        shared = []
+        if mod["action"] == "init":
+            struct = None
+            for key, entry in mod["struct"].items():
+                if _is_shared(entry[1]):
+                    if struct is None:
+                        struct = dict(mod["struct"])
+                    struct[key] = (entry[0], None, entry[2])
+                    shared.append((("struct", key, 1), )
+                                  + self._share(key, entry[1]))
+            if struct is not None:
+                mod = dict(mod, struct=struct)
+        elif mod["action"] == "setitem":
+            path = mod["path"]
+            if not path:
+                entry = mod["value"]
+                if _is_shared(entry[1]):
+                    shared.append((("value", 1), )
+                                  + self._share(mod["key"], entry[1]))
+                    mod = dict(mod, value=(entry[0], None, entry[2]))
+            elif len(path) == 1 and mod["key"] == 1:
+                if _is_shared(mod["value"]):
+                    shared.append((("value", ), )
+                                  + self._share(path[0], mod["value"]))
+                    mod = dict(mod, value=None)
+        return mod, shared
+
+    def release(self, name):
+        """Release a segment returned by :meth:`extract`."""
+        segment = self._segments.get(name)
+        if segment is None:
+            return
+        segment.users -= 1
+        if not segment.users and not segment.current:
+            self._free(segment)
+
+    def close(self):
+        """Free all segments."""
+        for segment in list(self._segments.values()):
+            self._free(segment)
+        self._current.clear()
+
+
+def _insert(obj, path, value):
+    if not path:
+        return value
+    key = path[0]
+    child = _insert(obj[key], path[1:], value)
+    if isinstance(obj, tuple):
+        obj = list(obj)
+        obj[key] = child
+        return tuple(obj)
+    obj[key] = child
+    return obj
+
+
+class SharedArrayMapper:
+    """Maps the shared memory segments received by an applet.
+
+    Segments are closed once the arrays backed by them have been freed. The
+    mapper must be kept alive as long as these arrays are in use.
+    """
+    def __init__(self):
+        self._mapped = dict()
+
+    def _close_unused(self):
+        for name, (shm, array_ref) in list(self._mapped.items()):
+            if array_ref() is None:
+                shm.close()
+                del self._mapped[name]
+
+    def _map(self, name, dtype, shape):
+        if name in self._mapped:
+            array = self._mapped[name][1]()
+            if array is not None:
+                return array
+        shm = shared_memory.SharedMemory(name)
+        if os.name == "posix":
+            # The dashboard owns the segment; do not let the resource
+            # tracker of the applet unlink it when the applet exits.
+            resource_tracker.unregister(shm._name, "shared_memory")
+        array = np.ndarray(shape, dtype, buffer=shm.buf)
+        array.flags.writeable = False
+        self._mapped[name] = (shm, weakref.ref(array))
+        return array
+
+    def insert(self, mod, shared):
+        """Insert the arrays described by :meth:`SharedArrays.extract` into
+        a mod received from the dashboard."""
+        self._close_unused()
+        for path, name, dtype, shape in shared:
+            mod = _insert(mod, path, self._map(name, dtype, shape))
+        return mod
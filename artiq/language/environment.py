@@ -446,6 +446,20 @@ class HasEnvironment:
         efficiently as incremental modifications in broadcast mode."""
         self.__dataset_mgr.append_to(key, value)
 
+    def enable_dataset_streaming(self):
+        """Write archived datasets to the results file while the experiment
+        runs, instead of keeping them in memory until the end.
+
+        Archived NumPy arrays and lists of numbers that are not broadcast are
+        then stored in resizable HDF5 datasets. Elements appended to them are
+        written in blocks, and the results file is flushed regularly, so that
+        it can still be read if the experiment does not terminate normally.
+        Other datasets are written at the end of the experiment as usual.
+
+        :meth:`get_dataset` returns a copy of a streamed dataset.
+        """
+        self.__dataset_mgr.enable_streaming()
+
     def get_dataset(self, key, default=NoDefault, archive=True):
         """Returns the contents of a dataset.
 
@@ -1,6 +1,8 @@
 import asyncio
+import struct
 
 import lmdb
+import numpy as np
 
 from sipyco.sync_struct import (Notifier, process_mod, ModAction,
                                 update_from_dict)
@@ -41,34 +43,268 @@ class DeviceDB:
         return self.data.raw_view["satellite_cpu_targets"][destination]
 
 
+# Keys of array chunks start with a byte that does not occur in UTF-8, so
+# that they sort after all dataset keys.
+_chunk_key_marker = b"\xff"
+# Values of arrays stored in chunks start with this byte, which does not
+# occur in the PYON encoding of other values.
+_array_header_marker = b"\xff"
+_chunk_key_suffix = struct.Struct(">Q")
+_array_chunk_size = 64*1024
+_array_kinds = "biufc"
+# Lists whose elements all have one of these types are stored in chunks as
+# arrays of the corresponding dtype.
+_list_dtypes = {bool: np.dtype(np.bool_), int: np.dtype(np.int64),
+                float: np.dtype(np.float64)}
+_list_types = {dtype: ty for ty, dtype in _list_dtypes.items()}
+
+
+def _chunk_key_prefix(key):
+    key = key.encode()
+    return _chunk_key_marker + struct.pack(">I", len(key)) + key
+
+
+def _list_array(values, dtype):
+    """Convert list elements to an array of the given dtype, or return
+    ``None`` if they cannot be converted back to the same list."""
+    ty = _list_types[dtype]
+    if not all(type(value) is ty for value in values):
+        return None
+    try:
+        return np.array(values, dtype)
+    except OverflowError:
+        return None
+
+
+def _chunked_array(value):
+    """Return the array to store in chunks for a dataset value, or ``None``
+    if the value is stored as PYON."""
+    if isinstance(value, np.ndarray):
+        array = value if value.dtype.kind in _array_kinds else None
+    elif isinstance(value, list) and value and type(value[0]) in _list_dtypes:
+        if len(value)*_list_dtypes[type(value[0])].itemsize < _array_chunk_size:
+            return None
+        array = _list_array(value, _list_dtypes[type(value[0])])
+    else:
+        array = None
+    if array is None or array.ndim == 0 or array.nbytes < _array_chunk_size:
+        return None
+    return array
+
+
+def _changed_rows(dataset, mod):
+    """Return the ranges ``(start, stop)`` of the rows (first index) of the
+    value of a dataset changed by a mod, before it is applied. ``stop`` is
+    ``None`` for all following rows. Appended rows are not included. Return
+    ``None`` if the value is replaced or changed in another way."""
+    path = mod["path"]
+    if len(path) < 2 or dataset is None:
+        return None
+    if path[1] != 1:
+        # metadata
+        return []
+    value = dataset[1]
+    if len(path) > 2:
+        index = path[2]
+    elif mod["action"] == ModAction.append.value:
+        return []
+    elif mod["action"] == ModAction.setitem.value:
+        index = mod["key"]
+    else:
+        return None
+    if isinstance(index, tuple) and index:
+        index = index[0]
+    try:
+        length = len(value)
+    except TypeError:
+        return None
+    if isinstance(index, slice):
+        start, stop, step = index.indices(length)
+        if step != 1:
+            return [(0, None)]
+        if (len(path) == 2 and isinstance(value, list)
+                and len(mod["value"]) != stop - start):
+            # the following elements are shifted
+            return [(start, None)]
+        return [(start, stop)]
+    if isinstance(index, (int, np.integer)) and not isinstance(index, bool):
+        index = int(index)
+        if index < 0:
+            index += length
+        return [(index, index + 1)]
+    return None
+
+
 class DatasetDB(TaskObject):
+    """Persistent datasets, stored in LMDB.
+
+    Numeric numpy arrays, and lists of booleans, integers or floats, are
+    stored as a header and raw binary chunks when they are large. When
+    saving, only the chunks holding the elements changed by the mods since
+    the last save, or appended since, are written. Other values are stored
+    as PYON. Stored datasets are decoded when they are first accessed (all
+    of them when :attr:`data` is accessed).
+    """
     def __init__(self, persist_file, autosave_period=30):
         self.persist_file = persist_file
         self.autosave_period = autosave_period
 
         self.lmdb = lmdb.open(persist_file, subdir=False, map_size=2**30)
-        data = dict()
+        self._undecoded = dict()
+        with self.lmdb.begin() as txn:
+            for key, encoded in txn.cursor():
+                if key.startswith(_chunk_key_marker):
+                    break
+                self._undecoded[key.decode()] = encoded
+        self._data = Notifier(dict())
+        # key -> list of the ranges of rows changed since the last save
+        # (see _changed_rows), or None if the dataset is saved in full
+        self.pending_keys = dict()
+        # key -> (dtype, row shape, list flag, length) of the datasets
+        # stored in chunks
+        self._chunk_layouts = dict()
+
+    @property
+    def data(self):
+        """:class:`sipyco.sync_struct.Notifier` holding all datasets as
+        ``(persist, value, metadata)`` tuples."""
+        for key in list(self._undecoded.keys()):
+            self._load(key)
+        return self._data
+
+    def _load(self, key):
+        encoded = self._undecoded.pop(key, None)
+        if encoded is None:
+            return
         with self.lmdb.begin() as txn:
-            for key, value_and_metadata in txn.cursor():
-                value, metadata = pyon.decode(value_and_metadata.decode())
-                data[key.decode()] = (True, value, metadata)
-        self.data = Notifier(data)
-        self.pending_keys = set()
+            value, metadata = self._decode(txn, key, encoded)
+        # Not published: the data is only exposed after all datasets are loaded.
+        self._data.raw_view[key] = (True, value, metadata)
+
+    def _decode(self, txn, key, encoded):
+        if not encoded.startswith(_array_header_marker):
+            return pyon.decode(encoded.decode())
+        header = pyon.decode(encoded[len(_array_header_marker):].decode())
+        value = np.empty(header["shape"], header["dtype"])
+        data = value.reshape(-1).view(np.uint8)
+        prefix = _chunk_key_prefix(key)
+        for index, offset in enumerate(range(0, len(data), _array_chunk_size)):
+            chunk = txn.get(prefix + _chunk_key_suffix.pack(index))
+            if chunk is None or len(chunk) != min(_array_chunk_size, len(data) - offset):
+                raise ValueError("corrupted dataset '{}'".format(key))
+            data[offset:offset + len(chunk)] = np.frombuffer(chunk, np.uint8)
+        is_list = header.get("list", False)
+        self._chunk_layouts[key] = (value.dtype, value.shape[1:], is_list,
+                                    len(value))
+        if is_list:
+            value = value.tolist()
+        return value, header["metadata"]
 
     def close_db(self):
         self.lmdb.close()
 
+    def _delete_chunks(self, txn, key, start=0):
+        prefix = _chunk_key_prefix(key)
+        cursor = txn.cursor()
+        if cursor.set_range(prefix + _chunk_key_suffix.pack(start)):
+            while cursor.key().startswith(prefix):
+                if not cursor.delete():
+                    break
+
+    def _put_header(self, txn, key, dtype, shape, is_list, metadata):
+        header = {
+            "dtype": dtype.str,
+            "shape": shape,
+            "metadata": metadata
+        }
+        if is_list:
+            header["list"] = True
+        txn.put(key.encode(),
+                _array_header_marker + pyon.encode(header).encode())
+        self._chunk_layouts[key] = (dtype, shape[1:], is_list, shape[0])
+
+    def _put_array(self, txn, key, value, array, metadata):
+        self._put_header(txn, key, array.dtype, array.shape,
+                         isinstance(value, list), metadata)
+        data = np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+        prefix = _chunk_key_prefix(key)
+        chunk_count = 0
+        for offset in range(0, len(data), _array_chunk_size):
+            chunk = data[offset:offset + _array_chunk_size].tobytes()
+            chunk_key = prefix + _chunk_key_suffix.pack(chunk_count)
+            if txn.get(chunk_key) != chunk:
+                txn.put(chunk_key, chunk)
+            chunk_count += 1
+        self._delete_chunks(txn, key, chunk_count)
+
+    def _put_rows(self, txn, key, value, metadata, rows):
+        """Write the chunks of a dataset stored in chunks that hold the given
+        rows and the rows appended since it was stored. Return ``False`` if
+        the dataset must be saved in full instead."""
+        try:
+            dtype, row_shape, is_list, length = self._chunk_layouts[key]
+        except KeyError:
+            return False
+        if is_list:
+            if not isinstance(value, list):
+                return False
+        elif (not isinstance(value, np.ndarray) or value.dtype != dtype
+                or value.shape[1:] != row_shape):
+            return False
+        if len(value) < length:
+            return False
+
+        row_size = dtype.itemsize*int(np.prod(row_shape, dtype=np.int64))
+        size = len(value)*row_size
+        chunks = set()
+        for start, stop in rows + [(length, None)]:
+            stop = len(value) if stop is None else min(stop, len(value))
+            if start < stop:
+                chunks.update(range(start*row_size//_array_chunk_size,
+                                    (stop*row_size - 1)//_array_chunk_size + 1))
+        if not is_list:
+            data = np.ascontiguousarray(value).reshape(-1).view(np.uint8)
+        prefix = _chunk_key_prefix(key)
+        for index in sorted(chunks):
+            offset = index*_array_chunk_size
+            if is_list:
+                # The chunk size is a multiple of the element sizes.
+                chunk = _list_array(
+                    value[offset//row_size:
+                          min(size, offset + _array_chunk_size)//row_size],
+                    dtype)
+                if chunk is None:
+                    return False
+                chunk = chunk.tobytes()
+            else:
+                chunk = data[offset:offset + _array_chunk_size].tobytes()
+            txn.put(prefix + _chunk_key_suffix.pack(index), chunk)
+        self._put_header(txn, key, dtype, (len(value), ) + row_shape,
+                         is_list, metadata)
+        return True
+
+    def _put(self, txn, key, value, metadata):
+        array = _chunked_array(value)
+        if array is None:
+            txn.put(key.encode(), pyon.encode((value, metadata)).encode())
+            self._delete_chunks(txn, key)
+            self._chunk_layouts.pop(key, None)
+        else:
+            self._put_array(txn, key, value, array, metadata)
+
     def save(self):
         with self.lmdb.begin(write=True) as txn:
-            for key in self.pending_keys:
-                if (key not in self.data.raw_view
-                        or not self.data.raw_view[key][0]):
+            for key, rows in self.pending_keys.items():
+                if (key not in self._data.raw_view
+                        or not self._data.raw_view[key][0]):
                     txn.delete(key.encode())
+                    self._delete_chunks(txn, key)
+                    self._chunk_layouts.pop(key, None)
                 else:
-                    value_and_metadata = (self.data.raw_view[key][1],
-                                          self.data.raw_view[key][2])
-                    txn.put(key.encode(),
-                            pyon.encode(value_and_metadata).encode())
+                    _, value, metadata = self._data.raw_view[key]
+                    if rows is None or not self._put_rows(
+                            txn, key, value, metadata, rows):
+                        self._put(txn, key, value, metadata)
         self.pending_keys.clear()
 
     async def _do(self):
@@ -80,39 +316,61 @@ class DatasetDB(TaskObject):
             self.save()
 
     def get(self, key):
-        return self.data.raw_view[key][1]
+        self._load(key)
+        return self._data.raw_view[key][1]
 
     def get_metadata(self, key):
-        return self.data.raw_view[key][2]
+        self._load(key)
+        return self._data.raw_view[key][2]
+
+    def _set_pending(self, key, rows):
+        if rows is None:
+            self.pending_keys[key] = None
+        else:
+            pending_rows = self.pending_keys.setdefault(key, [])
+            if pending_rows is not None:
+                pending_rows += rows
 
     def update(self, mod):
         if mod["path"]:
             key = mod["path"][0]
+            self._load(key)
         else:
             assert (mod["action"] == ModAction.setitem.value
                     or mod["action"] == ModAction.delitem.value)
             key = mod["key"]
-        self.pending_keys.add(key)
-        process_mod(self.data, mod)
+            if mod["action"] == ModAction.setitem.value:
+                # replaced, no need to decode the stored value
+                self._undecoded.pop(key, None)
+            else:
+                self._load(key)
+        self._set_pending(key, _changed_rows(self._data.raw_view.get(key), mod))
+        process_mod(self._data, mod)
+
+    def update_batch(self, mods):
+        for mod in mods:
+            self.update(mod)
 
     # convenience functions (update() can be used instead)
     def set(self, key, value, persist=None, metadata=None):
+        self._load(key)
         if persist is None:
-            if key in self.data.raw_view:
-                persist = self.data.raw_view[key][0]
+            if key in self._data.raw_view:
+                persist = self._data.raw_view[key][0]
             else:
                 persist = False
         if metadata is None:
-            if key in self.data.raw_view:
-                metadata = self.data.raw_view[key][2]
+            if key in self._data.raw_view:
+                metadata = self._data.raw_view[key][2]
             else:
                 metadata = {}
-        self.data[key] = (persist, value, metadata)
-        self.pending_keys.add(key)
+        self._data[key] = (persist, value, metadata)
+        self._set_pending(key, None)
 
     def delete(self, key):
-        del self.data[key]
-        self.pending_keys.add(key)
+        self._load(key)
+        del self._data[key]
+        self._set_pending(key, None)
     #
 
 
@@ -2,13 +2,16 @@ import asyncio
 import logging
 import csv
 import os.path
+import heapq
+from collections import Counter
 from enum import Enum
 from time import time
 
 from sipyco.sync_struct import Notifier
 from sipyco.asyncio_tools import TaskObject, Condition
 
-from artiq.master.worker import Worker, log_worker_exception
+from artiq.master.worker import (Worker, WorkerProcessPool,
+                                 log_worker_exception)
 from artiq.tools import asyncio_wait_or_cancel
 
 
@@ -27,6 +30,10 @@ class RunStatus(Enum):
     paused = 8
 
 
+# Runs in these states do not prevent a flush run from being prepared.
+_flush_idle_statuses = {RunStatus.pending, RunStatus.deleting}
+
+
 def _mk_worker_method(name):
     async def worker_method(self, *args, **kwargs):
         if self.worker.closed.is_set():
@@ -60,10 +67,14 @@ class Run:
         self.due_date = due_date
         self.flush = flush
 
-        self.worker = Worker(pool.worker_handlers)
+        self.worker = Worker(pool.worker_handlers,
+                             process_pool=pool.worker_process_pool)
         self.termination_requested = False
 
         self._status = RunStatus.pending
+        # incremented on each status change, invalidating the entries
+        # of this run in the pool indexes
+        self.status_seq = 0
 
         notification = {
             "pipeline": self.pipeline_name,
@@ -77,6 +88,7 @@ class Run:
         self._notifier = pool.notifier
         self._notifier[self.rid] = notification
         self._state_changed = pool.state_changed
+        self._status_changed = pool.status_changed
 
     @property
     def status(self):
@@ -84,7 +96,10 @@ class Run:
 
     @status.setter
     def status(self, value):
+        old_status = self._status
         self._status = value
+        self.status_seq += 1
+        self._status_changed(self, old_status)
         if not self.worker.closed.is_set():
             self._notifier[self.rid]["status"] = self._status.name
         self._state_changed.notify()
@@ -96,6 +111,11 @@ class Run:
         """
         return (self.priority, -(self.due_date or 0), -self.rid)
 
+    def heap_key(self):
+        """Return the inverse of :meth:`priority_key`, so that the run with
+        the highest priority is the smallest element of a heap."""
+        return (-self.priority, self.due_date or 0, self.rid)
+
     async def close(self):
         # called through pool
         await self.worker.close()
@@ -115,16 +135,106 @@ class Run:
 
 
 class RunPool:
-    def __init__(self, ridc, worker_handlers, notifier, experiment_db, log_submissions):
+    def __init__(self, ridc, worker_handlers, notifier, experiment_db, log_submissions,
+                 worker_process_pool=None):
         self.runs = dict()
         self.state_changed = Condition()
 
         self.ridc = ridc
         self.worker_handlers = worker_handlers
+        self.worker_process_pool = worker_process_pool
         self.notifier = notifier
         self.experiment_db = experiment_db
         self.log_submissions = log_submissions
 
+        # Per-status priority heaps of (heap_key, status_seq) entries.
+        # Entries are not removed when a run changes status or is deleted;
+        # they are skipped when they reach the top of the heap instead.
+        self._heaps = {status: [] for status in RunStatus}
+        # Pending runs with a due date, as (due_date, rid, status_seq).
+        # They are moved to the pending heap once their due date has elapsed.
+        self._due_heap = []
+        # Priorities of the runs that block a flush.
+        self._flush_blocking = Counter()
+
+    def _index(self, run):
+        if run.status == RunStatus.pending and run.due_date is not None:
+            heap = self._due_heap
+            heapq.heappush(heap, (run.due_date, run.rid, run.status_seq))
+        else:
+            heap = self._heaps[run.status]
+            heapq.heappush(heap, (run.heap_key(), run.status_seq))
+        if len(heap) > 2*len(self.runs) + 16:
+            self._compact()
+
+    def _is_current(self, rid, status_seq):
+        run = self.runs.get(rid)
+        return run is not None and run.status_seq == status_seq
+
+    def _compact(self):
+        for status, heap in self._heaps.items():
+            heap[:] = [entry for entry in heap
+                       if self._is_current(entry[0][2], entry[1])]
+            heapq.heapify(heap)
+        self._due_heap = [entry for entry in self._due_heap
+                          if self._is_current(entry[1], entry[2])]
+        heapq.heapify(self._due_heap)
+
+    def _unblock_flush(self, run, status):
+        if status not in _flush_idle_statuses:
+            self._flush_blocking[run.priority] -= 1
+            if not self._flush_blocking[run.priority]:
+                del self._flush_blocking[run.priority]
+
+    def status_changed(self, run, old_status):
+        # called through run
+        self._unblock_flush(run, old_status)
+        if run.status not in _flush_idle_statuses:
+            self._flush_blocking[run.priority] += 1
+        self._index(run)
+
+    def top(self, status):
+        """Return the run with the given status that has the highest
+        priority, or ``None``.
+
+        For pending runs, only those whose due date has elapsed (as of the
+        last call to :meth:`next_due_date`) are considered.
+        """
+        heap = self._heaps[status]
+        while heap:
+            key, status_seq = heap[0]
+            if self._is_current(key[2], status_seq):
+                return self.runs[key[2]]
+            heapq.heappop(heap)
+        return None
+
+    def next_due_date(self, now):
+        """Make the pending runs whose due date is before ``now`` available
+        through :meth:`top`, and return the earliest due date of the
+        remaining pending runs, or ``None``."""
+        heap = self._due_heap
+        while heap:
+            due_date, rid, status_seq = heap[0]
+            if not self._is_current(rid, status_seq):
+                heapq.heappop(heap)
+            elif due_date < now:
+                heapq.heappop(heap)
+                run = self.runs[rid]
+                heapq.heappush(self._heaps[RunStatus.pending],
+                               (run.heap_key(), status_seq))
+            else:
+                return due_date
+        return None
+
+    def flush_blocked(self, run):
+        """Return ``True`` if a run other than ``run`` and with at least
+        the same priority is neither pending nor being deleted."""
+        blocking = sum(count for priority, count in self._flush_blocking.items()
+                       if priority >= run.priority)
+        if run.status not in _flush_idle_statuses:
+            blocking -= 1
+        return blocking > 0
+
     def log_submission(self, rid, expid):
         start_time = time()
         with open(self.log_submissions, 'a', newline='') as f:
@@ -159,6 +269,7 @@ class RunPool:
         if self.log_submissions is not None:
             self.log_submission(rid, expid)
         self.runs[rid] = run
+        self._index(run)
         self.state_changed.notify()
         return rid
 
@@ -170,6 +281,7 @@ class RunPool:
         await run.close()
         if "repo_rev" in run.expid:
             self.experiment_db.repo_backend.release_rev(run.expid["repo_rev"])
+        self._unblock_flush(run, run.status)
         del self.runs[rid]
 
 
@@ -187,29 +299,21 @@ class PrepareStage(TaskObject):
         of them are going to become next-in-line before further pool state
         changes (which will also cause a re-evaluation).
         """
-        pending_runs = list(
-            filter(lambda r: r.status == RunStatus.pending,
-                   self.pool.runs.values()))
-
         now = time()
-        def is_runnable(r):
-            return (r.due_date or 0) < now
-
-        prepared_max = max((r.priority_key() for r in self.pool.runs.values()
-                            if r.status == RunStatus.prepare_done),
-                           default=None)
-        def takes_precedence(r):
-            return prepared_max is None or r.priority_key() > prepared_max
-
-        candidate = max(filter(is_runnable, pending_runs),
-                        key=lambda r: r.priority_key(),
-                        default=None)
-        if candidate is not None and takes_precedence(candidate):
+        next_due_date = self.pool.next_due_date(now)
+
+        prepared = self.pool.top(RunStatus.prepare_done)
+        candidate = self.pool.top(RunStatus.pending)
+        if candidate is not None and (
+                prepared is None or
+                candidate.priority_key() > prepared.priority_key()):
             return candidate
 
-        return min((r.due_date - now for r in pending_runs
-                    if (not is_runnable(r) and takes_precedence(r))),
-                   default=None)
+        # The run due next may not take precedence over the prepared run,
+        # in which case this only causes an early re-evaluation.
+        if next_due_date is None:
+            return None
+        return next_due_date - now
 
     async def _do(self):
         while True:
@@ -222,11 +326,7 @@ class PrepareStage(TaskObject):
             else:
                 if run.flush:
                     run.status = RunStatus.flushing
-                    while not all(r.status in (RunStatus.pending,
-                                               RunStatus.deleting)
-                                  or r.priority < run.priority
-                                  or r is run
-                                  for r in self.pool.runs.values()):
+                    while self.pool.flush_blocked(run):
                         ev = [self.pool.state_changed.wait(),
                               run.worker.closed.wait()]
                         await asyncio_wait_or_cancel(
@@ -254,14 +354,7 @@ class RunStage(TaskObject):
         self.delete_cb = delete_cb
 
     def _get_run(self):
-        prepared_runs = filter(lambda r: r.status == RunStatus.prepare_done,
-                               self.pool.runs.values())
-        try:
-            r = max(prepared_runs, key=lambda r: r.priority_key())
-        except ValueError:
-            # prepared_runs is an empty sequence
-            r = None
-        return r
+        return self.pool.top(RunStatus.prepare_done)
 
     async def _do(self):
         stack = []
@@ -308,14 +401,7 @@ class AnalyzeStage(TaskObject):
         self.delete_cb = delete_cb
 
     def _get_run(self):
-        run_runs = filter(lambda r: r.status == RunStatus.run_done,
-                          self.pool.runs.values())
-        try:
-            r = max(run_runs, key=lambda r: r.priority_key())
-        except ValueError:
-            # run_runs is an empty sequence
-            r = None
-        return r
+        return self.pool.top(RunStatus.run_done)
 
     async def _do(self):
         while True:
@@ -334,8 +420,10 @@ class AnalyzeStage(TaskObject):
 
 
 class Pipeline:
-    def __init__(self, ridc, deleter, worker_handlers, notifier, experiment_db, log_submissions):
-        self.pool = RunPool(ridc, worker_handlers, notifier, experiment_db, log_submissions)
+    def __init__(self, ridc, deleter, worker_handlers, notifier, experiment_db, log_submissions,
+                 worker_process_pool=None):
+        self.pool = RunPool(ridc, worker_handlers, notifier, experiment_db, log_submissions,
+                            worker_process_pool)
         self._prepare = PrepareStage(self.pool, deleter.delete)
         self._run = RunStage(self.pool, deleter.delete)
         self._analyze = AnalyzeStage(self.pool, deleter.delete)
@@ -406,7 +494,12 @@ class Deleter(TaskObject):
 
 
 class Scheduler:
-    def __init__(self, ridc, worker_handlers, experiment_db, log_submissions):
+    """
+    :param worker_pool_size: number of idle, pre-started worker processes to
+        keep for new runs (see :class:`~artiq.master.worker.WorkerProcessPool`).
+    """
+    def __init__(self, ridc, worker_handlers, experiment_db, log_submissions,
+                 worker_pool_size=0):
         self.notifier = Notifier(dict())
 
         self._pipelines = dict()
@@ -417,10 +510,16 @@ class Scheduler:
         self._ridc = ridc
         self._deleter = Deleter(self._pipelines)
         self._log_submissions = log_submissions
+        if worker_pool_size:
+            self._worker_process_pool = WorkerProcessPool(worker_pool_size)
+        else:
+            self._worker_process_pool = None
 
     def start(self, *, loop=None):
         self._loop = loop
         self._deleter.start(loop=self._loop)
+        if self._worker_process_pool is not None:
+            self._worker_process_pool.start(loop=self._loop)
 
     async def stop(self):
         # NB: restart of a stopped scheduler is not supported
@@ -430,6 +529,8 @@ class Scheduler:
                 self._deleter.delete(rid)
         await self._deleter.join()
         await self._deleter.stop()
+        if self._worker_process_pool is not None:
+            await self._worker_process_pool.stop()
         if self._pipelines:
             logger.warning("some pipelines were not garbage-collected")
 
@@ -449,7 +550,8 @@ class Scheduler:
             logger.debug("creating pipeline '%s'", pipeline_name)
             pipeline = Pipeline(self._ridc, self._deleter,
                                 self._worker_handlers, self.notifier,
-                                self._experiment_db, self._log_submissions)
+                                self._experiment_db, self._log_submissions,
+                                self._worker_process_pool)
             self._pipelines[pipeline_name] = pipeline
             pipeline.start(loop=self._loop)
         return pipeline.pool.submit(expid, priority, due_date, flush, pipeline_name)
@@ -496,12 +598,8 @@ class Scheduler:
                 if run.termination_requested:
                     return True
 
-                prepared_runs = filter(lambda r: r.status == RunStatus.prepare_done,
-                                       pipeline.pool.runs.values())
-                try:
-                    r = max(prepared_runs, key=lambda r: r.priority_key())
-                except ValueError:
-                    # prepared_runs is an empty sequence
+                r = pipeline.pool.top(RunStatus.prepare_done)
+                if r is None:
                     return False
                 return r.priority_key() > run.priority_key()
         raise KeyError("RID not found")
@@ -5,11 +5,12 @@ import logging
 import subprocess
 import time
 
-from sipyco import pipe_ipc, pyon
+from sipyco import pipe_ipc
 from sipyco.logging_tools import LogParser
 from sipyco.packed_exceptions import current_exc_packed
 
 from artiq.tools import asyncio_wait_or_cancel
+from artiq.master.worker_ipc import encode_frame, read_frame_async
 
 
 logger = logging.getLogger(__name__)
@@ -41,14 +42,122 @@ def log_worker_exception():
         logger.error("worker exception details", exc_info=True)
 
 
+async def _start_worker_process(log_level, log_source):
+    ipc = pipe_ipc.AsyncioParentComm()
+    env = os.environ.copy()
+    env["PYTHONUNBUFFERED"] = "1"
+    await ipc.create_subprocess(
+        sys.executable, "-m", "artiq.master.worker_impl",
+        ipc.get_address(), str(log_level),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        env=env, start_new_session=True)
+    asyncio.ensure_future(
+        LogParser(log_source).stream_task(
+            ipc.process.stdout))
+    asyncio.ensure_future(
+        LogParser(log_source).stream_task(
+            ipc.process.stderr))
+    return ipc
+
+
+class _PooledLogSource:
+    def __init__(self):
+        self.worker = None
+
+    def __call__(self):
+        if self.worker is None:
+            return "worker(idle)"
+        return self.worker._get_log_source()
+
+
+class WorkerProcessPool:
+    """Keeps a number of idle worker processes ready to be handed over to
+    new :class:`Worker` instances.
+
+    Idle processes have already started the Python interpreter and imported
+    the worker modules (numpy, h5py, the compiler, etc.), so a run that gets
+    one skips that startup time. Processes are not reused after a run; the
+    pool is replenished in the background instead.
+
+    :param size: number of idle processes to keep. Zero disables the pool.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._idle = []
+        self._replenish_task = None
+        self._closed = False
+        self._loop = None
+
+    def start(self, *, loop=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self._loop = loop
+        self._replenish()
+
+    def _replenish(self):
+        if (self._closed or len(self._idle) >= self.size
+                or self._replenish_task is not None):
+            return
+        self._replenish_task = self._loop.create_task(self._do_replenish())
+
+    async def _do_replenish(self):
+        try:
+            while not self._closed and len(self._idle) < self.size:
+                log_source = _PooledLogSource()
+                ipc = await _start_worker_process(logging.WARNING, log_source)
+                self._idle.append((ipc, log_source))
+        except Exception:
+            logger.warning("failed to start idle worker process",
+                           exc_info=True)
+        finally:
+            self._replenish_task = None
+
+    def get(self, worker):
+        """Return the IPC object of an idle worker process now owned by
+        ``worker``, or ``None`` if none is available."""
+        result = None
+        while self._idle and result is None:
+            ipc, log_source = self._idle.pop(0)
+            if ipc.process.returncode is None:
+                log_source.worker = worker
+                result = ipc
+        self._replenish()
+        return result
+
+    async def _close_idle(self, term_timeout=2.0):
+        idle, self._idle = self._idle, []
+        for ipc, _ in idle:
+            if ipc.process.returncode is not None:
+                continue
+            try:
+                for buffer in encode_frame({"action": "terminate"}):
+                    ipc.write(buffer)
+                await asyncio.wait_for(ipc.process.wait(), term_timeout)
+            except:
+                logger.debug("idle worker failed to exit on request",
+                             exc_info=True)
+                try:
+                    ipc.process.kill()
+                except ProcessLookupError:
+                    pass
+
+    async def stop(self):
+        self._closed = True
+        if self._replenish_task is not None:
+            await self._replenish_task
+        await self._close_idle()
+
+
 class Worker:
-    def __init__(self, handlers=dict(), send_timeout=10.0):
+    def __init__(self, handlers=dict(), send_timeout=10.0, process_pool=None):
         self.handlers = handlers
         self.send_timeout = send_timeout
+        self.process_pool = process_pool
 
         self.rid = None
         self.filename = None
         self.ipc = None
+        self.recv_task = None
         self.watchdogs = dict()  # wid -> expiration (using time.monotonic)
 
         self.io_lock = asyncio.Lock()
@@ -83,20 +192,11 @@ class Worker:
         try:
             if self.closed.is_set():
                 raise WorkerError("Attempting to create process after close")
-            self.ipc = pipe_ipc.AsyncioParentComm()
-            env = os.environ.copy()
-            env["PYTHONUNBUFFERED"] = "1"
-            await self.ipc.create_subprocess(
-                sys.executable, "-m", "artiq.master.worker_impl",
-                self.ipc.get_address(), str(log_level),
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                env=env, start_new_session=True)
-            asyncio.ensure_future(
-                LogParser(self._get_log_source).stream_task(
-                    self.ipc.process.stdout))
-            asyncio.ensure_future(
-                LogParser(self._get_log_source).stream_task(
-                    self.ipc.process.stderr))
+            if self.process_pool is not None:
+                self.ipc = self.process_pool.get(self)
+            if self.ipc is None:
+                self.ipc = await _start_worker_process(log_level,
+                                                       self._get_log_source)
         finally:
             self.io_lock.release()
 
@@ -153,12 +253,15 @@ class Worker:
             except asyncio.TimeoutError:
                 logger.warning("worker refuses to die (RID %s)", self.rid)
         finally:
+            if self.recv_task is not None:
+                self.recv_task.cancel()
+                self.recv_task = None
             self.io_lock.release()
 
     async def _send(self, obj, cancellable=True):
         assert self.io_lock.locked()
-        line = pyon.encode(obj)
-        self.ipc.write((line + "\n").encode())
+        for buffer in encode_frame(obj):
+            self.ipc.write(buffer)
         ifs = [self.ipc.drain()]
         if cancellable:
             ifs.append(self.closed.wait())
@@ -178,8 +281,13 @@ class Worker:
 
     async def _recv(self, timeout):
         assert self.io_lock.locked()
+        # A frame is read with several awaits. The read is not cancelled on
+        # timeout, so that the next call completes a partially read frame
+        # instead of parsing its remainder as a new one.
+        if self.recv_task is None:
+            self.recv_task = asyncio.ensure_future(read_frame_async(self.ipc))
         fs = await asyncio_wait_or_cancel(
-            [self.ipc.readline(), self.closed.wait()],
+            [asyncio.shield(self.recv_task), self.closed.wait()],
             timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
         if all(f.cancelled() for f in fs):
             raise WorkerTimeout(
@@ -188,15 +296,15 @@ class Worker:
             raise WorkerError(
                 "Receiving data from worker cancelled (RID {})".format(
                     self.rid))
-        line = fs[0].result()
-        if not line:
+        recv_task, self.recv_task = self.recv_task, None
+        try:
+            obj = recv_task.result()
+        except EOFError:
             raise WorkerError(
                 "Worker ended while attempting to receive data (RID {})".
                 format(self.rid))
-        try:
-            obj = pyon.decode(line.decode())
         except:
-            raise WorkerError("Worker sent invalid PYON data (RID {})".format(
+            raise WorkerError("Worker sent invalid data (RID {})".format(
                 self.rid))
         return obj
 
@@ -275,7 +383,8 @@ class Worker:
              "pipeline_name": pipeline_name,
              "wd": wd,
              "expid": expid,
-             "priority": priority},
+             "priority": priority,
+             "log_level": expid["log_level"]},
             timeout)
 
     async def prepare(self):
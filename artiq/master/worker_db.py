@@ -7,7 +7,11 @@ standalone command line tools).
 from operator import setitem
 import importlib
 import logging
+import copy
+import sys
+import time
 
+import numpy as np
 from sipyco.sync_struct import Notifier
 from sipyco.pc_rpc import AutoTarget, Client, BestEffortClient
 
@@ -116,6 +120,202 @@ class DeviceManager:
         self.active_devices.clear()
 
 
+# Assigning to this slice of a list extends it, whatever its length. Batched
+# appends are sent as setitem mods with this key, which clients (e.g. applets)
+# recognize.
+extend_slice = slice(sys.maxsize, None)
+
+
+def _mod_dataset_key(mod):
+    if mod["path"]:
+        return mod["path"][0]
+    else:
+        return mod["key"]
+
+
+def _same_element(a, b):
+    # Slice assignments are not merged: on a list, they can change its
+    # length and thereby what the next assignment replaces.
+    return type(a) is type(b) and isinstance(a, int) and a == b
+
+
+class DatasetModBatch:
+    """Accumulates dataset mods to be sent to the master as a batch.
+
+    Mods are copied when added, and merged where this does not change the
+    result of applying the batch:
+
+    * setting or deleting a dataset discards the previous mods of that dataset,
+    * consecutive appends to a dataset are merged into one mod that extends it,
+    * consecutive mutations of the same element (integer index) of a dataset
+      keep the last value only.
+    """
+    def __init__(self):
+        self.mods = []
+
+    def __bool__(self):
+        return bool(self.mods)
+
+    def _last_mod(self, key):
+        for mod in reversed(self.mods):
+            if _mod_dataset_key(mod) == key:
+                return mod
+        return None
+
+    def add(self, mod):
+        mod = copy.deepcopy(mod)
+        key = _mod_dataset_key(mod)
+        if not mod["path"]:
+            self.mods = [m for m in self.mods if _mod_dataset_key(m) != key]
+            self.mods.append(mod)
+            return
+
+        last = self._last_mod(key)
+        if last is not None and last["path"] == mod["path"]:
+            if mod["action"] == "append":
+                if last["action"] == "append":
+                    last["action"] = "setitem"
+                    last["key"] = extend_slice
+                    last["value"] = [last.pop("x"), mod["x"]]
+                    return
+                if (last["action"] == "setitem"
+                        and last["key"] is extend_slice):
+                    last["value"].append(mod["x"])
+                    return
+            elif (mod["action"] == "setitem" and last["action"] == "setitem"
+                    and last["key"] is not extend_slice
+                    and _same_element(last["key"], mod["key"])):
+                last["value"] = mod["value"]
+                return
+        self.mods.append(mod)
+
+    def take(self):
+        """Return the accumulated mods and empty the batch."""
+        mods, self.mods = self.mods, []
+        return mods
+
+
+class _NotStreamable(Exception):
+    pass
+
+
+class _StreamedDataset:
+    """Archived dataset held in a resizable, chunked HDF5 dataset instead
+    of memory. Elements appended to a list are buffered and written in
+    blocks."""
+    def __init__(self, stream, key, value, metadata):
+        self.stream = stream
+        self.key = key
+        self.metadata = metadata
+        self.is_list = isinstance(value, list)
+        self.dataset = None
+        self.pending = []
+        if not self.is_list or value:
+            self._create(np.asarray(value))
+
+    def _create(self, data):
+        if data.ndim < 1 or data.dtype.kind not in "biuf":
+            raise _NotStreamable
+        try:
+            self.dataset = self.stream.group.create_dataset(
+                self.key, data=data, maxshape=(None, ) + data.shape[1:],
+                chunks=True)
+            for key, val in self.metadata.items():
+                self.dataset.attrs[key] = val
+        except Exception as e:
+            raise _NotStreamable from e
+
+    def append(self, x):
+        if not self.is_list:
+            raise AttributeError("'numpy.ndarray' object has no attribute 'append'")
+        self.pending.append(x)
+        if (len(self.pending) >= self.stream.block_size
+                or time.monotonic() - self.stream.last_flush
+                    >= self.stream.flush_period):
+            self.flush()
+            self.stream.flush_file()
+
+    def flush(self):
+        if not self.pending:
+            return
+        try:
+            block = np.asarray(self.pending)
+        except ValueError as e:
+            raise _NotStreamable from e
+        if self.dataset is None:
+            self._create(block)
+        else:
+            if (block.dtype.kind not in "biuf"
+                    or block.shape[1:] != self.dataset.shape[1:]
+                    or np.result_type(self.dataset.dtype, block.dtype)
+                        != self.dataset.dtype):
+                raise _NotStreamable
+            length = self.dataset.shape[0]
+            self.dataset.resize(length + len(block), axis=0)
+            try:
+                self.dataset[length:] = block
+            except Exception as e:
+                self.dataset.resize(length, axis=0)
+                raise _NotStreamable from e
+        self.pending = []
+
+    def __setitem__(self, index, value):
+        self.flush()
+        if self.is_list:
+            # HDF5 casts the value to the type of the dataset, while a list
+            # keeps it as is. (NumPy arrays cast it like HDF5.)
+            try:
+                dtype = np.asarray(value).dtype
+            except ValueError as e:
+                raise _NotStreamable from e
+            if not np.can_cast(dtype, self.dataset.dtype, "safe"):
+                raise _NotStreamable
+        self.dataset[index] = value
+
+    def value(self):
+        if self.dataset is None:
+            data = []
+        else:
+            data = self.dataset[()]
+            if self.is_list:
+                data = data.tolist()
+        if self.is_list:
+            data += self.pending
+        return data
+
+
+class _HDF5Stream:
+    block_size = 1024
+    flush_period = 1.0
+
+    def __init__(self, f):
+        self.file = f
+        self.group = f.require_group("datasets")
+        self.datasets = dict()
+        self.last_flush = time.monotonic()
+
+    def add(self, key, value, metadata):
+        self.remove(key)
+        if not isinstance(value, (list, np.ndarray)):
+            return None
+        try:
+            dataset = _StreamedDataset(self, key, value, metadata)
+        except _NotStreamable:
+            self.remove(key)
+            return None
+        self.datasets[key] = dataset
+        return dataset
+
+    def remove(self, key):
+        self.datasets.pop(key, None)
+        if key in self.group:
+            del self.group[key]
+
+    def flush_file(self):
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+
 class DatasetManager:
     def __init__(self, ddb):
         self._broadcaster = Notifier(dict())
@@ -126,6 +326,59 @@ class DatasetManager:
         self.ddb = ddb
         self._broadcaster.publish = ddb.update
 
+        # Called without arguments to open the results file when streaming
+        # is enabled. Set by the worker.
+        self.results_file_factory = None
+        self._stream = None
+
+    @property
+    def results_file(self):
+        """The open results file if streaming is enabled, else ``None``."""
+        if self._stream is None:
+            return None
+        return self._stream.file
+
+    def enable_streaming(self):
+        if self._stream is not None:
+            return
+        if self.results_file_factory is None:
+            logger.warning("Dataset streaming is not available, datasets "
+                           "will be written at the end of the experiment")
+            return
+        self._stream = _HDF5Stream(self.results_file_factory())
+        for key, value in list(self.local.items()):
+            self._archive(key, value)
+
+    def _archive(self, key, value):
+        if self._stream is not None:
+            if key in self._broadcaster.raw_view:
+                # held in memory by the broadcaster anyway
+                self._stream.remove(key)
+            else:
+                streamed = self._stream.add(key, value,
+                                            self.metadata.get(key, {}))
+                if streamed is not None:
+                    value = streamed
+        self.local[key] = value
+
+    def _unstream(self, key):
+        value = self._stream.datasets[key].value()
+        self._stream.remove(key)
+        self.local[key] = value
+        return value
+
+    def flush_stream(self):
+        """Write all buffered elements of streamed datasets to the
+        results file."""
+        if self._stream is None:
+            return
+        for key, dataset in list(self._stream.datasets.items()):
+            try:
+                dataset.flush()
+            except _NotStreamable:
+                self._unstream(key)
+        self._stream.flush_file()
+
     def set(self, key, value, metadata, broadcast, persist, archive):
         if persist:
             broadcast = True
@@ -138,12 +391,14 @@ class DatasetManager:
         elif key in self._broadcaster.raw_view:
             del self._broadcaster[key]
 
+        self.metadata[key] = metadata
+
         if archive:
-            self.local[key] = value
+            self._archive(key, value)
         elif key in self.local:
             del self.local[key]
-        
-        self.metadata[key] = metadata
+            if self._stream is not None:
+                self._stream.remove(key)
 
     def _get_mutation_target(self, key):
         target = self.local.get(key, None)
@@ -162,14 +417,32 @@ class DatasetManager:
                 index = tuple(slice(*e) for e in index)
             else:
                 index = slice(*index)
+        if isinstance(target, _StreamedDataset):
+            try:
+                target[index] = value
+                return
+            except Exception:
+                # Retry in memory, where an invalid mutation raises the
+                # usual exception.
+                target = self._unstream(key)
         setitem(target, index, value)
 
     def append_to(self, key, value):
-        self._get_mutation_target(key).append(value)
+        target = self._get_mutation_target(key)
+        if isinstance(target, _StreamedDataset):
+            try:
+                target.append(value)
+            except _NotStreamable:
+                self._unstream(key)
+        else:
+            target.append(value)
 
     def get(self, key, archive=False):
         if key in self.local:
-            return self.local[key]
+            value = self.local[key]
+            if isinstance(value, _StreamedDataset):
+                return value.value()
+            return value
         
         data = self.ddb.get(key)
         if archive:
@@ -185,8 +458,13 @@ class DatasetManager:
         return self.ddb.get_metadata(key)
 
     def write_hdf5(self, f):
-        datasets_group = f.create_group("datasets")
+        self.flush_stream()
+        datasets_group = f.require_group("datasets")
         for k, v in self.local.items():
+            if isinstance(v, _StreamedDataset):
+                if v.dataset is not None:
+                    continue
+                v = v.value()
             m = self.metadata.get(k, {})
             _write(datasets_group, k, v, m)
 
@@ -12,6 +12,7 @@ import os
 import inspect
 import logging
 import traceback
+import threading
 from collections import OrderedDict
 import importlib.util
 import linecache
@@ -24,7 +25,9 @@ from sipyco.logging_tools import multiline_log_config
 
 import artiq
 from artiq import tools
-from artiq.master.worker_db import DeviceManager, DatasetManager, DummyDevice
+from artiq.master.worker_ipc import read_frame, write_frame
+from artiq.master.worker_db import (DeviceManager, DatasetManager,
+                                    DatasetModBatch, DummyDevice)
 from artiq.language.environment import (
     is_public_experiment, TraceArgumentManager, ProcessArgumentManager
 )
@@ -36,23 +39,28 @@ from artiq import __version__ as artiq_version
 
 
 ipc = None
+# Held for the duration of each exchange with the master, including while the
+# main thread waits for its next command, so that the frames of other threads
+# setting datasets are not interleaved with it.
+ipc_lock = threading.RLock()
 
 
 def get_object():
-    line = ipc.readline().decode()
-    return pyon.decode(line)
+    return read_frame(ipc)
 
 
 def put_object(obj):
-    ds = pyon.encode(obj)
-    ipc.write((ds + "\n").encode())
+    write_frame(ipc, obj)
 
 
 def make_parent_action(action):
     def parent_action(*args, **kwargs):
         request = {"action": action, "args": args, "kwargs": kwargs}
-        put_object(request)
-        reply = get_object()
+        with ipc_lock:
+            # Keep the master datasets up to date before any other request.
+            ParentDatasetDB.flush()
+            put_object(request)
+            reply = get_object()
         if "action" in reply:
             if reply["action"] == "terminate":
                 sys.exit()
@@ -71,10 +79,45 @@ class ParentDeviceDB:
 
 
 class ParentDatasetDB:
+    """Dataset mods are sent to the master in batches: by the first update
+    made at least ``flush_period`` seconds after the previous batch, before
+    any other request and at the end of each stage.
+
+    Batches are sent by the thread making the update, so that a termination
+    request received in reply ends the experiment as any other request does.
+    """
+    flush_period = 0.1
+
     get = make_parent_action("get_dataset")
-    update = make_parent_action("update_dataset")
+    _update_batch = make_parent_action("update_dataset_batch")
     get_metadata = make_parent_action("get_dataset_metadata")
 
+    _batch = DatasetModBatch()
+    _batch_lock = threading.Lock()
+    _last_flush = 0.0
+
+    @classmethod
+    def update(cls, mod):
+        with cls._batch_lock:
+            cls._batch.add(mod)
+        if time.monotonic() - cls._last_flush >= cls.flush_period:
+            # If another thread is exchanging with the master, or the main
+            # thread waits for its next command, the batch is sent later.
+            if ipc_lock.acquire(blocking=False):
+                try:
+                    cls.flush()
+                finally:
+                    ipc_lock.release()
+
+    @classmethod
+    def flush(cls):
+        with ipc_lock:
+            with cls._batch_lock:
+                mods = cls._batch.take() if cls._batch else None
+            if mods:
+                cls._last_flush = time.monotonic()
+                cls._update_batch(mods)
+
 
 class Watchdog:
     _create = make_parent_action("create_watchdog")
@@ -191,6 +234,10 @@ class ExamineDatasetMgr:
     def get_metadata(key):
         return ParentDatasetDB.get_metadata(key)
 
+    @staticmethod
+    def enable_streaming():
+        pass
+
 
 def examine(device_mgr, dataset_mgr, file):
     previous_keys = set(sys.modules.keys())
@@ -259,8 +306,19 @@ def setup_diagnostics(experiment_file, repository_path):
         render_diagnostic
 
 
+def set_log_level(level):
+    # Workers taken from a pool were started before the level of their run
+    # was known.
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    for handler in root_logger.handlers:
+        handler.setLevel(level)
+
+
 def put_completed():
-    put_object({"action": "completed"})
+    with ipc_lock:
+        ParentDatasetDB.flush()
+        put_object({"action": "completed"})
 
 
 def put_exception_report():
@@ -280,7 +338,12 @@ def put_exception_report():
             lines += traceback.format_exception_only(type(exc), exc)
         logging.error("".join(lines).rstrip(),
                       exc_info=not hasattr(exc, "parent_traceback"))
-    put_object({"action": "exception"})
+    with ipc_lock:
+        try:
+            ParentDatasetDB.flush()
+        except:
+            logging.warning("failed to send dataset updates", exc_info=True)
+        put_object({"action": "exception"})
 
 
 def main():
@@ -297,15 +360,31 @@ def main():
     exp_inst = None
     repository_path = None
 
+    def write_run_info(f):
+        f["artiq_version"] = artiq_version
+        f["rid"] = rid
+        f["start_time"] = start_time
+        f["expid"] = pyon.encode(expid)
+
+    def open_results_file():
+        # Used when the experiment enables dataset streaming.
+        f = h5py.File("{:09}-{}.h5".format(rid, exp.__name__), "w")
+        write_run_info(f)
+        f.flush()
+        return f
+
     def write_results():
-        filename = "{:09}-{}.h5".format(rid, exp.__name__)
-        with h5py.File(filename, "w") as f:
+        f = dataset_mgr.results_file
+        if f is None:
+            filename = "{:09}-{}.h5".format(rid, exp.__name__)
+            with h5py.File(filename, "w") as f:
+                dataset_mgr.write_hdf5(f)
+                write_run_info(f)
+                f["run_time"] = run_time
+        elif f:
             dataset_mgr.write_hdf5(f)
-            f["artiq_version"] = artiq_version
-            f["rid"] = rid
-            f["start_time"] = start_time
             f["run_time"] = run_time
-            f["expid"] = pyon.encode(expid)
+            f.close()
 
     device_mgr = DeviceManager(ParentDeviceDB,
                                virtual_devices={"scheduler": Scheduler(),
@@ -316,10 +395,13 @@ def main():
 
     try:
         while True:
-            obj = get_object()
+            with ipc_lock:
+                obj = get_object()
             action = obj["action"]
             if action == "build":
                 start_time = time.time()
+                if "log_level" in obj:
+                    set_log_level(obj["log_level"])
                 rid = obj["rid"]
                 expid = obj["expid"]
                 if "devarg_override" in expid:
@@ -345,12 +427,15 @@ def main():
                                        time.strftime("%H", start_local_time))
                 os.makedirs(dirname, exist_ok=True)
                 os.chdir(dirname)
+                if rid is not None:
+                    dataset_mgr.results_file_factory = open_results_file
                 argument_mgr = ArgumentManager(expid["arguments"])
                 exp_inst = exp((device_mgr, dataset_mgr, argument_mgr, {}))
                 argument_mgr.check_unprocessed_arguments()
                 put_completed()
             elif action == "prepare":
                 exp_inst.prepare()
+                dataset_mgr.flush_stream()
                 put_completed()
             elif action == "run":
                 run_time = time.time()
@@ -369,6 +454,7 @@ def main():
                         # callbacks produce an exception
                         write_results()
                         raise
+                dataset_mgr.flush_stream()
                 put_completed()
             elif action == "analyze":
                 try:
@@ -0,0 +1,179 @@
+"""Framing of the messages exchanged between the master and its workers.
+
+Each message is sent as a frame made of a fixed-size header, a PYON body and
+the raw contents of the large numpy arrays found in the message. Such arrays
+are replaced by ``None`` in the body and described by a list of
+``(path, dtype, shape)`` entries, so that their data is written directly from
+the array memory and read back into a new array, without going through the
+PYON text encoding. Everything else is encoded with PYON.
+"""
+
+import struct
+
+import numpy
+from sipyco import pyon
+
+
+__all__ = ["encode_frame", "write_frame", "read_frame", "read_frame_async"]
+
+
+# body length, total length of the array data
+_header = struct.Struct("<QQ")
+
+# Arrays smaller than this are left to PYON.
+OOB_THRESHOLD = 1024
+# bool, integer, float and complex arrays (no object or structured dtypes)
+_oob_kinds = "biufc"
+
+
+def _extract(obj, path, arrays):
+    if isinstance(obj, numpy.ndarray):
+        if obj.dtype.kind in _oob_kinds and obj.nbytes >= OOB_THRESHOLD:
+            arrays.append((path, obj))
+            return None
+        return obj
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, (list, tuple)):
+        items = enumerate(obj)
+    else:
+        return obj
+
+    replaced = None
+    for key, value in items:
+        if isinstance(value, (numpy.ndarray, dict, list, tuple)):
+            new_value = _extract(value, path + (key, ), arrays)
+            if new_value is not value:
+                if replaced is None:
+                    replaced = dict()
+                replaced[key] = new_value
+    if replaced is None:
+        return obj
+
+    # Only the containers leading to an array are copied.
+    if isinstance(obj, dict):
+        result = obj.copy()
+        result.update(replaced)
+    else:
+        result = list(obj)
+        for key, value in replaced.items():
+            result[key] = value
+        if isinstance(obj, tuple):
+            result = tuple(result)
+    return result
+
+
+def _insert(obj, path, value):
+    if not path:
+        return value
+    key = path[0]
+    child = _insert(obj[key], path[1:], value)
+    if isinstance(obj, tuple):
+        obj = list(obj)
+        obj[key] = child
+        return tuple(obj)
+    obj[key] = child
+    return obj
+
+
+def _byte_view(array):
+    return memoryview(array.reshape(-1).view(numpy.uint8))
+
+
+def encode_frame(obj):
+    """Encode a message.
+
+    :return: a list of buffers to be written in order. Array contents are
+        returned as views of the arrays and are not copied, unless an array
+        is not contiguous.
+    """
+    arrays = []
+    body = _extract(obj, (), arrays)
+    descriptors = []
+    buffers = []
+    for path, array in arrays:
+        array = numpy.ascontiguousarray(array)
+        descriptors.append((path, array.dtype.str, array.shape))
+        buffers.append(_byte_view(array))
+    body = pyon.encode((body, descriptors)).encode()
+    header = _header.pack(len(body), sum(len(buffer) for buffer in buffers))
+    return [header, body] + buffers
+
+
+def write_frame(ipc, obj):
+    """Write a message to a blocking IPC object (worker side)."""
+    for buffer in encode_frame(obj):
+        view = memoryview(buffer)
+        while view:
+            written = ipc.write(view)
+            if written is None:
+                break
+            view = view[written:]
+
+
+def _decode_body(body):
+    obj, descriptors = pyon.decode(body.decode())
+    arrays = []
+    for path, dtype, shape in descriptors:
+        array = numpy.empty(shape, dtype)
+        arrays.append((path, array))
+    return obj, arrays
+
+
+def _check_lengths(arrays, data_length):
+    if sum(array.nbytes for _, array in arrays) != data_length:
+        raise ValueError("inconsistent frame header")
+
+
+def _read_into(ipc, view):
+    while view:
+        data = ipc.read(len(view))
+        if not data:
+            raise EOFError
+        view[:len(data)] = data
+        view = view[len(data):]
+
+
+async def _read_into_async(ipc, view):
+    while view:
+        data = await ipc.read(len(view))
+        if not data:
+            raise EOFError
+        view[:len(data)] = data
+        view = view[len(data):]
+
+
+def read_frame(ipc):
+    """Read a message from a blocking IPC object (worker side).
+
+    :raises EOFError: if the other end closed the connection.
+    """
+    header = bytearray(_header.size)
+    _read_into(ipc, memoryview(header))
+    body_length, data_length = _header.unpack(header)
+    body = bytearray(body_length)
+    _read_into(ipc, memoryview(body))
+    obj, arrays = _decode_body(body)
+    _check_lengths(arrays, data_length)
+    for path, array in arrays:
+        _read_into(ipc, _byte_view(array))
+        obj = _insert(obj, path, array)
+    return obj
+
+
+async def read_frame_async(ipc):
+    """Read a message from an asyncio IPC object (master side).
+
+    :raises EOFError: if the other end closed the connection.
+    """
+    header = bytearray(_header.size)
+    await _read_into_async(ipc, memoryview(header))
+    body_length, data_length = _header.unpack(header)
+    body = bytearray(body_length)
+    await _read_into_async(ipc, memoryview(body))
+    obj, arrays = _decode_body(body)
+    _check_lengths(arrays, data_length)
+    for path, array in arrays:
+        await _read_into_async(ipc, _byte_view(array))
+        obj = _insert(obj, path, array)
+    return obj
@@ -42,6 +42,29 @@ class _Precompile(EnvExperiment):
         precompiled()
 
 
+class _RepeatPrecompiled(EnvExperiment):
+    def build(self):
+        self.setattr_device("core")
+        self.count = 0
+
+    def increment(self):
+        self.count += 1
+
+    @kernel
+    def the_kernel(self):
+        self.increment()
+
+    def run(self):
+        precompiled = self.core.precompile(self.the_kernel)
+        for _ in range(10):
+            precompiled()
+
+
+class _PrecompileBundle(_Precompile):
+    def run(self):
+        pass
+
+
 class TestCompile(ExperimentCase):
     def test_compile(self):
         core_addr = self.device_mgr.get_desc("core")["arguments"]["host"]
@@ -62,3 +85,21 @@ class TestCompile(ExperimentCase):
         exp.run()
         self.assertEqual(exp.x, 42)
         self.assertEqual(exp.z, 3)
+
+    def test_resident_kernel(self):
+        exp = self.create(_RepeatPrecompiled)
+        exp.run()
+        self.assertEqual(exp.count, 10)
+        if exp.core.comm.resident_kernels:
+            self.assertIsNotNone(exp.core.comm._resident_digest)
+
+    def test_precompile_bundle(self):
+        exp = self.create(_PrecompileBundle)
+        with tempfile.TemporaryDirectory() as tmp:
+            bundle_path = os.path.join(tmp, "the_kernel.tar")
+            exp.core.precompile_bundle(exp.the_kernel, 40).save(bundle_path)
+            exp = self.create(_PrecompileBundle)
+            exp.y = 0
+            exp.core.load_precompiled(bundle_path, exp)()
+        self.assertEqual(exp.x, 42)
+        self.assertEqual(exp.z, 3)
@@ -0,0 +1,73 @@
+import os
+import random
+import struct
+import tempfile
+import unittest
+
+import numpy
+
+from artiq.coredevice.comm_analyzer import (
+    decode_dump, decoded_dump_to_waveform_data, get_message_time,
+    StoppedMessage)
+from artiq.coredevice.analyzer_trace import (
+    is_analyzer_trace, write_trace, AnalyzerTrace)
+
+
+def make_dump(n, seed=0):
+    rng = random.Random(seed)
+    messages = bytearray()
+    t = 1000
+    for _ in range(n):
+        channel = rng.randint(0, 3)
+        t += rng.randint(0, 50)
+        messages += struct.pack(">QIQQI", rng.randint(0, 1),
+                                rng.randint(0, 1), t - rng.randint(0, 100),
+                                t - rng.randint(0, 20), channel << 2)
+    messages += struct.pack(">QIQQI", 0, 0, t + 10, 0, 3)
+    header = struct.pack("<IQbbb", len(messages), len(messages), 0, 7, 0)
+    return b"e" + header + bytes(messages)
+
+
+class AnalyzerTraceCase(unittest.TestCase):
+    def setUp(self):
+        self.dump = decode_dump(make_dump(1000))
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+        write_trace(self.filename, self.dump)
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_messages(self):
+        self.assertTrue(is_analyzer_trace(self.filename))
+        expected = sorted(list(self.dump.messages)[:-1], key=get_message_time)
+        with AnalyzerTrace(self.filename) as trace:
+            self.assertEqual(trace.channels, [0, 1, 2, 3])
+            self.assertEqual(list(trace.get_messages()), expected)
+            for channel in trace.channels:
+                self.assertEqual(
+                    list(trace.get_messages(channel, 5000, 10000)),
+                    [message for message in expected
+                     if message.channel == channel
+                     and 5000 <= get_message_time(message) < 10000])
+            messages = trace.get_decoded_dump().messages
+            self.assertEqual(list(messages), expected + [
+                StoppedMessage(trace.stopped)])
+
+    def test_waveform_data(self):
+        devices = {
+            "ttl{}".format(channel): {
+                "type": "local", "module": "artiq.coredevice.ttl",
+                "class": "TTLOut", "arguments": {"channel": channel}}
+            for channel in range(4)
+        }
+        expected = decoded_dump_to_waveform_data(devices, self.dump)
+        with AnalyzerTrace(self.filename) as trace:
+            data = decoded_dump_to_waveform_data(
+                devices, trace.get_decoded_dump({1, 2}))
+        self.assertEqual(data["stopped_x"], expected["stopped_x"])
+        for name in "ttl/ttl1", "ttl/ttl2":
+            for array, expected_array in zip(data["data"][name],
+                                             expected["data"][name]):
+                numpy.testing.assert_array_equal(array, expected_array)
+        self.assertEqual(len(data["data"]["ttl/ttl0"][0]), 0)
@@ -0,0 +1,120 @@
+import unittest
+
+import numpy as np
+
+from artiq.applets.simple import (DatasetBuffer, DatasetChange,
+                                  get_dataset_changes)
+from artiq.master.worker_db import DatasetModBatch
+
+
+def append(key, x):
+    return {"action": "append", "path": [key, 1], "x": x}
+
+
+def setitem(path, key, value):
+    return {"action": "setitem", "path": path, "key": key, "value": value}
+
+
+class DatasetChangesCase(unittest.TestCase):
+    def test_init(self):
+        self.assertIsNone(get_dataset_changes(
+            [append("a", 1), {"action": "init", "struct": dict()}]))
+
+    def test_append(self):
+        batch = DatasetModBatch()
+        for x in range(5):
+            batch.add(append("a", x))
+        mods = [append("b", 0)] + batch.take()
+        # Batched appends are sent as an extend slice assignment.
+        self.assertEqual(mods[1]["action"], "setitem")
+
+        changes = get_dataset_changes(mods)
+        self.assertEqual(set(changes), {"a", "b"})
+        self.assertEqual(changes["a"].appended, 5)
+        self.assertEqual(changes["b"].appended, 1)
+        for change in changes.values():
+            self.assertFalse(change.replaced)
+            self.assertEqual(change.mutated, [])
+            self.assertTrue(change.value_changed)
+
+    def test_setitem(self):
+        change = get_dataset_changes([
+            setitem(["a", 1], 2, 0.5),
+            setitem(["a", 1], slice(0, 2), [1, 2]),
+            setitem(["a", 1, 3], 0, 1.0),
+        ])["a"]
+        self.assertFalse(change.replaced)
+        self.assertEqual(change.appended, 0)
+        self.assertEqual(change.mutated, [2, slice(0, 2), 3])
+
+    def test_replace(self):
+        for mod in [
+            setitem([], "a", (False, [1, 2], dict())),
+            {"action": "delitem", "path": [], "key": "a"},
+            setitem(["a"], 1, [1, 2]),
+            {"action": "delitem", "path": ["a", 1], "key": 0},
+            {"action": "insert", "path": ["a", 1], "i": 0, "x": 1},
+        ]:
+            change = get_dataset_changes([append("a", 1), mod])["a"]
+            self.assertTrue(change.replaced)
+            self.assertTrue(change.value_changed)
+
+    def test_metadata(self):
+        changes = get_dataset_changes([
+            setitem(["a"], 0, True),
+            setitem(["a"], 2, {"unit": "Hz"}),
+            setitem(["a", 2], "scale", 1e3),
+        ])
+        self.assertEqual(set(changes), {"a"})
+        self.assertFalse(changes["a"].value_changed)
+
+
+def change(replaced=False, appended=0, mutated=()):
+    change = DatasetChange()
+    change.replaced = replaced
+    change.appended = appended
+    change.mutated = list(mutated)
+    return change
+
+
+class DatasetBufferCase(unittest.TestCase):
+    def test_extend(self):
+        buffer = DatasetBuffer()
+        value = []
+        for x in range(100):
+            value.append(x)
+            self.assertTrue(buffer.update(value, change(appended=1)))
+        self.assertEqual(len(buffer), 100)
+        np.testing.assert_array_equal(buffer.array, value)
+        self.assertLess(len(buffer._buffer), 400)
+
+        value += [100, 101, 102]
+        self.assertTrue(buffer.update(value, change(appended=3)))
+        np.testing.assert_array_equal(buffer.array, value)
+
+    def test_mutate(self):
+        buffer = DatasetBuffer()
+        buffer.set([0, 1, 2, 3])
+        value = [5, 6, 2, 7, 8]
+        self.assertFalse(buffer.update(
+            value, change(appended=1, mutated=[slice(0, 2), 3])))
+        np.testing.assert_array_equal(buffer.array, value)
+
+    def test_set(self):
+        buffer = DatasetBuffer(dtype=np.int64)
+        buffer.set([0, 1, 2, 3])
+        for value, value_change in [
+            ([4, 5], None),
+            ([6, 7, 8], change(replaced=True)),
+            # length inconsistent with the change
+            ([9, 10], change(appended=1)),
+            # index out of range
+            ([11, 12], change(mutated=[5])),
+        ]:
+            self.assertFalse(buffer.update(value, value_change))
+            np.testing.assert_array_equal(buffer.array, value)
+            self.assertEqual(buffer.array.dtype, np.int64)
+
+    def test_not_one_dimensional(self):
+        with self.assertRaises(ValueError):
+            DatasetBuffer().set([[1, 2], [3, 4]])
@@ -0,0 +1,170 @@
+import io
+import struct
+import random
+import unittest
+
+import numpy
+
+from artiq.coredevice.comm_analyzer import (
+    decode_dump, decode_message, get_message_time, DecodedMessages,
+    OutputMessage, InputMessage, ExceptionMessage, StoppedMessage,
+    WaveformManager, TTLHandler, DDSHandler, SPIMaster2Handler, LogHandler,
+    decoded_dump_to_vcd, merge_dumps)
+
+
+def make_dump(n, channels=(0, 1, 2, 3), endian="<", log_channel=3, seed=0):
+    rng = random.Random(seed)
+    messages = bytearray()
+    t = 1000
+    for _ in range(n):
+        message_type = rng.choice([0, 0, 0, 1, 2])
+        channel = rng.choice(channels)
+        t += rng.randint(0, 50)
+        if message_type == 2:
+            messages += struct.pack(">QIQQI", 0, 0b010100, t, 0,
+                                    channel << 2 | message_type)
+        else:
+            messages += struct.pack(">QIQQI", rng.getrandbits(32),
+                                    rng.randint(0, 1), t - rng.randint(0, 100),
+                                    t, channel << 2 | message_type)
+    messages += struct.pack(">QIQQI", 0, 0, t + 10, 0, 3)
+    header = struct.pack(endian + "IQbbb", len(messages), len(messages),
+                         0, log_channel, 0)
+    return (b"e" if endian == "<" else b"E") + header + bytes(messages)
+
+
+class DecodeDumpCase(unittest.TestCase):
+    def test_decode(self):
+        for endian in "<>":
+            dump = make_dump(1000, endian=endian)
+            decoded = decode_dump(dump)
+            self.assertEqual(decoded.log_channel, 3)
+            expected = [decode_message(dump[position:position+32])
+                        for position in range(16, len(dump), 32)]
+            self.assertEqual(list(decoded.messages), expected)
+            self.assertEqual(decoded.messages[-1], expected[-1])
+            numpy.testing.assert_array_equal(
+                decoded.messages.time,
+                [get_message_time(message) for message in expected])
+
+    def test_columns(self):
+        messages = decode_dump(make_dump(100)).messages
+        self.assertIsInstance(messages[:-1], DecodedMessages)
+        self.assertEqual(list(messages[:-1]), list(messages)[:-1])
+
+        outputs = messages[messages.message_type == 0]
+        self.assertTrue(all(isinstance(message, OutputMessage)
+                            for message in outputs))
+        self.assertEqual(
+            [message for message in messages
+             if isinstance(message, OutputMessage)],
+            list(outputs))
+        self.assertTrue(all(isinstance(message, (InputMessage, ExceptionMessage))
+                            for message in messages[messages.message_type % 3 != 0]))
+        self.assertIsInstance(messages[len(messages) - 1], StoppedMessage)
+
+    def test_merge(self):
+        dumps = [make_dump(100, seed=i) for i in range(3)]
+        merged = decode_dump(merge_dumps(dumps))
+        expected = []
+        for dump in dumps:
+            expected += list(decode_dump(dump).messages)[:-1]
+        expected.append(decode_dump(dumps[-1]).messages[-1])
+        self.assertEqual(list(merged.messages), expected)
+
+        merged = decode_dump(merge_dumps(dumps, max_payload_length=50*32))
+        self.assertEqual(list(merged.messages), expected[-50:])
+
+    def test_invalid(self):
+        dump = bytearray(make_dump(10))
+        with self.assertRaises(ValueError):
+            decode_dump(dump[:-1])
+        struct.pack_into(">QIQQI", dump, 16, 0, 0b111111, 0, 0, 2)
+        with self.assertRaises(ValueError):
+            decode_dump(dump)
+
+
+def make_channel_messages(handler, rng, n):
+    messages = []
+    t = 1000
+    log = "".join("ch{}\x1Elog message {}\x1D".format(i % 2, i)
+                  for i in range(n)).encode()
+    for i in range(n):
+        t += rng.randint(0, 20)
+        if handler == "ttl":
+            if rng.random() < 0.2:
+                messages.append(InputMessage(0, t, t, rng.randint(0, 1)))
+            else:
+                messages.append(OutputMessage(0, t, t, rng.choice([0, 0, 1]),
+                                              rng.randint(0, 1)))
+        elif handler == "dds":
+            address = rng.choice([0x81, 0x11, 0x13, 0x31, 0x80])
+            data = rng.randint(0, 3) if address == 0x81 else rng.getrandbits(16)
+            messages.append(OutputMessage(0, t, t, address, data))
+        elif handler == "spi":
+            if rng.random() < 0.3:
+                messages.append(InputMessage(0, t, t + rng.randint(0, 40),
+                                             rng.getrandbits(32)))
+            else:
+                messages.append(OutputMessage(0, t, t, rng.randint(0, 1),
+                                              rng.getrandbits(32)))
+        elif handler == "log":
+            word = log[4*i:4*i + 4].ljust(4, b"\0")
+            messages.append(OutputMessage(0, t, t, 0,
+                                          int.from_bytes(word, "big")))
+    return messages
+
+
+class WaveformDataCase(unittest.TestCase):
+    def create_handler(self, manager, handler):
+        if handler == "ttl":
+            return TTLHandler(manager, "ttl")
+        elif handler == "dds":
+            dds_handler = DDSHandler(manager, False, 3e9)
+            dds_handler.add_dds_channel("dds0", 0)
+            dds_handler.add_dds_channel("dds1", 1)
+            return dds_handler
+        elif handler == "spi":
+            return SPIMaster2Handler(manager, "spi")
+        elif handler == "log":
+            return LogHandler(manager, {"ch0": 20, "ch1": 20})
+
+    def test_process_messages(self):
+        rng = random.Random(0)
+        for handler in "ttl", "dds", "spi", "log":
+            messages = make_channel_messages(handler, rng, 500)
+
+            manager = WaveformManager()
+            channel_handler = self.create_handler(manager, handler)
+            for message in messages:
+                manager.set_time(get_message_time(message))
+                channel_handler.process_message(message)
+            manager.finish()
+            expected = manager.trace["data"]
+
+            manager = WaveformManager()
+            channel_handler = self.create_handler(manager, handler)
+            decoded = DecodedMessages.from_messages(messages)
+            channel_handler.process_messages(
+                decoded, decoded.time.astype(numpy.int64))
+            manager.finish()
+            data = manager.trace["data"]
+
+            self.assertEqual(list(data), list(expected))
+            for name, (times, values) in data.items():
+                expected_times, expected_values = expected[name]
+                self.assertEqual(times.tolist(), expected_times.tolist())
+                self.assertEqual(values.tolist(), expected_values.tolist())
+
+    def test_vcd(self):
+        devices = {
+            "ttl0": {"type": "local", "module": "artiq.coredevice.ttl",
+                     "class": "TTLOut", "arguments": {"channel": 0}}
+        }
+        dump = decode_dump(make_dump(100, log_channel=5))
+        f = io.StringIO()
+        decoded_dump_to_vcd(f, devices, dump)
+        times = [int(line[1:]) for line in f.getvalue().splitlines()
+                 if line.startswith("#")]
+        self.assertEqual(times, sorted(set(times)))
+        self.assertIn("$var wire 1 ! ttl/ttl0 $end", f.getvalue())
@@ -0,0 +1,271 @@
+import random
+import struct
+import threading
+import unittest
+from unittest import mock
+
+import numpy
+
+from artiq import __version__ as software_version
+from artiq.coredevice import exceptions
+from artiq.coredevice.comm_kernel import (CommKernel, Request,
+                                          RPCReturnValueError,
+                                          _AsyncRPCExecutor)
+
+
+class _FakeSocket:
+    """Socket returning the given data in chunks of at most ``chunk_size``
+    bytes, whatever the flags."""
+    def __init__(self, data, chunk_size):
+        self.data = memoryview(data)
+        self.chunk_size = chunk_size
+        self.sent = bytearray()
+
+    def recv_into(self, view, length, flags=0):
+        length = min(length, self.chunk_size, len(self.data))
+        view[:length] = self.data[:length]
+        self.data = self.data[length:]
+        return length
+
+    def sendall(self, data):
+        self.sent += data
+
+    def close(self):
+        pass
+
+
+def open_comm(data=b"", chunk_size=1 << 20, endian=b"e",
+              async_rpc_queue_size=0):
+    comm = CommKernel("::1", async_rpc_queue_size=async_rpc_queue_size)
+    socket = _FakeSocket(endian + data, chunk_size)
+    with mock.patch("artiq.coredevice.comm_kernel.create_connection",
+                    lambda host, port: socket):
+        comm.open()
+    return comm
+
+
+class ReadBufferCase(unittest.TestCase):
+    def test_reads(self):
+        rng = random.Random(0)
+        sizes = [rng.choice([1, 4, 8, 100, 4096, 65535, 65536, 65537, 200000])
+                 for _ in range(60)]
+        data = rng.randbytes(sum(sizes))
+        for chunk_size in 1000, 65536 + 7, 1 << 20:
+            comm = open_comm(data, chunk_size)
+            offset = 0
+            for i, size in enumerate(sizes):
+                expected = data[offset:offset + size]
+                if i % 2:
+                    received = comm._read(size)
+                else:
+                    received = comm._read_array(size, numpy.uint8).tobytes()
+                self.assertEqual(received, expected)
+                offset += size
+            with self.assertRaises(ConnectionResetError):
+                comm._read(1)
+
+    def test_read_buffer_reuse(self):
+        data = bytes(range(256)) * 1024
+        comm = open_comm(data, 100000)
+        first = comm._read(10)
+        comm._read(len(data) - 10)
+        self.assertEqual(first, data[:10])
+
+
+# struct formats of the elements of lists and arrays, by RPC tag
+_element_formats = {"b": "?", "i": "l", "I": "q", "f": "d"}
+
+
+def pack_elements(endian, tag, elements):
+    """Serialise elements one at a time, like the generic path."""
+    return b"".join(struct.pack(endian + _element_formats[tag], element)
+                    for element in elements)
+
+
+class RPCValueCase(unittest.TestCase):
+    lists = [
+        ("b", [True, False, True]),
+        ("i", [1, -2, 2**31 - 1, -2**31]),
+        ("i", [numpy.int32(5), 6, True]),
+        ("I", [2**40, -1, numpy.int64(-2**63), numpy.int32(7)]),
+        ("f", [1.5, -2.0, float("inf")]),
+        ("f", [1, numpy.float64(2.5), numpy.int32(3)]),
+        ("i", []),
+        ("I", []),
+        ("f", []),
+        ("f", list(numpy.linspace(0, 1, 10000))),
+    ]
+
+    arrays = [
+        ("b", numpy.array([[True, False], [False, True]])),
+        ("i", numpy.arange(-10, 10, dtype=numpy.int32)),
+        ("i", numpy.arange(12, dtype=numpy.int64).reshape(3, 4)),
+        ("I", numpy.arange(24).reshape(2, 3, 4) * 2**33),
+        ("f", numpy.linspace(0, 1, 12).reshape(4, 3)),
+        ("f", numpy.linspace(0, 1, 12).reshape(4, 3).T),
+        ("f", numpy.arange(20000, dtype=numpy.int32)),
+        ("f", numpy.empty((0, 3))),
+        ("i", numpy.empty(0, numpy.int32)),
+    ]
+
+    def send(self, endian, tags, value):
+        comm = open_comm(endian=b"e" if endian == "<" else b"E")
+        comm.socket.sent.clear()
+        index = comm._send_rpc_value(tags, 0, value, value, "f")
+        self.assertEqual(index, len(tags))
+        comm._flush()
+        return bytes(comm.socket.sent)
+
+    def receive(self, endian, data):
+        comm = open_comm(data, 1000, b"e" if endian == "<" else b"E")
+        return comm._receive_rpc_value(None)
+
+    def test_send_list(self):
+        for endian in "<>":
+            for tag, value in self.lists:
+                expected = (struct.pack(endian + "l", len(value))
+                            + pack_elements(endian, tag, value))
+                self.assertEqual(
+                    self.send(endian, ("l" + tag).encode(), value), expected)
+
+    def test_send_array(self):
+        for endian in "<>":
+            for tag, value in self.arrays:
+                tags = b"a" + bytes([value.ndim]) + tag.encode()
+                expected = b"".join(struct.pack(endian + "l", dim)
+                                    for dim in value.shape)
+                expected += pack_elements(endian, tag,
+                                          value.flatten(order="C").tolist())
+                self.assertEqual(self.send(endian, tags, value), expected)
+
+    def test_send_out_of_range(self):
+        for tags, value in [(b"li", [0, 2**31]),
+                            (b"lI", [2**63]),
+                            (b"li", [0, 1.5]),
+                            (b"a\x01i", numpy.array([-2**31 - 1])),
+                            (b"a\x01I", numpy.array([2**63], numpy.uint64))]:
+            with self.assertRaises(RPCReturnValueError):
+                self.send("<", tags, value)
+
+    def test_receive_list(self):
+        element_types = {"b": bool, "i": int, "I": numpy.int64, "f": float}
+        for endian in "<>":
+            for tag, value in self.lists:
+                data = (b"l" + struct.pack(endian + "l", len(value))
+                        + tag.encode() + pack_elements(endian, tag, value))
+                received = self.receive(endian, data)
+                self.assertEqual(received, value)
+                for element in received:
+                    self.assertIs(type(element), element_types[tag])
+
+    def test_receive_array(self):
+        dtypes = {"b": numpy.bool_, "i": numpy.int32, "I": numpy.int64,
+                  "f": numpy.float64}
+        for endian in "<>":
+            for tag, value in self.arrays:
+                data = (b"a" + bytes([value.ndim])
+                        + b"".join(struct.pack(endian + "l", dim)
+                                   for dim in value.shape)
+                        + tag.encode()
+                        + pack_elements(endian, tag,
+                                        value.flatten(order="C").tolist()))
+                received = self.receive(endian, data)
+                self.assertEqual(received.dtype.type, dtypes[tag])
+                self.assertEqual(received.shape, value.shape)
+                numpy.testing.assert_array_equal(received, value)
+
+
+class SystemInfoCase(unittest.TestCase):
+    def load(self, ident):
+        ident = ident.encode()
+        data = (b"\x5a"*4 + b"\x02AROR" + struct.pack("<l", len(ident))
+                + ident + b"\x01" + b"\x5a"*4 + b"\x05")
+        comm = open_comm(data)
+        comm.check_system_info()
+        comm.socket.sent.clear()
+        comm.load(b"library")
+        # request type following the synchronization sequence
+        return comm, Request(comm.socket.sent[4])
+
+    def test_resident_kernel(self):
+        comm, request = self.load(
+            software_version + ";kasli;capabilities=resident_kernel")
+        self.assertTrue(comm.resident_kernels)
+        self.assertEqual(request, Request.UploadResidentKernel)
+
+    def test_legacy_runtime(self):
+        for ident in software_version, software_version + ";kasli":
+            comm, request = self.load(ident)
+            self.assertFalse(comm.resident_kernels)
+            self.assertEqual(request, Request.LoadKernel)
+
+
+class AsyncRPCExecutorCase(unittest.TestCase):
+    def setUp(self):
+        self.executor = _AsyncRPCExecutor(4)
+        self.addCleanup(self.executor.close)
+
+    def test_order(self):
+        calls = []
+        for i in range(100):
+            self.executor.submit(calls.append, (i,), {})
+        self.assertIsNone(self.executor.wait())
+        self.assertEqual(calls, list(range(100)))
+        self.assertEqual(self.executor.stats["submitted"], 100)
+        self.assertLessEqual(self.executor.stats["max_pending"], 4)
+
+    def test_error(self):
+        calls = []
+        error = ValueError("first")
+
+        def fail(exn):
+            raise exn
+
+        self.executor.submit(calls.append, (0,), {})
+        self.executor.submit(fail, (error,), {})
+        self.executor.submit(fail, (ValueError("second"),), {})
+        self.executor.submit(calls.append, (1,), {})
+        self.assertIs(self.executor.wait(), error)
+        self.assertEqual(calls, [0])
+        # The error is only reported once, and later calls run again.
+        self.executor.submit(calls.append, (2,), {})
+        self.assertIsNone(self.executor.wait())
+        self.assertEqual(calls, [0, 2])
+
+    def test_close(self):
+        calls = []
+        release = threading.Event()
+        self.executor.submit(release.wait, (), {})
+        timer = threading.Timer(0.1, release.set)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        # The queue fills up while the first call is blocked.
+        for i in range(10):
+            self.executor.submit(calls.append, (i,), {})
+        self.assertGreater(self.executor.stats["blocked"], 0)
+        # Pending calls are executed before the thread stops.
+        self.executor.close()
+        self.assertEqual(calls, list(range(10)))
+        self.executor.close()
+        self.assertIsNone(self.executor.wait())
+
+
+class AsyncRPCServeCase(unittest.TestCase):
+    def serve(self, reply):
+        comm = open_comm(b"\x5a"*4 + reply, async_rpc_queue_size=4)
+        self.addCleanup(comm.close)
+
+        def fail():
+            raise ValueError("async")
+
+        comm.async_rpc_executor.submit(fail, (), {})
+        comm.serve(None, None, None)
+
+    def test_finished(self):
+        with self.assertRaisesRegex(ValueError, "async"):
+            self.serve(bytes([7, 0]))
+
+    def test_clock_failure(self):
+        with self.assertLogs("artiq.coredevice.comm_kernel", "ERROR"):
+            with self.assertRaises(exceptions.ClockFailure):
+                self.serve(bytes([15]))
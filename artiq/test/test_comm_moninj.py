@@ -0,0 +1,111 @@
+import asyncio
+import random
+import struct
+import unittest
+
+from artiq.coredevice.comm_moninj import CommMonInj
+
+
+def monitor_packet(channel, probe, value):
+    return struct.pack("<blbq", 0, channel, probe, value)
+
+
+def injection_packet(channel, override, value):
+    return struct.pack("<blbb", 1, channel, override, value)
+
+
+class ParseCase(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.disconnected = False
+
+        def disconnect_cb():
+            self.disconnected = True
+
+        self.comm = CommMonInj(
+            lambda *args: self.events.append(("monitor", ) + args),
+            lambda *args: self.events.append(("injection", ) + args),
+            disconnect_cb)
+
+    def packets(self, n):
+        rng = random.Random(0)
+        data = bytearray()
+        events = []
+        for _ in range(n):
+            channel = rng.randrange(2**31)
+            if rng.random() < 0.5:
+                probe, value = rng.randrange(128), rng.randrange(-2**63, 2**63)
+                data += monitor_packet(channel, probe, value)
+                events.append(("monitor", channel, probe, value))
+            else:
+                override, value = rng.randrange(3), rng.randrange(2)
+                data += injection_packet(channel, override, value)
+                events.append(("injection", channel, override, value))
+        return bytes(data), events
+
+    def test_complete(self):
+        data, events = self.packets(100)
+        self.assertEqual(self.comm._parse(bytearray(data)), len(data))
+        self.assertEqual(self.events, events)
+
+    def test_partial(self):
+        data = monitor_packet(3, 0, 1) + injection_packet(4, 1, 0)
+        for end in range(len(data)):
+            self.events.clear()
+            position = self.comm._parse(bytearray(data[:end]))
+            if end < 14:
+                self.assertEqual((position, self.events), (0, []))
+            else:
+                self.assertEqual(position, 14)
+                self.assertEqual(self.events, [("monitor", 3, 0, 1)])
+
+    def test_unknown_type(self):
+        with self.assertRaises(ValueError):
+            self.comm._parse(bytearray(monitor_packet(3, 0, 1) + b"\x07"))
+        # The packets before it are processed.
+        self.assertEqual(self.events, [("monitor", 3, 0, 1)])
+
+    def receive(self, chunks):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        reader = asyncio.StreamReader(loop=loop)
+
+        async def feed():
+            for chunk in chunks:
+                reader.feed_data(chunk)
+                # let the receiver process the chunk on its own
+                for _ in range(3):
+                    await asyncio.sleep(0)
+            reader.feed_eof()
+
+        reads = []
+        parse = self.comm._parse
+
+        def counting_parse(buffer):
+            reads.append(len(buffer))
+            return parse(buffer)
+
+        self.comm._reader = reader
+        self.comm._parse = counting_parse
+
+        async def run():
+            await asyncio.gather(feed(), self.comm._receive_cr())
+        loop.run_until_complete(run())
+        return reads
+
+    def test_receive_split(self):
+        data, events = self.packets(1000)
+        rng = random.Random(1)
+        cuts = sorted(rng.sample(range(1, len(data)), 200))
+        reads = self.receive(
+            [data[i:j] for i, j in zip([0] + cuts, cuts + [len(data)])])
+        self.assertEqual(len(reads), len(cuts) + 1)
+        self.assertEqual(self.events, events)
+        self.assertTrue(self.disconnected)
+
+    def test_receive_unknown_type(self):
+        with self.assertLogs("artiq.coredevice.comm_moninj", "ERROR"):
+            self.receive([injection_packet(1, 0, 1), b"\xff",
+                          monitor_packet(3, 0, 1)])
+        self.assertEqual(self.events, [("injection", 1, 0, 1)])
+        self.assertTrue(self.disconnected)
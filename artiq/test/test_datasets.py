@@ -1,12 +1,20 @@
 """Tests for the (Env)Experiment-facing dataset interface."""
 
 import copy
+import os
+import shutil
 import unittest
+from tempfile import TemporaryDirectory
+from unittest import mock
 
+import h5py
+import numpy as np
 from sipyco.sync_struct import process_mod
 
 from artiq.experiment import EnvExperiment
-from artiq.master.worker_db import DatasetManager
+from artiq.master.databases import DatasetDB
+from artiq.master.worker_db import (DatasetManager, DatasetModBatch,
+                                    extend_slice)
 
 
 class MockDatasetDB:
@@ -132,3 +140,336 @@ class ExperimentDatasetCase(unittest.TestCase):
         self.assertEqual(self.dataset_db.get_metadata(KEY), {})
 
 
+
+
+class BatchedDatasetDB(MockDatasetDB):
+    def __init__(self):
+        MockDatasetDB.__init__(self)
+        self.batch = DatasetModBatch()
+
+    def update(self, mod):
+        self.batch.add(mod)
+
+    def flush(self):
+        for mod in self.batch.take():
+            MockDatasetDB.update(self, mod)
+
+
+class DatasetModBatchCase(unittest.TestCase):
+    def setUp(self):
+        self.dataset_db = BatchedDatasetDB()
+        self.dataset_mgr = DatasetManager(self.dataset_db)
+        self.exp = TestExperiment((None, self.dataset_mgr, None, None))
+
+    def test_append(self):
+        self.exp.set(KEY, [], broadcast=True)
+        self.dataset_db.flush()
+        self.dataset_db.data[KEY][1].append(-1)
+        for i in range(100):
+            self.exp.append(KEY, i)
+        self.assertEqual(len(self.dataset_db.batch.mods), 1)
+        self.dataset_db.flush()
+        self.assertEqual(self.dataset_db.get(KEY), [-1] + list(range(100)))
+
+    def test_set_then_append(self):
+        self.exp.set(KEY, [0], broadcast=True)
+        self.exp.append(KEY, 1)
+        self.exp.set("other", 0, broadcast=True)
+        self.exp.append(KEY, 2)
+        self.dataset_db.flush()
+        self.assertEqual(self.dataset_db.get(KEY), [0, 1, 2])
+        self.assertEqual(self.dataset_db.get("other"), 0)
+
+    def test_set_discards_previous_mods(self):
+        self.exp.set(KEY, [0], broadcast=True)
+        self.exp.append(KEY, 1)
+        self.exp.set(KEY, [2], broadcast=True)
+        self.assertEqual(len(self.dataset_db.batch.mods), 1)
+        self.dataset_db.flush()
+        self.assertEqual(self.dataset_db.get(KEY), [2])
+
+    def test_mutate(self):
+        self.exp.set(KEY, [0, 0], broadcast=True)
+        self.dataset_db.flush()
+        for i in range(10):
+            self.exp.mutate_dataset(KEY, 1, i)
+        self.assertEqual(len(self.dataset_db.batch.mods), 1)
+        self.exp.mutate_dataset(KEY, 0, 5)
+        self.dataset_db.flush()
+        self.assertEqual(self.dataset_db.get(KEY), [5, 9])
+
+    def test_mutate_slice(self):
+        self.exp.set(KEY, [0, 0, 0, 0], broadcast=True)
+        self.dataset_db.flush()
+        self.exp.mutate_dataset(KEY, (0, 2), [1, 2, 3])
+        self.exp.mutate_dataset(KEY, (0, 2), [4])
+        self.dataset_db.flush()
+        self.assertEqual(self.dataset_db.get(KEY), [4, 3, 0, 0])
+
+
+class _RecordingEnvironment:
+    """Wraps an LMDB environment to record the keys written."""
+    def __init__(self, env):
+        self.env = env
+        self.written = []
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+    def begin(self, **kwargs):
+        return _RecordingTransaction(self.env.begin(**kwargs), self.written)
+
+
+class _RecordingTransaction:
+    def __init__(self, txn, written):
+        self.txn = txn
+        self.written = written
+
+    def __getattr__(self, name):
+        return getattr(self.txn, name)
+
+    def __enter__(self):
+        self.txn.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self.txn.__exit__(*args)
+
+    def put(self, key, value):
+        self.written.append(key)
+        return self.txn.put(key, value)
+
+
+class DatasetDBCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.persist_file = os.path.join(self.tempdir.name, "dataset_db.mdb")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def reopen(self, dataset_db):
+        dataset_db.save()
+        dataset_db.close_db()
+        return DatasetDB(self.persist_file)
+
+    def test_persist(self):
+        dataset_db = DatasetDB(self.persist_file)
+        array = np.arange(100000, dtype=np.float64).reshape(1000, 100)
+        dataset_db.set("array", array, persist=True, metadata={"unit": "V"})
+        dataset_db.set("list", [1, 2, 3], persist=True)
+        dataset_db.set("volatile", 0)
+        dataset_db = self.reopen(dataset_db)
+        np.testing.assert_array_equal(dataset_db.get("array"), array)
+        self.assertEqual(dataset_db.get_metadata("array"), {"unit": "V"})
+        self.assertEqual(dataset_db.get("list"), [1, 2, 3])
+        self.assertEqual(set(dataset_db.data.raw_view.keys()), {"array", "list"})
+        dataset_db.close_db()
+
+    def test_update_array(self):
+        dataset_db = DatasetDB(self.persist_file)
+        array = np.zeros(100000)
+        dataset_db.set("array", array, persist=True)
+        dataset_db = self.reopen(dataset_db)
+
+        dataset_db.update({"action": "setitem", "path": ["array", 1],
+                           "key": 5, "value": 1.0})
+        array[5] = 1.0
+        dataset_db = self.reopen(dataset_db)
+        np.testing.assert_array_equal(dataset_db.get("array"), array)
+
+        array = np.append(array, np.ones(10))
+        dataset_db.set("array", array)
+        dataset_db = self.reopen(dataset_db)
+        np.testing.assert_array_equal(dataset_db.get("array"), array)
+
+        dataset_db.set("array", array[:10])
+        dataset_db = self.reopen(dataset_db)
+        np.testing.assert_array_equal(dataset_db.get("array"), array[:10])
+
+        dataset_db.delete("array")
+        dataset_db = self.reopen(dataset_db)
+        self.assertEqual(dataset_db.data.raw_view, dict())
+        with dataset_db.lmdb.begin() as txn:
+            self.assertEqual(txn.stat()["entries"], 0)
+        dataset_db.close_db()
+
+
+    def save_reopen(self, dataset_db, full):
+        """Save and reopen the database, checking whether the datasets were
+        written in full."""
+        with mock.patch.object(DatasetDB, "_put_array",
+                               wraps=dataset_db._put_array) as put_array:
+            dataset_db = self.reopen(dataset_db)
+        self.assertEqual(put_array.called, full)
+        return dataset_db
+
+    def entries(self, dataset_db):
+        with dataset_db.lmdb.begin() as txn:
+            return txn.stat()["entries"]
+
+    def test_update_list(self):
+        dataset_db = DatasetDB(self.persist_file)
+        values = [float(i) for i in range(10000)]
+        dataset_db.set("list", list(values), persist=True)
+        dataset_db = self.save_reopen(dataset_db, True)
+        # header and two chunks
+        self.assertEqual(self.entries(dataset_db), 3)
+        self.assertEqual(dataset_db.get("list"), values)
+        self.assertIs(type(dataset_db.get("list")[0]), float)
+
+        for mod in [
+            {"action": "append", "path": ["list", 1], "x": -1.0},
+            {"action": "setitem", "path": ["list", 1], "key": 3, "value": 0.5},
+            {"action": "setitem", "path": ["list", 1], "key": -1, "value": 2.5},
+            {"action": "setitem", "path": ["list", 1],
+             "key": extend_slice, "value": [1.0]*10000},
+            {"action": "setitem", "path": ["list", 1],
+             "key": slice(10, 11), "value": [7.0, 8.0]},
+            {"action": "setitem", "path": ["list", 2],
+             "key": "unit", "value": "V"},
+        ]:
+            dataset_db.update(mod)
+            process_mod({"list": [True, values, {}]}, mod)
+        dataset_db = self.save_reopen(dataset_db, False)
+        self.assertEqual(self.entries(dataset_db), 4)
+        self.assertEqual(dataset_db.get("list"), values)
+        self.assertEqual(dataset_db.get_metadata("list"), {"unit": "V"})
+
+        # elements of another type cannot be stored in chunks
+        dataset_db.update({"action": "append", "path": ["list", 1], "x": 1})
+        dataset_db = self.save_reopen(dataset_db, False)
+        self.assertEqual(self.entries(dataset_db), 1)
+        self.assertEqual(dataset_db.get("list"), values + [1])
+        self.assertIs(type(dataset_db.get("list")[-1]), int)
+
+        dataset_db.update({"action": "pop", "path": ["list", 1], "i": -1})
+        dataset_db = self.save_reopen(dataset_db, True)
+        self.assertEqual(self.entries(dataset_db), 4)
+        self.assertEqual(dataset_db.get("list"), values)
+        dataset_db.close_db()
+
+    def test_update_rows(self):
+        dataset_db = DatasetDB(self.persist_file)
+        array = np.zeros((1000, 20), np.int32)
+        dataset_db.set("array", array.copy(), persist=True)
+        dataset_db = self.reopen(dataset_db)
+
+        # 80000 bytes, 819.2 rows per chunk
+        for key, value, chunks in [(5, 1, 1), ((7, 3), 2, 1),
+                                   (slice(800, 900), 3, 2),
+                                   ((slice(None), 0), 4, 2)]:
+            dataset_db.update({"action": "setitem", "path": ["array", 1],
+                               "key": key, "value": value})
+            array[key] = value
+            dataset_db.lmdb = _RecordingEnvironment(dataset_db.lmdb)
+            dataset_db.save()
+            # header and chunks
+            self.assertEqual(len(dataset_db.lmdb.written), 1 + chunks)
+            dataset_db = self.save_reopen(dataset_db, False)
+            np.testing.assert_array_equal(dataset_db.get("array"), array)
+
+        # the dtype changes
+        dataset_db.update({"action": "setitem", "path": ["array", 1],
+                           "key": 0, "value": 0.5})
+        dataset_db.data.raw_view["array"] = (True, array.astype(float), {})
+        dataset_db = self.save_reopen(dataset_db, True)
+        self.assertEqual(dataset_db.get("array").dtype, float)
+        dataset_db.close_db()
+
+    def test_changed_rows(self):
+        dataset_db = DatasetDB(self.persist_file)
+        dataset_db.set("list", list(range(10)), persist=True)
+        dataset_db.save()
+        for mod, rows in [
+            ({"action": "append", "path": ["list", 1], "x": 10}, []),
+            ({"action": "setitem", "path": ["list", 1], "key": -2,
+              "value": 0}, [(9, 10)]),
+            ({"action": "setitem", "path": ["list", 1], "key": slice(2, 4),
+              "value": [0, 0]}, [(2, 4)]),
+            ({"action": "setitem", "path": ["list", 1], "key": slice(2, 4),
+              "value": [0]}, [(2, None)]),
+            ({"action": "setitem", "path": ["list", 1], "key": slice(None, None, 2),
+              "value": [0]*5}, [(0, None)]),
+            ({"action": "insert", "path": ["list", 1], "i": 0, "x": 0}, None),
+            ({"action": "setitem", "path": [], "key": "list",
+              "value": (True, [], {})}, None),
+        ]:
+            dataset_db.pending_keys.clear()
+            dataset_db.update(copy.deepcopy(mod))
+            self.assertEqual(dataset_db.pending_keys, {"list": rows})
+        dataset_db.close_db()
+
+
+class DatasetStreamingCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.filename = os.path.join(self.tempdir.name, "results.h5")
+        self.dataset_db = MockDatasetDB()
+        self.dataset_mgr = DatasetManager(self.dataset_db)
+        self.dataset_mgr.results_file_factory = lambda: h5py.File(self.filename, "w")
+        self.exp = TestExperiment((None, self.dataset_mgr, None, None))
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_stream(self):
+        self.exp.set("before", [1.0, 2.0])
+        self.exp.enable_dataset_streaming()
+        self.exp.set("array", np.zeros((4, 2)), unit="V")
+        self.exp.set("list", [])
+        self.exp.set("broadcast", [0], broadcast=True)
+        self.exp.set("scalar", 1)
+        for i in range(3000):
+            self.exp.append("before", float(i))
+            self.exp.append("list", i)
+            self.exp.append("broadcast", i)
+        self.exp.mutate_dataset("array", (1, 3), 1.0)
+        self.dataset_mgr.flush_stream()
+
+        # A copy of the file taken while the experiment runs is usable.
+        partial = os.path.join(self.tempdir.name, "partial.h5")
+        shutil.copy(self.filename, partial)
+        with h5py.File(partial, "r") as f:
+            self.assertEqual(len(f["datasets"]["list"]), 3000)
+            self.assertEqual(f["datasets"]["array"].attrs["unit"], "V")
+            self.assertNotIn("broadcast", f["datasets"])
+
+        self.assertEqual(self.exp.get("list"), list(range(3000)))
+        self.exp.append("list", 0.5)
+
+        with self.dataset_mgr.results_file as f:
+            self.dataset_mgr.write_hdf5(f)
+        with h5py.File(self.filename, "r") as f:
+            datasets = f["datasets"]
+            self.assertEqual(list(datasets["before"][()]),
+                             [1.0, 2.0] + [float(i) for i in range(3000)])
+            np.testing.assert_array_equal(datasets["array"][()],
+                                          [[0, 0], [1, 1], [1, 1], [0, 0]])
+            self.assertEqual(list(datasets["list"][()]),
+                             list(range(3000)) + [0.5])
+            self.assertEqual(list(datasets["broadcast"][()]), [0] + list(range(3000)))
+            self.assertEqual(datasets["scalar"][()], 1)
+
+    def check_mutate(self, value, index, element):
+        expected = copy.copy(value)
+        expected[index] = element
+        self.exp.enable_dataset_streaming()
+        self.exp.set("dataset", value)
+        self.exp.mutate_dataset("dataset", index, element)
+        np.testing.assert_array_equal(self.exp.get("dataset"), expected)
+        with self.dataset_mgr.results_file as f:
+            self.dataset_mgr.write_hdf5(f)
+        with h5py.File(self.filename, "r") as f:
+            np.testing.assert_array_equal(f["datasets"]["dataset"][()],
+                                          np.asarray(expected))
+
+    def test_mutate_list_type(self):
+        self.check_mutate([1, 2, 3], 0, 0.5)
+        self.assertEqual(self.exp.get("dataset"), [0.5, 2, 3])
+
+    def test_mutate_list_slice_type(self):
+        self.check_mutate([1, 2, 3], slice(1, 3), [0.5, 1.5])
+
+    def test_mutate_array_type(self):
+        self.check_mutate(np.array([1, 2, 3]), 0, 0.5)
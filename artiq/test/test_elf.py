@@ -0,0 +1,127 @@
+import os
+import ctypes
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from artiq.compiler import elf
+from artiq.compiler.targets import RV32GTarget
+
+
+_source = """
+int counter = 3;
+int bump(int x) { counter += x; return counter; }
+int (*bump_ptr)(int) = bump;
+int call(int x) { return bump_ptr(x) * 2; }
+"""
+
+
+def sections(data):
+    """Return the names of the sections of an ELF file, and a dictionary giving
+    the name of the section of each symbol of the symbol table."""
+    layout = elf._Layout(data)
+    header = layout.ehdr.unpack_from(data, 0)
+    e_shoff, e_shentsize, e_shnum, e_shstrndx = header[6], header[11], header[12], header[13]
+    headers = [elf._Section(layout.shdr.unpack_from(data, e_shoff + index*e_shentsize))
+               for index in range(e_shnum)]
+
+    def string(table, offset):
+        start = table.offset + offset
+        return data[start:data.index(b"\0", start)].decode()
+
+    names = [string(headers[e_shstrndx], section.name) for section in headers]
+    symbols = dict()
+    for section in headers:
+        if section.type != elf.SHT_SYMTAB:
+            continue
+        for offset in range(0, section.size, layout.sym.size):
+            fields = layout.sym.unpack_from(data, section.offset + offset)
+            shndx = fields[3] if layout.is64 else fields[5]
+            name = string(headers[section.link], fields[0])
+            if name and 0 < shndx < elf.SHN_LORESERVE:
+                symbols[name] = names[shndx]
+    return names, symbols
+
+
+@unittest.skipUnless(shutil.which("gcc"), "no C compiler")
+class StripDebugCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.source = os.path.join(self.tmpdir.name, "test.c")
+        with open(self.source, "w") as f:
+            f.write(_source)
+
+    def compile(self, output, *flags):
+        output = os.path.join(self.tmpdir.name, output)
+        try:
+            subprocess.run(["gcc", "-g", "-O1", *flags, self.source, "-o", output],
+                           check=True, capture_output=True)
+        except subprocess.CalledProcessError:
+            self.skipTest("gcc cannot compile with {}".format(" ".join(flags)))
+        with open(output, "rb") as f:
+            return f.read()
+
+    def check_stripped(self, data):
+        stripped = elf.strip_debug(data)
+        names, symbols = sections(data)
+        stripped_names, stripped_symbols = sections(stripped)
+        self.assertTrue(any(".debug" in name for name in names))
+        self.assertFalse(any(".debug" in name for name in stripped_names))
+        self.assertEqual(stripped_names,
+                         [name for name in names if ".debug" not in name])
+        self.assertEqual(stripped_symbols,
+                         {symbol: section for symbol, section in symbols.items()
+                          if ".debug" not in section})
+        self.assertEqual(stripped_symbols["bump"], ".text")
+        self.assertEqual(elf.strip_debug(stripped), stripped)
+        return stripped
+
+    def test_shared_object(self):
+        stripped = self.check_stripped(
+            self.compile("test.so", "-shared", "-fPIC"))
+        library_path = os.path.join(self.tmpdir.name, "stripped.so")
+        with open(library_path, "wb") as f:
+            f.write(stripped)
+        # Calling through the function pointer needs the dynamic relocations.
+        library = ctypes.CDLL(library_path)
+        self.assertEqual(library.call(2), 10)
+
+    def test_shared_object_32(self):
+        library = self.compile("test32.so", "-m32", "-shared", "-fPIC", "-nostdlib")
+        stripped = self.check_stripped(library)
+        if shutil.which("llvm-readelf"):
+            def relocations(data):
+                path = os.path.join(self.tmpdir.name, "readelf.so")
+                with open(path, "wb") as f:
+                    f.write(data)
+                return subprocess.run(
+                    ["llvm-readelf", "--relocations", "--dyn-syms", path],
+                    check=True, capture_output=True, text=True).stdout
+            self.assertEqual(relocations(stripped), relocations(library))
+
+    def test_relocatable(self):
+        # Object files have symbols referring to the debug sections, which
+        # are left to llvm-strip.
+        with self.assertRaises(elf.ELFError):
+            elf.strip_debug(self.compile("test.o", "-c"))
+
+    def test_invalid(self):
+        with self.assertRaises(elf.ELFError):
+            elf.strip_debug(b"not an ELF file")
+
+
+class DemangleCase(unittest.TestCase):
+    def test_unmangled(self):
+        target = RV32GTarget()
+        target.tool_cxxfilt = os.path.join(tempfile.gettempdir(), "nonexistent")
+        names = ["run", "__modinit__", "rpc_send"]
+        self.assertEqual(target.demangle(names), names)
+
+    @unittest.skipUnless(shutil.which(RV32GTarget.tool_cxxfilt), "no demangler")
+    def test_mangled(self):
+        target = RV32GTarget()
+        self.assertEqual(
+            target.demangle(["run", "_ZN3foo3barEv", "_RNvCs1234_3foo3bar"]),
+            ["run", "foo::bar()", "foo::bar"])
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from artiq.experiment import *
+from artiq.coredevice.core import Core
+from artiq.compiler.embedding import Stitcher
+from artiq.compiler.kernel_cache import KernelDigest, KernelCache
+from artiq.compiler.targets import RV32GTarget, CortexA9Target
+
+
+class _Kernel:
+    def __init__(self, core, x=1, a=None):
+        self.core = core
+        self.x = x
+        self.a = numpy.zeros(4) if a is None else a
+
+    @rpc
+    def report(self, x: TInt32):
+        pass
+
+    @kernel
+    def run(self):
+        self.a[0] = 1.0
+        self.report(self.x)
+
+
+class _DigestMixin:
+    def setUp(self):
+        self.core = Core({}, host=None, ref_period=1e-9)
+
+    def digest(self, obj, target=None, **params):
+        stitcher = Stitcher(core=self.core, dmgr={"core": self.core})
+        stitcher.stitch_call(obj.run, (), {})
+        stitcher.finalize()
+        if target is None:
+            target = RV32GTarget()
+        return KernelDigest(stitcher.typedtree, stitcher.embedding_map,
+                            target, **params)
+
+
+class KernelDigestCase(_DigestMixin, unittest.TestCase):
+    def test_stable(self):
+        digest = self.digest(_Kernel(self.core))
+        self.assertEqual(digest.hexdigest,
+                         self.digest(_Kernel(self.core)).hexdigest)
+        self.assertTrue(digest.cacheable())
+
+    def test_sensitivity(self):
+        digest = self.digest(_Kernel(self.core)).hexdigest
+        self.assertNotEqual(digest,
+                            self.digest(_Kernel(self.core, x=2)).hexdigest)
+        self.assertNotEqual(
+            digest, self.digest(_Kernel(self.core, a=numpy.ones(4))).hexdigest)
+        self.assertNotEqual(
+            digest, self.digest(_Kernel(self.core), CortexA9Target()).hexdigest)
+        self.assertNotEqual(
+            digest, self.digest(_Kernel(self.core), ref_period=1e-9).hexdigest)
+        self.assertNotEqual(
+            self.digest(_Kernel(self.core), ref_period=1e-9).hexdigest,
+            self.digest(_Kernel(self.core), ref_period=2e-9).hexdigest)
+
+
+class KernelCacheCase(_DigestMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def entries(self, cache):
+        return sorted(name for name in os.listdir(cache.path)
+                      if not name.startswith("."))
+
+    def test_put_get(self):
+        cache = KernelCache(self.tmpdir.name)
+        digest = self.digest(_Kernel(self.core))
+        self.assertIsNone(cache.get(digest))
+
+        digest.embedding_map.store_str("compiled")
+        cache.put(digest, b"library", b"stripped")
+        digest = self.digest(_Kernel(self.core))
+        self.assertEqual(cache.get(digest), (b"library", b"stripped"))
+        # The embedding map changes made by the compiler are replayed.
+        self.assertIn("compiled", digest.embedding_map.str_forward_map)
+
+        self.assertIsNone(cache.get(self.digest(_Kernel(self.core, x=2))))
+
+    def test_eviction(self):
+        # Large compared to the embedding map description stored with each
+        # library.
+        entry_size = 20000
+        cache = KernelCache(self.tmpdir.name, max_size=5*entry_size//2)
+        digests = [self.digest(_Kernel(self.core, x=x)) for x in range(3)]
+
+        for i, digest in enumerate(digests[:2]):
+            cache.put(digest, bytes(entry_size//2), bytes(entry_size//2))
+            os.utime(cache._entry_path(digest), (1000 + i, 1000 + i))
+        # Using the oldest entry makes it the most recently used.
+        self.assertIsNotNone(cache.get(self.digest(_Kernel(self.core, x=0))))
+
+        cache.put(digests[2], bytes(entry_size//2), bytes(entry_size//2))
+        self.assertEqual(self.entries(cache),
+                         sorted([digests[0].hexdigest, digests[2].hexdigest]))
@@ -0,0 +1,95 @@
+import asyncio
+import struct
+import unittest
+
+from artiq.frontend.aqctl_moninj_proxy import EventType, ProxyConnection
+
+
+class _FakeWriter:
+    def __init__(self):
+        self.writes = []
+
+    def get_extra_info(self, name):
+        return ("::1", 0)
+
+    def write(self, data):
+        self.writes.append(data)
+
+    async def drain(self):
+        pass
+
+
+def decode(data):
+    """Return the events sent to a client, in order."""
+    events = []
+    while data:
+        if data[0] == 0:
+            _, channel, probe, value = struct.unpack_from("<blbq", data)
+            events.append(((EventType.PROBE, channel, probe), value))
+            data = data[14:]
+        else:
+            _, channel, overrd, value = struct.unpack_from("<blbb", data)
+            events.append(((EventType.INJECTION, channel, overrd), value))
+            data = data[7:]
+    return events
+
+
+class ProxyConnectionCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+
+    def start(self, update_interval):
+        writer = _FakeWriter()
+        connection = ProxyConnection(None, None, writer, update_interval)
+        task = self.loop.create_task(connection._send_cr())
+
+        def stop():
+            task.cancel()
+            self.loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+        self.addCleanup(stop)
+        return connection, writer
+
+    def run_loop(self, duration=0.0):
+        self.loop.run_until_complete(asyncio.sleep(duration))
+
+    def test_coalesce(self):
+        connection, writer = self.start(0.0)
+        probe = (EventType.PROBE, 1, 0)
+        injection = (EventType.INJECTION, 2, 1)
+        for value in range(5):
+            connection.event_cb(probe, value)
+        connection.event_cb(injection, 1)
+        connection.event_cb(probe, -2**40)
+        self.run_loop()
+        self.assertEqual(len(writer.writes), 1)
+        self.assertEqual(decode(writer.writes[0]),
+                         [(probe, -2**40), (injection, 1)])
+        self.assertEqual((connection.sent, connection.dropped), (2, 5))
+
+    def test_discard(self):
+        connection, writer = self.start(0.0)
+        probe = (EventType.PROBE, 1, 0)
+        connection.event_cb(probe, 1)
+        connection.event_cb((EventType.PROBE, 1, 1), 2)
+        connection.discard_event(probe)
+        self.run_loop()
+        self.assertEqual(decode(b"".join(writer.writes)),
+                         [((EventType.PROBE, 1, 1), 2)])
+
+    def test_update_interval(self):
+        connection, writer = self.start(0.2)
+        probe = (EventType.PROBE, 1, 0)
+        connection.event_cb(probe, 0)
+        self.run_loop()
+        # Updates arriving during the interval are merged into one write at
+        # its end.
+        for value in range(1, 4):
+            connection.event_cb(probe, value)
+            self.run_loop()
+        self.assertEqual(len(writer.writes), 1)
+        self.run_loop(0.3)
+        self.assertEqual([decode(data) for data in writer.writes],
+                         [[(probe, 0)], [(probe, 3)]])
+        self.assertEqual((connection.sent, connection.dropped), (2, 2))
@@ -1,11 +1,15 @@
 import unittest
 import logging
 import asyncio
+import os
 import sys
-from time import time, sleep
+from time import time, sleep, perf_counter
+
+from sipyco.sync_struct import Notifier
 
 from artiq.experiment import *
-from artiq.master.scheduler import Scheduler
+from artiq.master.scheduler import (Scheduler, RunPool, RunStatus,
+                                    PrepareStage, RunStage, AnalyzeStage)
 
 
 class EmptyExperiment(EnvExperiment):
@@ -124,6 +128,34 @@ class SchedulerCase(unittest.TestCase):
         scheduler.notifier.publish = None
         loop.run_until_complete(scheduler.stop())
 
+    def test_worker_pool(self):
+        loop = self.loop
+        scheduler = Scheduler(_RIDCounter(0), dict(), None, None,
+                              worker_pool_size=2)
+        expid = _get_expid("EmptyExperiment")
+
+        expect = _get_basic_steps(0, expid) + _get_basic_steps(1, expid)
+        done = asyncio.Event()
+        expect_idx = 0
+        def notify(mod):
+            nonlocal expect_idx
+            self.assertEqual(mod, expect[expect_idx])
+            expect_idx += 1
+            if expect_idx >= len(expect):
+                done.set()
+        scheduler.notifier.publish = notify
+
+        scheduler.start(loop=loop)
+        # Let the pool start its idle workers.
+        loop.run_until_complete(asyncio.sleep(1))
+        scheduler.submit("main", expid, 0, None, False)
+        loop.run_until_complete(asyncio.sleep(0.5))
+        scheduler.submit("main", expid, 0, None, False)
+
+        loop.run_until_complete(done.wait())
+        scheduler.notifier.publish = None
+        loop.run_until_complete(scheduler.stop())
+
     def test_pending_priority(self):
         """Check due dates take precedence over priorities when waiting to
         prepare."""
@@ -174,15 +206,15 @@ class SchedulerCase(unittest.TestCase):
         loop = self.loop
 
         termination_ok = False
-        def check_termination(mod):
+        def check_termination(mods):
             nonlocal termination_ok
             self.assertEqual(
-                mod,
-                {"action": "setitem", "key": "termination_ok",
-                 "value": (False, True, {}), "path": []})
+                mods,
+                [{"action": "setitem", "key": "termination_ok",
+                  "value": (False, True, {}), "path": []}])
             termination_ok = True
         handlers = {
-            "update_dataset": check_termination
+            "update_dataset_batch": check_termination
         }
         scheduler = Scheduler(_RIDCounter(0), handlers, None, None)
 
@@ -317,3 +349,130 @@ class SchedulerCase(unittest.TestCase):
 
     def tearDown(self):
         self.loop.close()
+
+
+class _RunPoolMixin:
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.pool = RunPool(_RIDCounter(0), dict(), Notifier(dict()),
+                            None, None)
+        self.expid = _get_expid("EmptyExperiment")
+        self.stages = (PrepareStage(self.pool, None),
+                       RunStage(self.pool, None),
+                       AnalyzeStage(self.pool, None))
+
+    def submit(self, priority=0, due_date=None, flush=False):
+        rid = self.pool.submit(self.expid, priority, due_date, flush, "main")
+        return self.pool.runs[rid]
+
+    def delete(self, run):
+        self.loop.run_until_complete(self.pool.delete(run.rid))
+
+    def dispatch(self):
+        """Move the next run through the stages without workers, and delete
+        it."""
+        prepare, run_stage, analyze = self.stages
+        run = prepare._get_run()
+        run.status = RunStatus.preparing
+        run.status = RunStatus.prepare_done
+        self.assertIs(run_stage._get_run(), run)
+        run.status = RunStatus.running
+        run.status = RunStatus.run_done
+        self.assertIs(analyze._get_run(), run)
+        run.status = RunStatus.analyzing
+        run.status = RunStatus.deleting
+        self.delete(run)
+        return run
+
+    def tearDown(self):
+        self.loop.close()
+
+
+class RunPoolCase(_RunPoolMixin, unittest.TestCase):
+    def test_dispatch_order(self):
+        n = 1000
+        priorities = 8
+        for i in range(n):
+            self.submit(i % priorities)
+        order = [self.dispatch().rid for _ in range(n)]
+        self.assertIsNone(self.stages[0]._get_run())
+        self.assertEqual(self.pool.runs, dict())
+
+        expected = sorted(range(n), key=lambda rid: (-(rid % priorities), rid))
+        self.assertEqual(order, expected)
+
+    def test_due_date(self):
+        prepare = self.stages[0]
+        now = time()
+        later = self.submit(priority=1, due_date=now + 100)
+        due = self.submit(due_date=now - 1)
+        self.assertIs(prepare._get_run(), due)
+        self.delete(due)
+
+        wait = prepare._get_run()
+        self.assertIsInstance(wait, float)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 100)
+        self.assertIsNone(self.pool.top(RunStatus.pending))
+
+        self.assertIsNone(self.pool.next_due_date(now + 101))
+        self.assertIs(self.pool.top(RunStatus.pending), later)
+
+        # Deleted runs with a due date are dropped from the index.
+        deleted = self.submit(due_date=now + 50)
+        self.delete(deleted)
+        self.assertIsNone(self.pool.next_due_date(now))
+
+    def test_flush_blocking(self):
+        running = self.submit()
+        running.status = RunStatus.preparing
+        running.status = RunStatus.running
+
+        flush = self.submit(flush=True)
+        flush.status = RunStatus.flushing
+        self.assertTrue(self.pool.flush_blocked(flush))
+        lower = self.submit(priority=-1, flush=True)
+        self.assertTrue(self.pool.flush_blocked(lower))
+        higher = self.submit(priority=1, flush=True)
+        higher.status = RunStatus.flushing
+        self.assertFalse(self.pool.flush_blocked(higher))
+        # The flushing run of higher priority blocks the others as well.
+        running.status = RunStatus.deleting
+        self.assertTrue(self.pool.flush_blocked(flush))
+        self.delete(higher)
+        self.assertFalse(self.pool.flush_blocked(flush))
+        self.assertTrue(self.pool.flush_blocked(lower))
+
+        # Deleting a run that is not idle unblocks the flush.
+        self.delete(flush)
+        self.assertFalse(self.pool.flush_blocked(lower))
+
+        self.delete(running)
+        self.delete(lower)
+        self.assertEqual(self.pool._flush_blocking, dict())
+
+
+@unittest.skipUnless(os.getenv("ARTIQ_BENCHMARK"), "ARTIQ_BENCHMARK not set")
+class SchedulerBenchmark(_RunPoolMixin, unittest.TestCase):
+    def test_dispatch_latency(self):
+        n = 10000
+        priorities = 8
+        t0 = perf_counter()
+        for i in range(n):
+            self.submit(i % priorities)
+        submit_time = perf_counter() - t0
+
+        latencies = []
+        for _ in range(n):
+            t0 = perf_counter()
+            self.dispatch()
+            latencies.append(perf_counter() - t0)
+        self.assertEqual(self.pool.runs, dict())
+
+        latencies.sort()
+        print()
+        print("Submission of {} runs: {:.3f}s".format(n, submit_time))
+        print("Dispatch latency: mean {:.1f}us, median {:.1f}us, "
+              "max {:.1f}us".format(sum(latencies)/n*1e6,
+                                    latencies[n//2]*1e6, latencies[-1]*1e6))
@@ -0,0 +1,88 @@
+import io
+import sys
+import unittest
+import subprocess
+
+import numpy
+from sipyco import pyon
+
+from artiq.gui.shared_arrays import SharedArrays
+
+
+# Applets map the segments in their own process, with their own resource
+# tracker.
+_mapper_script = """
+import sys
+import numpy
+from sipyco import pyon
+from artiq.gui.shared_arrays import SharedArrayMapper
+
+mod, shared = pyon.decode(sys.stdin.read())
+mapper = SharedArrayMapper()
+mod = mapper.insert(mod, shared)
+for path, _, _, _ in shared:
+    array = mod
+    for key in path:
+        array = array[key]
+    assert not array.flags.writeable
+    numpy.save(sys.stdout.buffer, array)
+"""
+
+
+def map_in_applet(mod, shared):
+    """Return the arrays inserted into the mod by an applet process."""
+    output = subprocess.run([sys.executable, "-c", _mapper_script],
+                            input=pyon.encode((mod, shared)).encode(),
+                            capture_output=True, check=True).stdout
+    f = io.BytesIO(output)
+    return [numpy.load(f) for _ in shared]
+
+
+class SharedArraysCase(unittest.TestCase):
+    def setUp(self):
+        self.shared_arrays = SharedArrays()
+
+    def tearDown(self):
+        self.shared_arrays.close()
+
+    def send(self, mod):
+        self.shared_arrays.on_mod(mod)
+        return self.shared_arrays.extract(mod)
+
+    def test_init(self):
+        image = numpy.arange(256*256, dtype=numpy.int32).reshape(256, 256)
+        x = numpy.zeros(3)
+        struct = {"image": (False, image, {}), "x": (True, x, {})}
+        mod, shared = self.send({"action": "init", "struct": struct})
+        self.assertEqual(len(shared), 1)
+        self.assertIs(struct["image"][1], image)
+        self.assertIsNone(mod["struct"]["image"][1])
+        self.assertIs(mod["struct"]["x"][1], x)
+
+        received, = map_in_applet(mod, shared)
+        numpy.testing.assert_array_equal(received, image)
+
+    def test_versions(self):
+        image = numpy.ones((256, 256))
+        mod = {"action": "setitem", "path": [], "key": "image",
+               "value": (False, image, {})}
+        _, shared0 = self.send(mod)
+        # Other applets receiving the same value share the segment.
+        _, shared1 = self.send(mod)
+        self.assertEqual(shared0, shared1)
+        name = shared0[0][1]
+
+        self.shared_arrays.on_mod({"action": "setitem", "path": ["image", 1],
+                                   "key": 0, "value": 2.})
+        image[0] = 2.
+        mod, shared2 = self.send({"action": "init",
+                                  "struct": {"image": (False, image, {})}})
+        self.assertNotEqual(shared2[0][1], name)
+        received, = map_in_applet(mod, shared2)
+        numpy.testing.assert_array_equal(received, image)
+
+        # The retired segment is freed once both applets released it.
+        self.shared_arrays.release(name)
+        self.assertIn(name, self.shared_arrays._segments)
+        self.shared_arrays.release(name)
+        self.assertNotIn(name, self.shared_arrays._segments)
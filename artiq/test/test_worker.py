@@ -4,8 +4,11 @@ import asyncio
 import sys
 from time import sleep
 
+import numpy as np
+
 from artiq.experiment import *
 from artiq.master.worker import *
+from artiq.master.worker_ipc import encode_frame
 
 
 class SimpleExperiment(EnvExperiment):
@@ -52,6 +55,28 @@ class WatchdogTimeoutInBuild(EnvExperiment):
         pass
 
 
+class LargeDataset(EnvExperiment):
+    def build(self):
+        pass
+
+    def run(self):
+        self.set_dataset("large", np.arange(1000000, dtype=np.float64),
+                         broadcast=True, archive=False)
+
+
+class DatasetLoop(EnvExperiment):
+    def build(self):
+        pass
+
+    def run(self):
+        self.set_dataset("values", [], broadcast=True, archive=False)
+        i = 0
+        while True:
+            self.append_to_dataset("values", i)
+            i += 1
+            sleep(0.01)
+
+
 async def _call_worker(worker, expid):
     try:
         await worker.build(0, "main", None, expid, 0)
@@ -67,14 +92,14 @@ class WorkerCase(unittest.TestCase):
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
 
-    def _run_experiment(self, class_name):
+    def _run_experiment(self, class_name, handlers=dict()):
         expid = {
             "log_level": logging.WARNING,
             "file": sys.modules[__name__].__file__,
             "class_name": class_name,
             "arguments": dict()
         }
-        worker = Worker({})
+        worker = Worker(handlers)
         self.loop.run_until_complete(_call_worker(worker, expid))
 
     def test_simple_run(self):
@@ -99,5 +124,69 @@ class WorkerCase(unittest.TestCase):
         with self.assertRaises(WorkerWatchdogTimeout):
             self._run_experiment("WatchdogTimeoutInBuild")
 
+    def test_large_dataset(self):
+        mods = []
+        self._run_experiment("LargeDataset",
+                             {"update_dataset_batch": mods.extend})
+        self.assertEqual(len(mods), 1)
+        self.assertEqual(mods[0]["key"], "large")
+        persist, value, metadata = mods[0]["value"]
+        np.testing.assert_array_equal(value, np.arange(1000000, dtype=np.float64))
+
+    def test_close_with_pending_datasets(self):
+        batches = []
+        blocked = asyncio.Event()
+
+        async def update_batch(mods):
+            batches.append(mods)
+            if len(batches) > 1:
+                # The master stops answering while the worker waits for the
+                # reply to a batch.
+                blocked.set()
+                await asyncio.Future()
+
+        expid = {
+            "log_level": logging.WARNING,
+            "file": sys.modules[__name__].__file__,
+            "class_name": "DatasetLoop",
+            "arguments": dict()
+        }
+        worker = Worker({"update_dataset_batch": update_batch})
+
+        async def run():
+            await worker.build(0, "main", None, expid, 0)
+            await worker.prepare()
+            run_task = asyncio.ensure_future(worker.run())
+            await blocked.wait()
+            run_task.cancel()
+            await worker.close()
+
+        with self.assertLogs("artiq.master.worker", logging.DEBUG) as logs:
+            self.loop.run_until_complete(run())
+        self.assertTrue(any("worker exited on request" in line
+                            for line in logs.output))
+        # Appends made during the flush period were sent as one mod.
+        self.assertGreater(len(batches[1][-1]["value"]), 1)
+
+    def test_recv_timeout_in_frame(self):
+        worker = Worker()
+        worker.ipc = asyncio.StreamReader()
+        obj = {"action": "completed", "data": np.arange(1000)}
+        frame = b"".join(bytes(buffer) for buffer in encode_frame(obj))
+
+        async def recv(timeout):
+            async with worker.io_lock:
+                return await worker._recv(timeout)
+
+        worker.ipc.feed_data(frame[:len(frame)//2])
+        with self.assertRaises(WorkerTimeout):
+            self.loop.run_until_complete(recv(0.01))
+        # The interrupted frame is completed by the next read.
+        worker.ipc.feed_data(frame[len(frame)//2:] + frame)
+        for _ in range(2):
+            received = self.loop.run_until_complete(recv(1.0))
+            self.assertEqual(received["action"], "completed")
+            np.testing.assert_array_equal(received["data"], obj["data"])
+
     def tearDown(self):
         self.loop.close()